@@ -0,0 +1,64 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+"""
+Compares the per-call latency of one-off requests (new TCP/TLS connection per call) with the pooled session
+of the client.
+
+>>> python benchmarks/latency.py http://localhost:8080 --login dummy_login --pwd dummy_pwd --runs 100
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable, List
+
+import requests
+
+from pyrostorage.client import Client
+
+
+def _measure(fn: Callable[[], requests.Response], runs: int) -> List[float]:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn().raise_for_status()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _summary(name: str, timings: List[float]) -> None:
+    timings = sorted(timings)
+    print(
+        f"{name:<16} median: {1000 * statistics.median(timings):7.2f}ms "
+        f"p95: {1000 * timings[int(0.95 * (len(timings) - 1))]:7.2f}ms ({len(timings)} calls)"
+    )
+
+
+def main(args):
+    api_client = Client(args.api_url, args.login, args.pwd)
+    # Route with a tiny payload, so that the connection overhead dominates
+    route = api_client.routes["create-media"]
+    media_id = api_client.create_media().json()["id"]
+    url = f"{route}/{media_id}/"
+
+    _summary("one-off requests", _measure(lambda: requests.get(url, headers=api_client.headers), args.runs))
+    _summary("pooled session", _measure(lambda: api_client.session.get(url, headers=api_client.headers), args.runs))
+    api_client.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Pyro-storage client latency benchmark", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("api_url", type=str, help="URL of the API")
+    parser.add_argument("--login", type=str, required=True, help="login of an admin access")
+    parser.add_argument("--pwd", type=str, required=True, help="password of the access")
+    parser.add_argument("--runs", type=int, default=100, help="number of calls of each method")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
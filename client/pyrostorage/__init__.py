@@ -1,2 +1,3 @@
 from .version import __version__
 from .client import *
+from .async_client import *
@@ -0,0 +1,466 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+import asyncio
+import time
+from contextlib import ExitStack
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, BinaryIO, Dict, Optional, Sequence, Union
+from urllib.parse import urljoin
+
+from .client import RETRY_STATUSES, ROUTES
+from .exceptions import HTTPRequestException
+from .multipart import CHUNK_SIZE, FileData, MultipartStream, digest_file, gzip_file, open_file_data
+from .tokens import REFRESH_MARGIN, decode_expiry, token_cache
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None  # type: ignore[assignment]
+
+__all__ = ["AsyncClient"]
+
+# Methods that can safely be sent twice
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+
+class _AsyncBody:
+    """Body of a request, read by chunks in the executor (file reads would block the event loop), and from its start
+    on each send so that the request can be retried"""
+
+    def __init__(self, stream: MultipartStream) -> None:
+        self._stream = stream
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        self._stream.seek(0)
+        while True:
+            chunk = await loop.run_in_executor(None, self._stream.read, CHUNK_SIZE)
+            if len(chunk) == 0:
+                break
+            yield chunk
+
+
+class AsyncClient:
+    """Asynchronous client to interact with the PyroNear API, requires the `async` extra (`pip install
+    pyrostorage[async]`)
+
+    All the calls share the same connection pool, and at most `max_concurrency` requests are in flight at the same
+    time (others wait for a slot). Access tokens are handled as in :class:`pyrostorage.client.Client`, the first one
+    being retrieved on the first call.
+
+    Example::
+        >>> import asyncio
+        >>> from pyrostorage import AsyncClient
+        >>> async def upload(frames):
+        >>>     async with AsyncClient("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD") as api_client:
+        >>>         responses = await asyncio.gather(*[api_client.create_media() for _ in frames])
+        >>>         media_ids = [response.json()["id"] for response in responses]
+        >>>         await asyncio.gather(*[api_client.upload_media(*args) for args in zip(media_ids, frames)])
+        >>> asyncio.run(upload(frames))
+
+    Args:
+        api_url (str): url of the pyronear API
+        credentials_login (str): Login (e.g: username)
+        credentials_password (str): Password (e.g: 123456 (don't do this))
+        timeout (float): number of seconds to wait for the server to send data
+        max_concurrency (int): max number of requests in flight, and of connections kept alive
+        max_retries (int): max number of retries of a request
+        backoff_factor (float): the n-th retry is delayed by backoff_factor * 2 ** (n - 1) seconds
+        token_cache_path (str): if specified, JSON file where access tokens are persisted across runs
+    """
+
+    api: str
+    routes: Dict[str, str]
+    token: Optional[str]
+
+    def __init__(
+        self,
+        api_url: str,
+        credentials_login: str,
+        credentials_password: str,
+        timeout: float = 10.0,
+        max_concurrency: int = 32,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        token_cache_path: Optional[Union[str, Path]] = None,
+    ) -> None:
+        if httpx is None:
+            raise ImportError("the async client requires httpx, install it with `pip install pyrostorage[async]`")
+        self.api = api_url
+        # Prepend API url to each route
+        self.routes = {k: urljoin(self.api, v) for k, v in ROUTES.items()}
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.token_cache_path = token_cache_path
+        self._credentials = (credentials_login, credentials_password)
+        self.token = token_cache.get(self.api, credentials_login, credentials_password, token_cache_path)
+        self._token_expiry = None if self.token is None else decode_expiry(self.token)
+        # Connection errors are retried by the transport, temporary server errors by _send
+        self.session = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            transport=httpx.AsyncHTTPTransport(retries=max_retries),
+        )
+        # Created lazily to be bound to the running event loop
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._token_lock: Optional[asyncio.Lock] = None
+
+    async def close(self) -> None:
+        """Release the connections of the pool"""
+        await self.session.aclose()
+
+    async def __aenter__(self) -> "AsyncClient":
+        if self.token is None:
+            await self._renew_token(None)
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.close()
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"}
+
+    async def refresh_token(self, login: str, password: str) -> None:
+        token = await self._retrieve_token(login, password)
+        token_cache.set(self.api, login, password, token, self.token_cache_path)
+        self.token = token
+        self._token_expiry = decode_expiry(token)
+        self._credentials = (login, password)
+
+    async def _renew_token(self, prev_token: Optional[str]) -> None:
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        # Only one task logs in, the others pick up its token
+        async with self._token_lock:
+            if self.token != prev_token:
+                return
+            token = token_cache.get(self.api, *self._credentials, self.token_cache_path)
+            if token is not None and token != prev_token:
+                self.token = token
+                self._token_expiry = decode_expiry(token)
+            else:
+                await self.refresh_token(*self._credentials)
+
+    async def _retrieve_token(self, login: str, password: str) -> str:
+        response = await self._send(
+            "POST",
+            self.routes["token"],
+            data={"username": login, "password": password},
+            headers={"accept": "application/json"},
+        )
+        if response.status_code == 200:
+            return response.json()["access_token"]
+        else:
+            raise HTTPRequestException(response.status_code, response.text)
+
+    async def _send(self, method: str, url: str, **kwargs: Any) -> "httpx.Response":
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        num_retries = self.max_retries if method in IDEMPOTENT_METHODS else 0
+        async with self._semaphore:
+            for attempt in range(num_retries + 1):
+                response = await self.session.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUSES or attempt == num_retries:
+                    break
+                await asyncio.sleep(self.backoff_factor * 2**attempt)
+        return response
+
+    async def _request(
+        self, method: str, url: str, headers: Optional[Dict[str, str]] = None, **kwargs: Any
+    ) -> "httpx.Response":
+        # Log in on the first call, and renew the token before it expires
+        if self.token is None or (self._token_expiry is not None and self._token_expiry - time.time() < REFRESH_MARGIN):
+            await self._renew_token(self.token)
+        token = self.token
+        response = await self._send(method, url, headers={**self.headers, **(headers or {})}, **kwargs)
+        # The token was revoked or expired early (e.g. clock skew): log in again and retry once
+        if response.status_code == 401 and isinstance(token, str):
+            token_cache.discard(self.api, self._credentials[0], token)
+            await self._renew_token(token)
+            response = await self._send(method, url, headers={**self.headers, **(headers or {})}, **kwargs)
+        return response
+
+    async def _upload(
+        self, url: str, file_data: FileData, precheck_url: Optional[str] = None, compress: bool = False
+    ) -> "httpx.Response":
+        with open_file_data(file_data) as (file, filename):
+            # Skip the transfer if the server already stores this content
+            if isinstance(precheck_url, str):
+                # Hashing is CPU & disk bound, it would block the event loop
+                sha256, size = await asyncio.get_running_loop().run_in_executor(None, digest_file, file)
+                response = await self._request(
+                    "POST", precheck_url, json={"sha256": sha256, "size": size, "filename": filename}
+                )
+                if response.status_code != 204:
+                    return response
+            if compress:
+                with ExitStack() as stack:
+                    # Compression is CPU bound, it would block the event loop
+                    compressed: BinaryIO = await asyncio.get_running_loop().run_in_executor(
+                        None, stack.enter_context, gzip_file(file)
+                    )
+                    response = await self._send_file(url, compressed, filename, {"Content-Encoding": "gzip"})
+                # Send the raw content if the server doesn't support the encoding
+                if response.status_code != 415:
+                    return response
+            return await self._send_file(url, file, filename)
+
+    async def _send_file(
+        self, url: str, file: BinaryIO, filename: str, part_headers: Optional[Dict[str, str]] = None
+    ) -> "httpx.Response":
+        # Streamed from the current position of the file, with its length (cf. Client._send_file)
+        body = MultipartStream("file", file, filename, part_headers)
+        return await self._request(
+            "POST",
+            url,
+            headers={"Content-Type": body.content_type, "Content-Length": str(len(body))},
+            content=_AsyncBody(body),
+        )
+
+    async def create_media(
+        self, media_type: str = "image", device_id: Optional[int] = None, captured_at: Optional[datetime] = None
+    ) -> "httpx.Response":
+        """Create a media entry
+
+        Args:
+            media_type: the type of media ('image', or 'video')
+            device_id: ID of the camera that took the media
+            captured_at: capture time of the media (UTC)
+
+        Returns:
+            HTTP response containing the created media
+        """
+        payload: Dict[str, Any] = {"type": media_type}
+        if isinstance(device_id, int):
+            payload["device_id"] = device_id
+        if isinstance(captured_at, datetime):
+            payload["captured_at"] = captured_at.isoformat()
+
+        return await self._request("POST", self.routes["create-media"], json=payload)
+
+    async def upload_media(self, media_id: int, media_data: FileData, precheck: bool = False) -> "httpx.Response":
+        """Upload the media content
+
+        Args:
+            media_id: ID of the associated media entry
+            media_data: path to the file, binary file object (streamed from its current position), or byte data
+            precheck: whether to hash the file locally first, and skip the transfer if the server already stores it
+
+        Returns:
+            HTTP response containing the updated media
+        """
+
+        return await self._upload(
+            self.routes["upload-media"].format(media_id=media_id),
+            media_data,
+            self.routes["precheck-media"].format(media_id=media_id) if precheck else None,
+        )
+
+    async def precheck_media(self, media_id: int, sha256: str, size: int, filename: str) -> "httpx.Response":
+        """Link a media to already stored content, from the digest of a file (cf. `upload_media` with precheck)
+
+        Args:
+            media_id: ID of the associated media entry
+            sha256: hexadecimal SHA256 of the file
+            size: size of the file, in bytes
+            filename: name of the file, for its extension
+
+        Returns:
+            HTTP response containing the updated media, or without content (204) if the file has to be uploaded
+        """
+
+        return await self._request(
+            "POST",
+            self.routes["precheck-media"].format(media_id=media_id),
+            json={"sha256": sha256, "size": size, "filename": filename},
+        )
+
+    async def get_media_url(self, media_id: int) -> "httpx.Response":
+        """Get the image as a URL
+
+        Args:
+            media_id: the identifier of the media entry
+
+        Returns:
+            HTTP response containing the URL to the media content
+        """
+
+        return await self._request("GET", self.routes["get-media-url"].format(media_id=media_id))
+
+    async def get_media_urls(
+        self,
+        media_ids: Optional[Sequence[int]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        after_id: int = 0,
+        limit: int = 500,
+    ) -> "httpx.Response":
+        """Get the URLs of a batch of verified media, selected by ID or by filters (cf. Client.get_media_urls)
+
+        Args:
+            media_ids: the identifiers of the media entries (1000 at most)
+            filters: selection criteria (cf. Client.create_dataset)
+            after_id: only resolve media with a greater identifier (last one of the previous batch)
+            limit: max number of media (1000 at most)
+
+        Returns:
+            HTTP response containing the URL, content name and byte range (for packed media) of each media
+        """
+
+        payload = {
+            "ids": None if media_ids is None else list(media_ids),
+            "filters": filters or {},
+            "after_id": after_id,
+            "limit": limit,
+        }
+        return await self._request("POST", self.routes["get-media-urls"], json=payload)
+
+    async def get_media_thumbnail_url(self, media_id: int) -> "httpx.Response":
+        """Get the thumbnail of the media as a URL (available shortly after the upload)
+
+        Args:
+            media_id: the identifier of the media entry
+
+        Returns:
+            HTTP response containing the URL to the JPEG thumbnail
+        """
+
+        return await self._request("GET", self.routes["get-media-thumbnail-url"].format(media_id=media_id))
+
+    async def get_media_duplicates(self, media_id: int, max_distance: Optional[int] = None) -> "httpx.Response":
+        """Get the images that look the same as a media, closest first
+
+        Args:
+            media_id: the identifier of the media entry
+            max_distance: max Hamming distance between the perceptual hashes (server default if None)
+
+        Returns:
+            HTTP response containing the list of near-duplicates
+        """
+
+        params = None if max_distance is None else {"max_distance": max_distance}
+        return await self._request("GET", self.routes["get-media-duplicates"].format(media_id=media_id), params=params)
+
+    async def get_media_content(self, media_id: int) -> "httpx.Response":
+        """Get the content of the media (including media packed into shards)
+
+        Args:
+            media_id: the identifier of the media entry
+
+        Returns:
+            HTTP response containing the media content
+        """
+
+        return await self._request("GET", self.routes["get-media-content"].format(media_id=media_id))
+
+    async def list_shards(self) -> "httpx.Response":
+        """List the shards, tar archives packing small media files that can be streamed sequentially
+
+        Returns:
+            HTTP response containing the list of shards
+        """
+
+        return await self._request("GET", self.routes["list-shards"])
+
+    async def get_shard_url(self, shard_id: int) -> "httpx.Response":
+        """Get a shard as a URL
+
+        Args:
+            shard_id: the identifier of the shard
+
+        Returns:
+            HTTP response containing the URL to the tar archive
+        """
+
+        return await self._request("GET", self.routes["get-shard-url"].format(shard_id=shard_id))
+
+    async def create_dataset(
+        self,
+        name: str,
+        filters: Optional[Dict[str, Any]] = None,
+        include_annotations: bool = True,
+        limit: Optional[int] = None,
+    ) -> "httpx.Response":
+        """Freeze the verified media matching the filters (and their annotations) as a new version of a dataset
+
+        Args:
+            name: name of the dataset
+            filters: selection criteria (cf. Client.create_dataset)
+            include_annotations: whether the annotations of the selected media are part of the dataset
+            limit: max number of media
+
+        Returns:
+            HTTP response containing the dataset version
+        """
+
+        payload = {"name": name, "filters": filters or {}, "include_annotations": include_annotations, "limit": limit}
+        return await self._request("POST", self.routes["create-dataset"], json=payload)
+
+    async def get_dataset_manifest(self, dataset_id: int, after_id: int = 0, limit: int = 500) -> "httpx.Response":
+        """Get the files of a dataset version with temporary URLs, to download them in parallel
+
+        Args:
+            dataset_id: the identifier of the dataset version
+            after_id: the listing starts after this item (ID of the last item of the previous page)
+            limit: max number of files (at most 1000)
+
+        Returns:
+            HTTP response containing the name, URL and byte range (for packed media) of each file
+        """
+
+        return await self._request(
+            "GET",
+            self.routes["get-dataset-manifest"].format(dataset_id=dataset_id),
+            params={"after_id": after_id, "limit": limit},
+        )
+
+    async def create_annotation(self, media_id: int) -> "httpx.Response":
+        """Create an annotation entry
+
+        Args:
+            media_id: the identifier of the media entry
+
+        Returns:
+            HTTP response containing the created annotation
+        """
+
+        return await self._request("POST", self.routes["create-annotation"], json={"media_id": media_id})
+
+    async def upload_annotation(
+        self, annotation_id: int, annotation_data: FileData, precheck: bool = False, compress: bool = False
+    ) -> "httpx.Response":
+        """Upload the annotation content
+
+        Args:
+            annotation_id: ID of the associated annotation entry
+            annotation_data: path to the file, binary file object (streamed from its current position), or byte data
+            precheck: whether to hash the file locally first, and skip the transfer if the server already stores it
+            compress: whether to send and store the file gzip-compressed
+
+        Returns:
+            HTTP response containing the updated annotation
+        """
+
+        return await self._upload(
+            self.routes["upload-annotation"].format(annotation_id=annotation_id),
+            annotation_data,
+            self.routes["precheck-annotation"].format(annotation_id=annotation_id) if precheck else None,
+            compress,
+        )
+
+    async def get_annotation_url(self, annotation_id: int) -> "httpx.Response":
+        """Get the image as a URL
+
+        Args:
+            annotation_id: the identifier of the annotation entry
+
+        Returns:
+            HTTP response containing the URL to the annotation content
+        """
+
+        return await self._request("GET", self.routes["get-annotation-url"].format(annotation_id=annotation_id))
@@ -0,0 +1,67 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+"""
+Command line interface of the client
+
+>>> pyrostorage-upload path/to/my/folder --api-url http://localhost:8080 --workers 8
+"""
+
+import argparse
+import logging
+import os
+import sys
+from typing import List, Optional
+
+from .client import Client
+
+__all__ = ["main"]
+
+
+def parse_args(args: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Upload all the files of a folder to the Pyronear data curation API",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("directory", type=str, help="folder to upload")
+    parser.add_argument("--api-url", type=str, default=os.getenv("PYROSTORAGE_API_URL"), help="url of the API")
+    parser.add_argument("--login", type=str, default=os.getenv("PYROSTORAGE_LOGIN"), help="login of the API user")
+    parser.add_argument(
+        "--password",
+        type=str,
+        default=os.getenv("PYROSTORAGE_PASSWORD"),
+        help="password of the API user (preferably set through PYROSTORAGE_PASSWORD)",
+    )
+    parser.add_argument("--workers", type=int, default=8, help="number of parallel uploads")
+    parser.add_argument("--ext", type=str, nargs="+", default=None, help="only upload files with these extensions")
+    parser.add_argument("--manifest", type=str, default=None, help="path of the resume manifest")
+    parser.add_argument(
+        "--precheck", action="store_true", help="skip the transfer of files already stored by the server"
+    )
+    parsed = parser.parse_args(args)
+    for arg_name in ("api_url", "login", "password"):
+        if getattr(parsed, arg_name) is None:
+            parser.error(f"--{arg_name.replace('_', '-')} is required (or its PYROSTORAGE_ environment variable)")
+    return parsed
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parsed = parse_args(args)
+    logging.getLogger("pyrostorage").setLevel(logging.INFO)
+    extensions = None if parsed.ext is None else [ext if ext.startswith(".") else f".{ext}" for ext in parsed.ext]
+    with Client(parsed.api_url, parsed.login, parsed.password, pool_size=parsed.workers) as api_client:
+        stats = api_client.upload_directory(
+            parsed.directory, parsed.workers, extensions, parsed.manifest, parsed.precheck
+        )
+    print(
+        f"Uploaded {stats['uploaded']} files in {stats['duration']:.1f}s "
+        f"({stats['throughput'] / 1e6:.2f} MB/s), skipped {stats['skipped']}, failed {len(stats['failed'])}"
+    )
+    if len(stats["failed"]) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
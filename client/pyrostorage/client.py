@@ -3,68 +3,179 @@
 # This program is licensed under the Apache License 2.0.
 # See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
 
-import io
 import logging
-from typing import Dict
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Optional, Sequence, Union
 from urllib.parse import urljoin
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.models import Response
+from urllib3.util.retry import Retry
 
+from .downloader import download_media
 from .exceptions import HTTPRequestException
+from .multipart import FileData, MultipartStream, content_md5, digest_file, gzip_file, open_file_data
+from .tokens import REFRESH_MARGIN, decode_expiry, token_cache
+from .uploader import upload_directory
 
 __all__ = ["Client"]
 
 logging.basicConfig()
 
+# Temporary errors: rate limited, or server unavailable
+RETRY_STATUSES = [429, 502, 503, 504]
+
 ROUTES: Dict[str, str] = {
     "token": "/login/access-token",
     #################
     # MEDIA
     #################
     "create-media": "/media",
+    "precheck-media": "/media/{media_id}/precheck",
     "upload-media": "/media/{media_id}/upload",
+    "put-media-content": "/media/{media_id}/content",
     "get-media-url": "/media/{media_id}/url",
+    "get-media-urls": "/media/urls",
+    "get-media-thumbnail-url": "/media/{media_id}/thumbnail",
+    "get-media-duplicates": "/media/{media_id}/duplicates",
+    "get-media-content": "/media/{media_id}/content",
     #################
     # ANNOTATIONS
     #################
     "create-annotation": "/annotations",
+    "precheck-annotation": "/annotations/{annotation_id}/precheck",
     "upload-annotation": "/annotations/{annotation_id}/upload",
     "get-annotation-url": "/annotations/{annotation_id}/url",
+    #################
+    # SHARDS
+    #################
+    "list-shards": "/shards",
+    "get-shard-url": "/shards/{shard_id}/url",
+    #################
+    # DATASETS
+    #################
+    "create-dataset": "/datasets",
+    "get-dataset-manifest": "/datasets/{dataset_id}/manifest",
+    "get-dataset-archive": "/datasets/{dataset_id}/archive",
 }
 
 
 class Client:
     """Client class to interact with the PyroNear API
 
+    Connections are kept alive and reused across calls. Idempotent requests (GET, PUT, DELETE, ...) are retried
+    with an exponential backoff on connection errors and on temporary server errors.
+
+    Access tokens are shared by the clients of the process with the same credentials (and optionally persisted to
+    disk), renewed shortly before they expire, and renewed once if the API rejects them.
+
+    Example::
+        >>> from pyrostorage import client
+        >>> with client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD") as api_client:
+        >>>     response = api_client.create_media(media_type="image")
+
     Args:
         api_url (str): url of the pyronear API
         credentials_login (str): Login (e.g: username)
         credentials_password (str): Password (e.g: 123456 (don't do this))
+        timeout (float): number of seconds to wait for the server to send data
+        pool_size (int): max number of connections kept alive
+        max_retries (int): max number of retries of a request
+        backoff_factor (float): the n-th retry is delayed by backoff_factor * 2 ** (n - 1) seconds
+        token_cache_path (str): if specified, JSON file where access tokens are persisted across runs
     """
 
     api: str
     routes: Dict[str, str]
     token: str
-
-    def __init__(self, api_url: str, credentials_login: str, credentials_password: str) -> None:
+    session: requests.Session
+
+    def __init__(
+        self,
+        api_url: str,
+        credentials_login: str,
+        credentials_password: str,
+        timeout: float = 10.0,
+        pool_size: int = 10,
+        max_retries: int = 3,
+        backoff_factor: float = 0.5,
+        token_cache_path: Optional[Union[str, Path]] = None,
+    ) -> None:
         self.api = api_url
+        self.timeout = timeout
         # Prepend API url to each route
         self.routes = {k: urljoin(self.api, v) for k, v in ROUTES.items()}
-        self.refresh_token(credentials_login, credentials_password)
+        self.session = self._build_session(pool_size, max_retries, backoff_factor)
+        self.token_cache_path = token_cache_path
+        self._token_lock = threading.Lock()
+        # Reuse the token of another client (or of a previous run) to avoid logging in again
+        token = token_cache.get(self.api, credentials_login, credentials_password, token_cache_path)
+        if token is None:
+            self.refresh_token(credentials_login, credentials_password)
+        else:
+            self._set_token(token, credentials_login, credentials_password)
+
+    @staticmethod
+    def _build_session(pool_size: int, max_retries: int, backoff_factor: float) -> requests.Session:
+        # Non-idempotent methods (POST) are only retried if the connection couldn't be established
+        retries = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def close(self) -> None:
+        """Release the connections of the pool"""
+        self.session.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
 
     @property
     def headers(self) -> Dict[str, str]:
         return {"Authorization": f"Bearer {self.token}"}
 
+    def _set_token(self, token: str, login: str, password: str) -> None:
+        self.token = token
+        self._token_expiry = decode_expiry(token)
+        self._credentials = (login, password)
+
     def refresh_token(self, login: str, password: str) -> None:
-        self.token = self._retrieve_token(login, password)
+        token = self._retrieve_token(login, password)
+        token_cache.set(self.api, login, password, token, self.token_cache_path)
+        self._set_token(token, login, password)
+
+    def _renew_token(self, prev_token: str) -> None:
+        # Only one thread logs in, the others pick up its token
+        with self._token_lock:
+            if self.token != prev_token:
+                return
+            token = token_cache.get(self.api, *self._credentials, self.token_cache_path)
+            if token is not None and token != prev_token:
+                self._set_token(token, *self._credentials)
+            else:
+                self.refresh_token(*self._credentials)
 
     def _retrieve_token(self, login: str, password: str) -> str:
-        response = requests.post(
+        response = self.session.post(
             self.routes["token"],
             data=f"username={login}&password={password}",
             headers={"Content-Type": "application/x-www-form-urlencoded", "accept": "application/json"},
+            timeout=self.timeout,
         )
         if response.status_code == 200:
             return response.json()["access_token"]
@@ -72,46 +183,154 @@ class Client:
             # Anyone has a better suggestion?
             raise HTTPRequestException(response.status_code, response.text)
 
-    def create_media(self, media_type: str = "image") -> Response:
+    def _request(self, method: str, url: str, headers: Optional[Dict[str, str]] = None, **kwargs: Any) -> Response:
+        # Renew the token before it expires
+        if self._token_expiry is not None and self._token_expiry - time.time() < REFRESH_MARGIN:
+            self._renew_token(self.token)
+        token = self.token
+        # File bodies are sent from their current position, which the retry has to start from as well
+        data: Any = kwargs.get("data")
+        data_start = data.tell() if hasattr(data, "seek") else None
+        response = self.session.request(
+            method, url, headers={**self.headers, **(headers or {})}, timeout=self.timeout, **kwargs
+        )
+        # The token was revoked or expired early (e.g. clock skew): log in again and retry once
+        if response.status_code == 401:
+            token_cache.discard(self.api, self._credentials[0], token)
+            self._renew_token(token)
+            if data_start is not None:
+                data.seek(data_start)
+            response = self.session.request(
+                method, url, headers={**self.headers, **(headers or {})}, timeout=self.timeout, **kwargs
+            )
+        return response
+
+    def _upload(
+        self, url: str, file_data: FileData, precheck_url: Optional[str] = None, compress: bool = False
+    ) -> Response:
+        with open_file_data(file_data) as (file, filename):
+            # Skip the transfer if the server already stores this content
+            if isinstance(precheck_url, str):
+                sha256, size = digest_file(file)
+                response = self._request(
+                    "POST", precheck_url, json={"sha256": sha256, "size": size, "filename": filename}
+                )
+                if response.status_code != 204:
+                    return response
+            if compress:
+                with gzip_file(file) as compressed:
+                    response = self._send_file(url, compressed, filename, {"Content-Encoding": "gzip"})
+                # Send the raw content if the server doesn't support the encoding
+                if response.status_code != 415:
+                    return response
+            return self._send_file(url, file, filename)
+
+    def _send_file(
+        self, url: str, file: BinaryIO, filename: str, part_headers: Optional[Dict[str, str]] = None
+    ) -> Response:
+        # The body is read from the file while being sent, so that memory usage doesn't depend on the file size
+        body = MultipartStream("file", file, filename, part_headers)
+        return self._request("POST", url, headers={"Content-Type": body.content_type}, data=body)
+
+    def create_media(
+        self, media_type: str = "image", device_id: Optional[int] = None, captured_at: Optional[datetime] = None
+    ) -> Response:
         """Create a media entry
 
         Example::
             >>> from pyrostorage import client
             >>> api_client = client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD")
-            >>> response = api_client.create_media(media_type="image")
+            >>> response = api_client.create_media(media_type="image", device_id=1)
 
         Args:
             media_type: the type of media ('image', or 'video')
+            device_id: ID of the camera that took the media
+            captured_at: capture time of the media (UTC)
 
         Returns:
             HTTP response containing the created media
         """
+        payload: Dict[str, Any] = {"type": media_type}
+        if isinstance(device_id, int):
+            payload["device_id"] = device_id
+        if isinstance(captured_at, datetime):
+            payload["captured_at"] = captured_at.isoformat()
 
-        return requests.post(self.routes["create-media"], headers=self.headers, json={"type": media_type})
+        return self._request("POST", self.routes["create-media"], json=payload)
 
-    def upload_media(self, media_id: int, media_data: bytes) -> Response:
+    def upload_media(self, media_id: int, media_data: FileData, precheck: bool = False) -> Response:
         """Upload the media content
 
         Example::
             >>> from pyrostorage import client
             >>> api_client = client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD")
-            >>> with open("path/to/my/file.ext", "rb") as f: data = f.read()
-            >>> response = api_client.upload_media(media_id=1, media_data=data)
+            >>> response = api_client.upload_media(media_id=1, media_data="path/to/my/file.ext")
 
         Args:
             media_id: ID of the associated media entry
-            media_data: byte data
+            media_data: path to the file, binary file object (streamed from its current position), or byte data
+            precheck: whether to hash the file locally first, and skip the transfer if the server already stores it
 
         Returns:
             HTTP response containing the updated media
         """
 
-        return requests.post(
+        return self._upload(
             self.routes["upload-media"].format(media_id=media_id),
-            headers=self.headers,
-            files={"file": io.BytesIO(media_data)},
+            media_data,
+            self.routes["precheck-media"].format(media_id=media_id) if precheck else None,
+        )
+
+    def precheck_media(self, media_id: int, sha256: str, size: int, filename: str) -> Response:
+        """Link a media to already stored content, from the digest of a file (cf. `upload_media` with precheck)
+
+        Example::
+            >>> from pyrostorage import client
+            >>> api_client = client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD")
+            >>> response = api_client.precheck_media(media_id=1, sha256="9f86d08...", size=4, filename="file.jpg")
+
+        Args:
+            media_id: ID of the associated media entry
+            sha256: hexadecimal SHA256 of the file
+            size: size of the file, in bytes
+            filename: name of the file, for its extension
+
+        Returns:
+            HTTP response containing the updated media, or without content (204) if the file has to be uploaded
+        """
+
+        return self._request(
+            "POST",
+            self.routes["precheck-media"].format(media_id=media_id),
+            json={"sha256": sha256, "size": size, "filename": filename},
         )
 
+    def put_media_content(self, media_id: int, media_data: FileData) -> Response:
+        """Upload the media content as the raw request body, which the server streams to the bucket without
+        spooling it to disk
+
+        Example::
+            >>> from pyrostorage import client
+            >>> api_client = client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD")
+            >>> response = api_client.put_media_content(media_id=1, media_data="path/to/my/file.ext")
+
+        Args:
+            media_id: ID of the associated media entry
+            media_data: path to the file, binary file object (streamed from its current position), or byte data
+
+        Returns:
+            HTTP response containing the updated media
+        """
+
+        with open_file_data(media_data) as (file, filename):
+            return self._request(
+                "PUT",
+                self.routes["put-media-content"].format(media_id=media_id),
+                params={"filename": filename},
+                data=file,
+                headers={"Content-Type": "application/octet-stream", "Content-MD5": content_md5(file)},
+            )
+
     def get_media_url(self, media_id: int) -> Response:
         """Get the image as a URL
 
@@ -127,7 +346,199 @@ class Client:
             HTTP response containing the URL to the media content
         """
 
-        return requests.get(self.routes["get-media-url"].format(media_id=media_id), headers=self.headers)
+        return self._request("GET", self.routes["get-media-url"].format(media_id=media_id))
+
+    def get_media_urls(
+        self,
+        media_ids: Optional[Sequence[int]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        after_id: int = 0,
+        limit: int = 500,
+    ) -> Response:
+        """Get the URLs of a batch of verified media, selected by ID or by filters, in the order of the IDs
+
+        Example::
+            >>> from pyrostorage import client
+            >>> api_client = client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD")
+            >>> response = api_client.get_media_urls(filters={"type": "image", "min_width": 1280})
+
+        Args:
+            media_ids: the identifiers of the media entries (1000 at most)
+            filters: selection criteria (cf. create_dataset)
+            after_id: only resolve media with a greater identifier (last one of the previous batch)
+            limit: max number of media (1000 at most)
+
+        Returns:
+            HTTP response containing the URL, content name (SHA256 prefix & extension) and byte range (for packed
+            media) of each media
+        """
+
+        payload = {
+            "ids": None if media_ids is None else list(media_ids),
+            "filters": filters or {},
+            "after_id": after_id,
+            "limit": limit,
+        }
+        return self._request("POST", self.routes["get-media-urls"], json=payload)
+
+    def get_media_thumbnail_url(self, media_id: int) -> Response:
+        """Get the thumbnail of the media as a URL (available shortly after the upload)
+
+        Example::
+            >>> from pyrostorage import client
+            >>> api_client = client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD")
+            >>> response = api_client.get_media_thumbnail_url(1)
+
+        Args:
+            media_id: the identifier of the media entry
+
+        Returns:
+            HTTP response containing the URL to the JPEG thumbnail
+        """
+
+        return self._request("GET", self.routes["get-media-thumbnail-url"].format(media_id=media_id))
+
+    def get_media_duplicates(self, media_id: int, max_distance: Optional[int] = None) -> Response:
+        """Get the images that look the same as a media, closest first
+
+        Example::
+            >>> from pyrostorage import client
+            >>> api_client = client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD")
+            >>> response = api_client.get_media_duplicates(1, max_distance=4)
+
+        Args:
+            media_id: the identifier of the media entry
+            max_distance: max Hamming distance between the perceptual hashes (server default if None)
+
+        Returns:
+            HTTP response containing the list of near-duplicates
+        """
+
+        params = None if max_distance is None else {"max_distance": max_distance}
+        return self._request("GET", self.routes["get-media-duplicates"].format(media_id=media_id), params=params)
+
+    def get_media_content(self, media_id: int) -> Response:
+        """Get the content of the media, streamed by the API (including media packed into shards)
+
+        Example::
+            >>> from pyrostorage import client
+            >>> api_client = client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD")
+            >>> response = api_client.get_media_content(1)
+            >>> with open("frame.jpg", "wb") as f:
+            ...     for chunk in response.iter_content(1024 * 1024):
+            ...         f.write(chunk)
+
+        Args:
+            media_id: the identifier of the media entry
+
+        Returns:
+            HTTP response streaming the media content
+        """
+
+        return self._request("GET", self.routes["get-media-content"].format(media_id=media_id), stream=True)
+
+    def list_shards(self) -> Response:
+        """List the shards, tar archives packing small media files that can be streamed sequentially
+
+        Example::
+            >>> from pyrostorage import client
+            >>> api_client = client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD")
+            >>> response = api_client.list_shards()
+
+        Returns:
+            HTTP response containing the list of shards
+        """
+
+        return self._request("GET", self.routes["list-shards"])
+
+    def get_shard_url(self, shard_id: int) -> Response:
+        """Get a shard as a URL
+
+        Example::
+            >>> from pyrostorage import client
+            >>> api_client = client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD")
+            >>> response = api_client.get_shard_url(1)
+
+        Args:
+            shard_id: the identifier of the shard
+
+        Returns:
+            HTTP response containing the URL to the tar archive
+        """
+
+        return self._request("GET", self.routes["get-shard-url"].format(shard_id=shard_id))
+
+    def create_dataset(
+        self,
+        name: str,
+        filters: Optional[Dict[str, Any]] = None,
+        include_annotations: bool = True,
+        limit: Optional[int] = None,
+    ) -> Response:
+        """Freeze the verified media matching the filters (and their annotations) as a new version of a dataset
+
+        Example::
+            >>> from pyrostorage import client
+            >>> api_client = client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD")
+            >>> response = api_client.create_dataset("wildfire-frames", {"type": "image", "annotated": True})
+
+        Args:
+            name: name of the dataset
+            filters: selection criteria (type, content_type, min_width, min_height, min_size, max_size,
+                captured_after, captured_before, annotated)
+            include_annotations: whether the annotations of the selected media are part of the dataset
+            limit: max number of media
+
+        Returns:
+            HTTP response containing the dataset version
+        """
+
+        payload = {"name": name, "filters": filters or {}, "include_annotations": include_annotations, "limit": limit}
+        return self._request("POST", self.routes["create-dataset"], json=payload)
+
+    def get_dataset_manifest(self, dataset_id: int, after_id: int = 0, limit: int = 500) -> Response:
+        """Get the files of a dataset version with temporary URLs, to download them in parallel
+
+        Example::
+            >>> from pyrostorage import client
+            >>> api_client = client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD")
+            >>> response = api_client.get_dataset_manifest(1)
+            >>> next_page = api_client.get_dataset_manifest(1, after_id=response.json()[-1]["id"])
+
+        Args:
+            dataset_id: the identifier of the dataset version
+            after_id: the listing starts after this item (ID of the last item of the previous page)
+            limit: max number of files (at most 1000)
+
+        Returns:
+            HTTP response containing the name, URL and byte range (for packed media) of each file
+        """
+
+        return self._request(
+            "GET",
+            self.routes["get-dataset-manifest"].format(dataset_id=dataset_id),
+            params={"after_id": after_id, "limit": limit},
+        )
+
+    def get_dataset_archive(self, dataset_id: int) -> Response:
+        """Get the files of a dataset version as a tar archive, streamed by the API
+
+        Example::
+            >>> from pyrostorage import client
+            >>> api_client = client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD")
+            >>> response = api_client.get_dataset_archive(1)
+            >>> with open("dataset.tar", "wb") as f:
+            ...     for chunk in response.iter_content(1024 * 1024):
+            ...         f.write(chunk)
+
+        Args:
+            dataset_id: the identifier of the dataset version
+
+        Returns:
+            HTTP response streaming the archive
+        """
+
+        return self._request("GET", self.routes["get-dataset-archive"].format(dataset_id=dataset_id), stream=True)
 
     def create_annotation(self, media_id: int) -> Response:
         """Create an annotation entry
@@ -144,29 +555,34 @@ class Client:
             HTTP response containing the created annotation
         """
 
-        return requests.post(self.routes["create-annotation"], headers=self.headers, json={"media_id": media_id})
+        return self._request("POST", self.routes["create-annotation"], json={"media_id": media_id})
 
-    def upload_annotation(self, annotation_id: int, annotation_data: bytes) -> Response:
+    def upload_annotation(
+        self, annotation_id: int, annotation_data: FileData, precheck: bool = False, compress: bool = False
+    ) -> Response:
         """Upload the annotation content
 
         Example::
             >>> from pyrostorage import client
             >>> api_client = client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD")
-            >>> with open("path/to/my/file.ext", "rb") as f: data = f.read()
-            >>> response = api_client.upload_annotation(annotation_id=1, annotation_data=data)
+            >>> response = api_client.upload_annotation(annotation_id=1, annotation_data="path/to/my/file.ext")
 
         Args:
             annotation_id: ID of the associated annotation entry
-            annotation_data: byte data
+            annotation_data: path to the file, binary file object (streamed from its current position), or byte data
+            precheck: whether to hash the file locally first, and skip the transfer if the server already stores it
+            compress: whether to send and store the file gzip-compressed (it is decompressed transparently by HTTP
+                clients on download)
 
         Returns:
             HTTP response containing the updated annotation
         """
 
-        return requests.post(
+        return self._upload(
             self.routes["upload-annotation"].format(annotation_id=annotation_id),
-            headers=self.headers,
-            files={"file": io.BytesIO(annotation_data)},
+            annotation_data,
+            self.routes["precheck-annotation"].format(annotation_id=annotation_id) if precheck else None,
+            compress,
         )
 
     def get_annotation_url(self, annotation_id: int) -> Response:
@@ -184,4 +600,72 @@ class Client:
             HTTP response containing the URL to the annotation content
         """
 
-        return requests.get(self.routes["get-annotation-url"].format(annotation_id=annotation_id), headers=self.headers)
+        return self._request("GET", self.routes["get-annotation-url"].format(annotation_id=annotation_id))
+
+    def upload_directory(
+        self,
+        directory: Union[str, Path],
+        num_workers: int = 8,
+        extensions: Optional[Sequence[str]] = None,
+        manifest_path: Optional[Union[str, Path]] = None,
+        precheck: bool = False,
+    ) -> Dict[str, Any]:
+        """Upload all the files of a directory (recursively) as media entries
+
+        Files are hashed locally and sent by parallel workers. Each upload is recorded in a local manifest
+        (relative path -> media ID and SHA256), so that a rerun skips the files that were already uploaded and
+        resumes those that were interrupted. Files whose content changed since are uploaded as new media.
+
+        Example::
+            >>> from pyrostorage import client
+            >>> api_client = client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD", pool_size=8)
+            >>> stats = api_client.upload_directory("path/to/my/folder", num_workers=8, extensions=[".jpg"])
+
+        Args:
+            directory: path to the folder to upload
+            num_workers: number of files uploaded at the same time (should not exceed the pool size of the client)
+            extensions: if specified, only the files with those extensions are uploaded (e.g. [".jpg", ".mp4"])
+            manifest_path: location of the manifest, defaults to a hidden file in the folder
+            precheck: whether to skip the transfer of files already stored by the server
+
+        Returns:
+            the number of uploaded, skipped and failed files, the volume sent in bytes, the duration in seconds and the
+            throughput in bytes per second
+        """
+
+        return upload_directory(self, directory, num_workers, extensions, manifest_path, precheck)
+
+    def download(
+        self,
+        media_ids: Optional[Sequence[int]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        directory: Optional[Union[str, Path]] = None,
+        num_workers: int = 8,
+        cache_dir: Optional[Union[str, Path]] = None,
+        batch_size: int = 500,
+    ) -> Dict[str, Any]:
+        """Download the content of verified media, selected by ID or by filters
+
+        URLs are resolved by batches and the files are fetched from the bucket by parallel workers. Each file is checked
+        against the SHA256 prefix of its content name and stored in a local content-addressed cache: content that is
+        already cached is not downloaded again, and interrupted transfers are resumed with HTTP range requests.
+
+        Example::
+            >>> from pyrostorage import client
+            >>> api_client = client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD")
+            >>> stats = api_client.download(filters={"annotated": True}, directory="path/to/my/folder")
+
+        Args:
+            media_ids: the identifiers of the media entries (all the verified media matching the filters if None)
+            filters: selection criteria (cf. create_dataset)
+            directory: if specified, the files are exposed there as <media_id>.<extension> (hard links to the cache)
+            num_workers: number of files downloaded at the same time
+            cache_dir: location of the cache, defaults to ~/.cache/pyrostorage/content (or $PYROSTORAGE_CACHE_DIR)
+            batch_size: number of URLs resolved per request (1000 at most)
+
+        Returns:
+            the number of downloaded, cached and failed media, the volume received in bytes, the duration in seconds,
+            the throughput in bytes per second, and the path of each media file
+        """
+
+        return download_media(self, media_ids, filters, directory, num_workers, cache_dir, batch_size)
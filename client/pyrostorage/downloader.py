@@ -0,0 +1,194 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Union
+
+import requests
+
+from .exceptions import HTTPRequestException
+from .uploader import hash_file
+
+if TYPE_CHECKING:
+    from .client import Client
+
+__all__ = ["ContentCache", "download_media"]
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_CACHE_DIR = Path(os.getenv("PYROSTORAGE_CACHE_DIR", "~/.cache/pyrostorage")).expanduser().joinpath("content")
+# Interrupted transfers are resumed from where they stopped
+MAX_ATTEMPTS = 3
+
+
+class ContentCache:
+    """Local store of media content, indexed by content name (first 32 chars of the SHA256 & extension, as on the
+    bucket), so that identical content is only downloaded once across media, datasets and runs
+
+    Args:
+        root: folder of the cache
+    """
+
+    def __init__(self, root: Union[str, Path] = DEFAULT_CACHE_DIR) -> None:
+        self.root = Path(root)
+
+    def path(self, content_name: str) -> Path:
+        # Spread over subfolders to keep directories small
+        return self.root.joinpath(content_name[:2], content_name)
+
+    def partial_path(self, content_name: str) -> Path:
+        return self.root.joinpath(content_name[:2], f"{content_name}.part")
+
+    def get(self, content_name: str) -> Optional[Path]:
+        """Return the location of a content, None if it isn't cached"""
+        file_path = self.path(content_name)
+        return file_path if file_path.is_file() else None
+
+    @staticmethod
+    def verify(file_path: Path, content_name: str) -> bool:
+        """Check that a file matches the SHA256 prefix of its content name"""
+        return hash_file(file_path)[:32] == content_name.partition(".")[0]
+
+
+def _fetch_content(session: requests.Session, item: Dict[str, Any], cache: ContentCache, timeout: float) -> int:
+    """Download a content into the cache, resuming partial transfers, returns the number of bytes received"""
+    content_name = item["content_name"]
+    partial_path = cache.partial_path(content_name)
+    partial_path.parent.mkdir(parents=True, exist_ok=True)
+    # Packed media are a byte range of their shard
+    offset = item["offset"] or 0
+    size = item["size"] if item["offset"] is not None else item["size_bytes"]
+    received = 0
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        start = partial_path.stat().st_size if partial_path.is_file() else 0
+        if size is not None and start >= size:
+            break
+        headers = {}
+        if start > 0 or item["offset"] is not None:
+            headers["Range"] = f"bytes={offset + start}-{'' if size is None else offset + size - 1}"
+        try:
+            response = session.get(item["url"], headers=headers, stream=True, timeout=timeout)
+            try:
+                # The range was ignored: only the whole file is acceptable
+                if response.status_code == 200 and item["offset"] is None:
+                    start = 0
+                elif response.status_code != 206:
+                    raise HTTPRequestException(response.status_code, response.text)
+                with open(partial_path, "ab" if start > 0 else "wb") as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        received += len(chunk)
+            finally:
+                response.close()
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == MAX_ATTEMPTS:
+                raise
+            logger.info(f"Resuming the transfer of {content_name} after: {e!r}")
+
+    if not cache.verify(partial_path, content_name):
+        partial_path.unlink()
+        raise ValueError(f"Corrupted transfer of {content_name}: the content doesn't match its hash")
+    os.replace(partial_path, cache.path(content_name))
+    return received
+
+
+def _link(src: Path, dst: Path) -> None:
+    """Expose a cached content at another location, without copying it when possible"""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Other file system
+        shutil.copyfile(src, dst)
+
+
+def download_media(
+    api_client: "Client",
+    media_ids: Optional[Sequence[int]] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    directory: Optional[Union[str, Path]] = None,
+    num_workers: int = 8,
+    cache_dir: Optional[Union[str, Path]] = None,
+    batch_size: int = 500,
+    timeout: float = 60.0,
+) -> Dict[str, Any]:
+    """Download media content, cf. `Client.download`"""
+    if media_ids is not None and len(media_ids) == 0:
+        raise ValueError("media_ids should not be empty")
+    cache = ContentCache(cache_dir or DEFAULT_CACHE_DIR)
+    # Presigned URLs authenticate by themselves, they are fetched without the API headers
+    session = api_client._build_session(num_workers, 3, 0.5)
+    stats: Dict[str, Any] = {"downloaded": 0, "cached": 0, "failed": {}, "bytes": 0, "files": {}}
+    start_ts = time.perf_counter()
+    id_list: Optional[List[int]] = None if media_ids is None else list(media_ids)
+    batch_idx, after_id = 0, 0
+    with session, ThreadPoolExecutor(max_workers=num_workers) as executor:
+        while True:
+            # URLs are resolved batch by batch so that they don't expire before being used
+            if id_list is None:
+                response = api_client.get_media_urls(filters=filters, after_id=after_id, limit=batch_size)
+            else:
+                batch_ids = id_list[batch_idx * batch_size : (batch_idx + 1) * batch_size]
+                if len(batch_ids) == 0:
+                    break
+                response = api_client.get_media_urls(media_ids=batch_ids, filters=filters, limit=batch_size)
+            if response.status_code != 200:
+                raise HTTPRequestException(response.status_code, response.text)
+            items = response.json()
+            if id_list is not None:
+                resolved_ids = {item["media_id"] for item in items}
+                for media_id in batch_ids:
+                    if media_id not in resolved_ids:
+                        stats["failed"][media_id] = "No verified content"
+
+            # Identical content is only transferred once
+            to_fetch = {item["content_name"]: item for item in items if cache.get(item["content_name"]) is None}
+            futures = {
+                executor.submit(_fetch_content, session, item, cache, timeout): content_name
+                for content_name, item in to_fetch.items()
+            }
+            errors = {}
+            for future in as_completed(futures):
+                try:
+                    stats["bytes"] += future.result()
+                except Exception as e:
+                    errors[futures[future]] = repr(e)
+                    logger.warning(f"Download of {futures[future]} failed: {e!r}")
+
+            for item in items:
+                content_name = item["content_name"]
+                if content_name in errors:
+                    stats["failed"][item["media_id"]] = errors[content_name]
+                    continue
+                stats["downloaded" if content_name in to_fetch else "cached"] += 1
+                file_path = cache.path(content_name)
+                if directory is not None:
+                    file_path = Path(directory).joinpath(f"{item['media_id']}{Path(content_name).suffix}")
+                    _link(cache.path(content_name), file_path)
+                stats["files"][item["media_id"]] = file_path
+            logger.info(f"{len(stats['files'])} media downloaded, {len(stats['failed'])} failed")
+
+            if id_list is None:
+                if len(items) < batch_size:
+                    break
+                after_id = items[-1]["media_id"]
+            batch_idx += 1
+
+    stats["duration"] = time.perf_counter() - start_ts
+    stats["throughput"] = stats["bytes"] / stats["duration"] if stats["duration"] > 0 else 0.0
+    logger.info(
+        f"Downloaded {stats['downloaded']} files ({stats['bytes'] / 1e6:.1f} MB, "
+        f"{stats['throughput'] / 1e6:.2f} MB/s), found {stats['cached']} in cache, failed {len(stats['failed'])}"
+    )
+    return stats
@@ -0,0 +1,194 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+import base64
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+__all__ = ["FileData", "MultipartStream", "open_file_data", "digest_file", "content_md5", "gzip_file"]
+
+CHUNK_SIZE = 1024 * 1024
+# Compressed files are kept in memory up to this size, then spilled to disk
+SPOOL_SIZE = 16 * 1024 * 1024
+
+# Raw content, path to a file on disk, or binary file object
+FileData = Union[bytes, str, Path, BinaryIO]
+
+
+class MultipartStream(io.RawIOBase):
+    """Read-only stream of a multipart/form-data body holding a single file, read lazily from the file object
+
+    Its length is known upfront so that the request is sent with a Content-Length and without loading the file in
+    memory. It can be rewound, which allows the request to be sent again.
+
+    Args:
+        field_name: name of the form field
+        file: binary file object, read from its current position
+        filename: name of the file sent to the server
+        headers: additional headers of the file part
+    """
+
+    def __init__(
+        self, field_name: str, file: BinaryIO, filename: str, headers: Optional[Dict[str, str]] = None
+    ) -> None:
+        self.boundary = uuid.uuid4().hex
+        part_headers = {
+            "Content-Disposition": f'form-data; name="{field_name}"; filename="{filename}"',
+            "Content-Type": "application/octet-stream",
+            **(headers or {}),
+        }
+        header = (
+            f"--{self.boundary}\r\n" + "".join(f"{name}: {value}\r\n" for name, value in part_headers.items()) + "\r\n"
+        ).encode()
+        trailer = f"\r\n--{self.boundary}--\r\n".encode()
+        self._file = file
+        self._file_start = file.tell()
+        file_size = file.seek(0, os.SEEK_END)
+        file.seek(self._file_start)
+        # (segment, length)
+        self._segments: List[Tuple[Union[bytes, BinaryIO], int]] = [
+            (header, len(header)),
+            (file, file_size - self._file_start),
+            (trailer, len(trailer)),
+        ]
+        self._pos = 0
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return sum(length for _, length in self._segments)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += len(self)
+        self._pos = min(max(offset, 0), len(self))
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = len(self) - self._pos
+        chunks = []
+        seg_start = 0
+        for segment, length in self._segments:
+            seg_end = seg_start + length
+            if size > 0 and self._pos < seg_end:
+                offset = self._pos - seg_start
+                num_bytes = min(size, length - offset)
+                if isinstance(segment, bytes):
+                    chunk = segment[offset : offset + num_bytes]
+                else:
+                    segment.seek(self._file_start + offset)
+                    chunk = segment.read(num_bytes)
+                chunks.append(chunk)
+                self._pos += len(chunk)
+                size -= len(chunk)
+                # The file got shorter
+                if len(chunk) < num_bytes:
+                    break
+            seg_start = seg_end
+        return b"".join(chunks)
+
+    def readinto(self, buffer: bytearray) -> int:  # type: ignore[override]
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+@contextmanager
+def open_file_data(data: FileData) -> Iterator[Tuple[BinaryIO, str]]:
+    """Give access to file data as a binary file object, along with its file name
+
+    Args:
+        data: raw content, path to a file, or binary file object (not closed by this function)
+
+    Returns:
+        the file object and the file name
+    """
+    if isinstance(data, (str, Path)):
+        with open(data, "rb") as f:
+            yield f, Path(data).name
+    elif isinstance(data, (bytes, bytearray)):
+        yield io.BytesIO(data), "file"
+    else:
+        yield data, Path(getattr(data, "name", "file")).name
+
+
+def digest_file(file: BinaryIO) -> Tuple[str, int]:
+    """Compute the SHA256 and the size of a file from its current position, without loading it in memory (the
+    position is restored afterwards)
+
+    Args:
+        file: binary file object
+
+    Returns:
+        the hexadecimal SHA256 and the number of bytes
+    """
+    start = file.tell()
+    sha256 = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+        sha256.update(chunk)
+        size += len(chunk)
+    file.seek(start)
+    return sha256.hexdigest(), size
+
+
+def content_md5(file: BinaryIO) -> str:
+    """Compute the Content-MD5 header value (base64-encoded MD5, cf. RFC 1864) of a file from its current position,
+    which is restored afterwards
+
+    Args:
+        file: binary file object
+
+    Returns:
+        the base64-encoded MD5 digest
+    """
+    start = file.tell()
+    md5 = hashlib.md5()  # nosec B324
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+        md5.update(chunk)
+    file.seek(start)
+    return base64.b64encode(md5.digest()).decode()
+
+
+@contextmanager
+def gzip_file(file: BinaryIO) -> Iterator[BinaryIO]:
+    """Compress a file from its current position (which is restored afterwards) into a temporary file
+
+    Args:
+        file: binary file object
+
+    Returns:
+        the compressed file, rewound
+    """
+    start = file.tell()
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as compressed:
+        # Fixed mtime so that identical content is compressed identically
+        with gzip.GzipFile(fileobj=compressed, mode="wb", mtime=0) as gz:
+            shutil.copyfileobj(file, gz, CHUNK_SIZE)
+        file.seek(start)
+        compressed.seek(0)
+        yield compressed  # type: ignore[misc]
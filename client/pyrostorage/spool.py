@@ -0,0 +1,331 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Union
+
+import requests
+
+from .exceptions import HTTPRequestException
+from .multipart import CHUNK_SIZE, FileData, open_file_data
+
+if TYPE_CHECKING:
+    from .client import Client
+
+__all__ = ["UploadSpool", "SpoolFullError", "LinkDown"]
+
+logger = logging.getLogger(__name__)
+
+# Responses meaning that the API can't be reached right now (as opposed to a rejected upload)
+UNAVAILABLE_STATUSES = {408, 429, 502, 503, 504}
+# Uploads rejected this many times are dropped, the ones that failed this many times while the API was unreachable
+# are sent after the other queued files
+MAX_ATTEMPTS = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sha256 TEXT NOT NULL UNIQUE,
+    file_name TEXT NOT NULL,
+    media_type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    media_id INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sent (
+    sha256 TEXT PRIMARY KEY,
+    media_id INTEGER NOT NULL,
+    sent_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_sent_sent_at ON sent (sent_at);
+"""
+
+
+class SpoolFullError(Exception):
+    pass
+
+
+class LinkDown(Exception):
+    pass
+
+
+class UploadSpool:
+    """Durable on-disk queue of media uploads, for stations whose connection to the API is intermittent
+
+    Files are copied to the spool folder and recorded in a SQLite journal, so that they survive restarts. A background
+    thread pushes them to the API in the order they were enqueued, as soon as it can be reached. Content that is
+    already queued, or that was sent recently, is not queued again. When the link comes back, uploads start one at a
+    time and their parallelism grows as long as they succeed (and is cut on failure), so that a weak link isn't
+    saturated with concurrent requests.
+
+    Example::
+        >>> from pyrostorage import client
+        >>> from pyrostorage.spool import UploadSpool
+        >>> spool = UploadSpool(lambda: client.Client("http://pyro-storage.herokuapp.com", "MY_LOGIN", "MY_PWD"),
+        ...                     "/var/spool/pyrostorage", max_bytes=2 * 1024**3)
+        >>> spool.enqueue("path/to/frame.jpg")
+
+    Args:
+        api_client: client of the API, or a function creating it (so that the client can be set up once the API is
+            reachable, e.g. when the station starts offline)
+        directory: location of the spool
+        max_bytes: max disk usage of the queued files
+        drop_oldest: whether the oldest queued files are dropped when the spool is full, instead of refusing new ones
+        num_workers: max number of parallel uploads
+        retry_interval: seconds to wait before trying again when the API is unreachable (doubled up to 10 minutes)
+        dedup_window: seconds during which content that was sent is not queued again
+        start: whether to start the background drainer right away
+    """
+
+    def __init__(
+        self,
+        api_client: Union["Client", Callable[[], "Client"]],
+        directory: Union[str, Path],
+        max_bytes: int = 1024**3,
+        drop_oldest: bool = True,
+        num_workers: int = 4,
+        retry_interval: float = 30.0,
+        dedup_window: float = 7 * 24 * 3600,
+        start: bool = True,
+    ) -> None:
+        self._api_client = api_client
+        self.directory = Path(directory)
+        self.files_dir = self.directory.joinpath("files")
+        self.files_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.drop_oldest = drop_oldest
+        self.num_workers = num_workers
+        self.retry_interval = retry_interval
+        self.dedup_window = dedup_window
+        # Current parallelism of the uploads
+        self.concurrency = 1
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.directory.joinpath("spool.sqlite3"), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if start:
+            self.start()
+
+    @property
+    def api_client(self) -> "Client":
+        if callable(self._api_client):
+            self._api_client = self._api_client()
+        return self._api_client
+
+    def _query(self, sql: str, params: Any = ()) -> List[sqlite3.Row]:
+        with self._lock, self._conn:
+            return self._conn.execute(sql, params).fetchall()
+
+    def __len__(self) -> int:
+        return self._query("SELECT COUNT(*) FROM entries")[0][0]
+
+    @property
+    def size(self) -> int:
+        """Disk usage of the queued files, in bytes"""
+        return self._query("SELECT COALESCE(SUM(size), 0) FROM entries")[0][0]
+
+    def enqueue(self, file_data: FileData, media_type: str = "image") -> bool:
+        """Queue the upload of a media file, returns False if the same content is already queued or was sent recently
+
+        Args:
+            file_data: path to the file, binary file object (read from its current position), or byte data
+            media_type: the type of media ('image', or 'video')
+        """
+        with open_file_data(file_data) as (file, filename):
+            # Copied while hashing, the source may be removed as soon as it is queued
+            tmp_path = self.files_dir.joinpath(f".{threading.get_ident()}.tmp")
+            sha256, size = hashlib.sha256(), 0
+            with open(tmp_path, "wb") as f:
+                for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+        file_name = f"{sha256.hexdigest()}{Path(filename).suffix.lower()}"
+        try:
+            with self._lock, self._conn:
+                is_known = self._conn.execute(
+                    "SELECT 1 FROM entries WHERE sha256 = :sha256 UNION SELECT 1 FROM sent WHERE sha256 = :sha256",
+                    {"sha256": sha256.hexdigest()},
+                ).fetchone()
+                if is_known is not None:
+                    return False
+                dropped = self._make_room(size)
+                self._conn.execute(
+                    "INSERT INTO entries (sha256, file_name, media_type, size, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (sha256.hexdigest(), file_name, media_type, size, time.time()),
+                )
+                # The journal is committed after the file is in place
+                os.replace(tmp_path, self.files_dir.joinpath(file_name))
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        for dropped_name in dropped:
+            self.files_dir.joinpath(dropped_name).unlink(missing_ok=True)
+        self._wakeup.set()
+        return True
+
+    def _make_room(self, size: int) -> List[str]:
+        """Free disk space for a new file (within a transaction), returns the names of the files to delete"""
+        if size > self.max_bytes:
+            raise SpoolFullError(f"the file ({size} bytes) is larger than the spool ({self.max_bytes} bytes)")
+        used = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if used + size <= self.max_bytes:
+            return []
+        if not self.drop_oldest:
+            raise SpoolFullError(f"the spool is full ({used} bytes queued)")
+        dropped: List[str] = []
+        for row in self._conn.execute("SELECT id, file_name, size FROM entries ORDER BY id").fetchall():
+            if used + size <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM entries WHERE id = ?", (row["id"],))
+            dropped.append(row["file_name"])
+            used -= row["size"]
+        logger.warning(f"Spool full: dropped the {len(dropped)} oldest files")
+        return dropped
+
+    def _upload(self, entry: sqlite3.Row) -> None:
+        """Send a queued file, raises LinkDown if the API can't be reached"""
+        file_path = self.files_dir.joinpath(entry["file_name"])
+        try:
+            media_id = entry["media_id"]
+            # Resume with the entry created by a previous attempt
+            if media_id is None:
+                response = self.api_client.create_media(media_type=entry["media_type"])
+                if response.status_code != 201:
+                    raise HTTPRequestException(response.status_code, response.text)
+                media_id = response.json()["id"]
+                self._query("UPDATE entries SET media_id = ? WHERE id = ?", (media_id, entry["id"]))
+            response = self.api_client.upload_media(media_id, file_path, precheck=True)
+            if response.status_code != 200:
+                raise HTTPRequestException(response.status_code, response.text)
+        except Exception as e:
+            # Every failure is recorded, so that a file the API keeps failing on can't hold the queue
+            self._query(
+                "UPDATE entries SET attempts = attempts + 1, last_error = ? WHERE id = ?", (repr(e), entry["id"])
+            )
+            if isinstance(e, HTTPRequestException) and e.status_code == 404:
+                # The entry was removed on the API side
+                self._query("UPDATE entries SET media_id = NULL WHERE id = ?", (entry["id"],))
+            if isinstance(e, (requests.ConnectionError, requests.Timeout)) or (
+                isinstance(e, HTTPRequestException) and e.status_code in UNAVAILABLE_STATUSES
+            ):
+                raise LinkDown(repr(e))
+            if not file_path.is_file() or entry["attempts"] + 1 >= MAX_ATTEMPTS:
+                logger.error(f"Dropping '{entry['file_name']}' after {entry['attempts'] + 1} failed uploads: {e!r}")
+                self._remove(entry)
+            return
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE id = ?", (entry["id"],))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sent (sha256, media_id, sent_at) VALUES (?, ?, ?)",
+                (entry["sha256"], media_id, time.time()),
+            )
+        file_path.unlink(missing_ok=True)
+
+    def _remove(self, entry: sqlite3.Row) -> None:
+        self._query("DELETE FROM entries WHERE id = ?", (entry["id"],))
+        self.files_dir.joinpath(entry["file_name"]).unlink(missing_ok=True)
+
+    def drain_batch(self) -> int:
+        """Upload the oldest queued files, as many as the current parallelism allows, and adjust it
+
+        Returns:
+            the number of queued files that were processed
+
+        Raises:
+            LinkDown: if the API can't be reached
+        """
+        self._query("DELETE FROM sent WHERE sent_at < ?", (time.time() - self.dedup_window,))
+        # Files that kept failing are sent last
+        entries = self._query(
+            "SELECT * FROM entries ORDER BY attempts >= ?, id LIMIT ?", (MAX_ATTEMPTS, self.concurrency)
+        )
+        if len(entries) == 0:
+            return 0
+        try:
+            # Set up once for the batch, so that a failed login isn't held against the queued files
+            self.api_client
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise LinkDown(repr(e))
+        start_ts = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(entries)) as executor:
+            futures = [executor.submit(self._upload, entry) for entry in entries]
+        errors: List[BaseException] = [
+            error for error in (future.exception() for future in futures) if error is not None
+        ]
+        if len(errors) > 0:
+            # Additive increase, multiplicative decrease
+            self.concurrency = max(self.concurrency // 2, 1)
+            raise errors[0]
+        if len(entries) == self.concurrency:
+            self.concurrency = min(self.concurrency + 1, self.num_workers)
+        num_bytes = sum(entry["size"] for entry in entries)
+        duration = time.perf_counter() - start_ts
+        logger.info(
+            f"Sent {len(entries)} files ({num_bytes / 1e6:.2f} MB at {num_bytes / max(duration, 1e-6) / 1e6:.2f}"
+            f" MB/s), {len(self)} left"
+        )
+        return len(entries)
+
+    def drain(self) -> None:
+        """Upload all the queued files now, raises LinkDown if the API can't be reached"""
+        while self.drain_batch() > 0:
+            pass
+
+    def _run(self) -> None:
+        delay = self.retry_interval
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            try:
+                self.drain()
+                delay = self.retry_interval
+                self._wakeup.wait(self.retry_interval)
+            except LinkDown as e:
+                logger.info(f"API unreachable ({e}), {len(self)} files queued, next attempt in {delay:.0f}s")
+                self.concurrency = 1
+                self._stop.wait(delay)
+                delay = min(delay * 2, 600)
+            except Exception as e:
+                # e.g. the client couldn't log in
+                logger.warning(f"Spool drainer error: {e!r}")
+                self._stop.wait(delay)
+
+    def start(self) -> None:
+        """Start the background drainer"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="pyrostorage-spool", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Stop the background drainer, queued files are kept for the next run"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._conn.close()
+
+    def __enter__(self) -> "UploadSpool":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Number and volume of the queued files, and parallelism of the uploads"""
+        return {"queued": len(self), "bytes": self.size, "concurrency": self.concurrency}
@@ -0,0 +1,103 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+__all__ = ["TokenCache", "decode_expiry", "token_cache"]
+
+# Tokens are renewed when they have less than this number of seconds left
+REFRESH_MARGIN = 60
+
+# (token, expiration timestamp, credentials fingerprint)
+CacheEntry = Tuple[str, Optional[float], str]
+
+
+def decode_expiry(token: str) -> Optional[float]:
+    """Read the expiration timestamp of a JWT, without verifying its signature (only the server can)"""
+    try:
+        payload = token.split(".")[1]
+        # Restore the stripped base64 padding
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenCache:
+    """Access tokens indexed by API url and login, shared by all the clients of the process
+
+    Tokens can also be persisted to a JSON file (only readable by its owner), so that short-lived scripts don't log
+    in on each run. A token is only handed out to the credentials that obtained it: entries hold a salted
+    fingerprint of the password, never the password itself.
+    """
+
+    def __init__(self) -> None:
+        self._tokens: Dict[str, CacheEntry] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(api_url: str, login: str) -> str:
+        return f"{api_url}|{login}"
+
+    @staticmethod
+    def _fingerprint(key: str, password: str) -> str:
+        return hashlib.pbkdf2_hmac("sha256", password.encode(), key.encode(), 10000).hex()
+
+    @staticmethod
+    def _read_file(path: Path) -> Dict[str, CacheEntry]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return {key: (entry[0], entry[1], entry[2]) for key, entry in json.load(f).items()}
+        except (OSError, ValueError, TypeError, IndexError, AttributeError, KeyError):
+            return {}
+
+    def get(self, api_url: str, login: str, password: str, path: Optional[Union[str, Path]] = None) -> Optional[str]:
+        """Return a token of these credentials that is not about to expire, if any"""
+        key = self._key(api_url, login)
+        with self._lock:
+            entry = self._tokens.get(key)
+            if entry is None and path is not None:
+                entry = self._read_file(Path(path).expanduser()).get(key)
+                if entry is not None:
+                    self._tokens[key] = entry
+        if entry is None:
+            return None
+        token, expires_at, fingerprint = entry
+        if expires_at is not None and expires_at - time.time() < REFRESH_MARGIN:
+            return None
+        return token if fingerprint == self._fingerprint(key, password) else None
+
+    def set(self, api_url: str, login: str, password: str, token: str, path: Optional[Union[str, Path]] = None) -> None:
+        key = self._key(api_url, login)
+        with self._lock:
+            self._tokens[key] = (token, decode_expiry(token), self._fingerprint(key, password))
+            if path is not None:
+                path = Path(path).expanduser()
+                tokens = self._read_file(path)
+                tokens[key] = self._tokens[key]
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_name(f"{path.name}.tmp")
+                # Create with restricted permissions, then swap
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(tokens, f)
+                os.replace(tmp_path, path)
+
+    def discard(self, api_url: str, login: str, token: str) -> None:
+        """Forget a token rejected by the server, unless it was replaced in the meantime"""
+        key = self._key(api_url, login)
+        with self._lock:
+            if self._tokens.get(key, (None,))[0] == token:
+                del self._tokens[key]
+
+
+token_cache = TokenCache()
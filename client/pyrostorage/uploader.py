@@ -0,0 +1,178 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Union
+
+from .exceptions import HTTPRequestException
+from .multipart import digest_file
+
+if TYPE_CHECKING:
+    from .client import Client
+
+__all__ = ["UploadManifest", "upload_directory"]
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".pyrostorage_manifest.json"
+VIDEO_EXTENSIONS = {".mp4", ".avi", ".mov", ".mkv", ".webm"}
+
+
+def hash_file(file_path: Union[str, Path]) -> str:
+    """Compute the SHA256 of a file without loading it in memory"""
+    with open(file_path, "rb") as f:
+        return digest_file(f)[0]
+
+
+class UploadManifest:
+    """Local record of the files of a directory that were sent to the API, indexed by relative path
+
+    Updates are appended to a journal (one JSON record per line) next to the manifest, and merged into the JSON
+    manifest by `compact`, so that recording an upload doesn't rewrite the whole manifest.
+
+    Args:
+        path: location of the JSON manifest
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        self.journal_path = self.path.with_name(f"{self.path.name}.journal")
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if self.path.is_file():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        # Updates of an interrupted run
+        if self.journal_path.is_file():
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Truncated by the interruption
+                        break
+                    self.entries[record.pop("path")] = record
+        self._lock = threading.Lock()
+
+    def get(self, rel_path: str, sha256: str) -> Optional[Dict[str, Any]]:
+        """Return the record of a file, unless its content changed since"""
+        entry = self.entries.get(rel_path)
+        return entry if isinstance(entry, dict) and entry.get("sha256") == sha256 else None
+
+    def update(self, rel_path: str, media_id: int, sha256: str, uploaded: bool) -> None:
+        entry = {"media_id": media_id, "sha256": sha256, "uploaded": uploaded}
+        line = json.dumps({"path": rel_path, **entry})
+        with self._lock:
+            self.entries[rel_path] = entry
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(f"{line}\n")
+
+    def compact(self) -> None:
+        """Write all the records to the JSON manifest, and clear the journal"""
+        with self._lock:
+            # Write then swap, so that an interrupted run never leaves a truncated manifest
+            with open(self.tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=2)
+            os.replace(self.tmp_path, self.path)
+            self.journal_path.unlink(missing_ok=True)
+
+
+def _upload_file(
+    api_client: "Client", file_path: Path, rel_path: str, manifest: UploadManifest, precheck: bool = False
+) -> Optional[int]:
+    """Create and upload a single media, returns the number of bytes sent (None if it was already uploaded)"""
+    with open(file_path, "rb") as f:
+        sha256, size = digest_file(f)
+    entry = manifest.get(rel_path, sha256)
+    if entry is not None and entry["uploaded"]:
+        return None
+
+    # Resume from the entry created by a previous run
+    if entry is None:
+        media_type = "video" if file_path.suffix.lower() in VIDEO_EXTENSIONS else "image"
+        response = api_client.create_media(media_type=media_type)
+        if response.status_code != 201:
+            raise HTTPRequestException(response.status_code, response.text)
+        media_id = response.json()["id"]
+        manifest.update(rel_path, media_id, sha256, uploaded=False)
+    else:
+        media_id = entry["media_id"]
+
+    num_bytes = 0
+    if precheck:
+        # The digest is already known, the file isn't hashed again
+        response = api_client.precheck_media(media_id, sha256, size, file_path.name)
+    if not precheck or response.status_code == 204:
+        response = api_client.upload_media(media_id, file_path)
+        num_bytes = size
+    if response.status_code != 200:
+        raise HTTPRequestException(response.status_code, response.text)
+    manifest.update(rel_path, media_id, sha256, uploaded=True)
+    return num_bytes
+
+
+def upload_directory(
+    api_client: "Client",
+    directory: Union[str, Path],
+    num_workers: int = 8,
+    extensions: Optional[Sequence[str]] = None,
+    manifest_path: Optional[Union[str, Path]] = None,
+    precheck: bool = False,
+) -> Dict[str, Any]:
+    """Upload all the files of a directory as media, cf. `Client.upload_directory`"""
+    directory = Path(directory)
+    if not directory.is_dir():
+        raise FileNotFoundError(f"unable to access directory {directory}")
+    manifest = UploadManifest(manifest_path or directory.joinpath(MANIFEST_NAME))
+    suffixes = None if extensions is None else {ext.lower() for ext in extensions}
+    excluded = {manifest.path.resolve(), manifest.tmp_path.resolve(), manifest.journal_path.resolve()}
+    rel_paths: List[str] = sorted(
+        file_path.relative_to(directory).as_posix()
+        for file_path in directory.rglob("*")
+        if file_path.is_file()
+        and file_path.resolve() not in excluded
+        and (suffixes is None or file_path.suffix.lower() in suffixes)
+    )
+
+    stats: Dict[str, Any] = {"uploaded": 0, "skipped": 0, "failed": {}, "bytes": 0}
+    start_ts = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = {
+                executor.submit(
+                    _upload_file, api_client, directory.joinpath(rel_path), rel_path, manifest, precheck
+                ): rel_path
+                for rel_path in rel_paths
+            }
+            for idx, future in enumerate(as_completed(futures)):
+                rel_path = futures[future]
+                try:
+                    num_bytes = future.result()
+                except Exception as e:
+                    stats["failed"][rel_path] = repr(e)
+                    logger.warning(f"[{idx + 1}/{len(rel_paths)}] {rel_path} failed: {e!r}")
+                    continue
+                if num_bytes is None:
+                    stats["skipped"] += 1
+                else:
+                    stats["uploaded"] += 1
+                    stats["bytes"] += num_bytes
+                logger.info(f"[{idx + 1}/{len(rel_paths)}] {rel_path}")
+    finally:
+        manifest.compact()
+
+    stats["duration"] = time.perf_counter() - start_ts
+    stats["throughput"] = stats["bytes"] / stats["duration"] if stats["duration"] > 0 else 0.0
+    logger.info(
+        f"Uploaded {stats['uploaded']} files ({stats['bytes'] / 1e6:.1f} MB, {stats['throughput'] / 1e6:.2f} MB/s), "
+        f"skipped {stats['skipped']}, failed {len(stats['failed'])}"
+    )
+    return stats
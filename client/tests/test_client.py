@@ -1,3 +1,4 @@
+import asyncio
 import time
 from copy import deepcopy
 
@@ -5,6 +6,7 @@ import pytest
 from requests import ConnectionError
 
 from pyrostorage import client
+from pyrostorage.async_client import AsyncClient
 from pyrostorage.exceptions import HTTPRequestException
 
 
@@ -39,3 +41,31 @@ def test_client():
     time.sleep(1)
     api_client.refresh_token("dummy_login", "dummy_pwd")
     assert prev_headers != api_client.headers
+    api_client.close()
+
+
+def test_client_session():
+    with client.Client("http://localhost:8080", "dummy_login", "dummy_pwd", pool_size=2, max_retries=1) as api_client:
+        adapter = api_client.session.get_adapter(api_client.api)
+        assert adapter.max_retries.total == 1
+        # Connections are reused across calls
+        for _ in range(3):
+            _test_route_return(api_client.create_media(media_type="image"), dict, 201)
+        assert len(adapter.poolmanager.pools) == 1
+
+
+def test_async_client():
+    async def _run():
+        async with AsyncClient("http://localhost:8080", "dummy_login", "dummy_pwd", max_concurrency=4) as api:
+            # Requests are sent concurrently over the shared pool
+            responses = await asyncio.gather(*[api.create_media(media_type="image") for _ in range(8)])
+            media_ids = [_test_route_return(response, dict, 201)["id"] for response in responses]
+            assert len(set(media_ids)) == 8
+            _test_route_return(await api.create_annotation(media_id=media_ids[0]), dict, 201)
+
+        # Wrong credentials
+        with pytest.raises(HTTPRequestException):
+            async with AsyncClient("http://localhost:8080", "invalid_login", "invalid_pwd"):
+                pass
+
+    asyncio.run(_run())
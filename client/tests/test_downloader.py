@@ -0,0 +1,132 @@
+import hashlib
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from requests.models import Response
+
+from pyrostorage.client import Client
+from pyrostorage.downloader import ContentCache, download_media
+
+
+def _content_name(content, ext="jpg"):
+    return f"{hashlib.sha256(content).hexdigest()[:32]}.{ext}"
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    # Path -> content, and requested ranges
+    files = {}
+    requests = []
+
+    def do_GET(self):
+        content = self.files.get(self.path)
+        RangeHandler.requests.append((self.path, self.headers.get("Range")))
+        if content is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range") or "")
+        if match is None:
+            self.send_response(200)
+        else:
+            start, end = int(match.group(1)), int(match.group(2) or len(content) - 1)
+            content = content[start : end + 1]
+            self.send_response(206)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="function")
+def bucket_server():
+    RangeHandler.files = {}
+    RangeHandler.requests = []
+    server = HTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+class FakeClient:
+    _build_session = staticmethod(Client._build_session)
+
+    def __init__(self, items):
+        self.items = items
+        self.calls = []
+
+    def get_media_urls(self, media_ids=None, filters=None, after_id=0, limit=500):
+        self.calls.append((media_ids, after_id))
+        items = [
+            item
+            for item in self.items
+            if item["media_id"] > after_id and (media_ids is None or item["media_id"] in media_ids)
+        ]
+        response = Response()
+        response.status_code = 200
+        response._content = json.dumps(items[:limit]).encode()
+        return response
+
+
+def test_download_media(bucket_server, tmp_path):
+    first, second = b"first frame" * 100, b"second frame" * 50
+    # The second media is packed in a shard
+    shard = b"\x00" * 512 + second + b"\x00" * 100
+    RangeHandler.files = {"/media/first.jpg": first, "/shards/0.tar": shard}
+    items = [
+        {"media_id": 1, "content_name": _content_name(first), "size_bytes": len(first), "offset": None, "size": None},
+        {"media_id": 2, "content_name": _content_name(second), "size_bytes": None, "offset": 512, "size": len(second)},
+        # Same content as the first media
+        {"media_id": 3, "content_name": _content_name(first), "size_bytes": len(first), "offset": None, "size": None},
+        # Corrupted
+        {"media_id": 4, "content_name": _content_name(b"other"), "size_bytes": 11, "offset": None, "size": None},
+    ]
+    for item, path in zip(items, ["/media/first.jpg", "/shards/0.tar", "/media/first.jpg", "/media/first.jpg"]):
+        item["url"] = f"{bucket_server}{path}"
+    api_client = FakeClient(items)
+    cache = ContentCache(tmp_path.joinpath("cache"))
+
+    stats = download_media(
+        api_client, filters={}, directory=tmp_path.joinpath("out"), cache_dir=cache.root, batch_size=2
+    )
+    # Batches resolved one after the other
+    assert api_client.calls == [(None, 0), (None, 2), (None, 4)]
+    # The content of the third media was fetched with the first one
+    assert stats["downloaded"] == 2 and stats["cached"] == 1 and list(stats["failed"]) == [4]
+    assert stats["bytes"] == len(first) + len(second)
+    assert tmp_path.joinpath("out", "1.jpg").read_bytes() == first
+    assert tmp_path.joinpath("out", "2.jpg").read_bytes() == second
+    assert stats["files"][3] == tmp_path.joinpath("out", "3.jpg")
+    assert ("/shards/0.tar", f"bytes=512-{512 + len(second) - 1}") in RangeHandler.requests
+    # Corrupted content is not kept
+    assert cache.get(_content_name(b"other")) is None
+    assert not cache.partial_path(_content_name(b"other")).exists()
+
+    # Cached content is not transferred again
+    RangeHandler.requests = []
+    stats = download_media(api_client, media_ids=[1, 2, 5], cache_dir=cache.root)
+    assert stats["downloaded"] == 0 and stats["cached"] == 2 and list(stats["failed"]) == [5]
+    assert stats["files"][1] == cache.path(_content_name(first))
+    assert RangeHandler.requests == []
+
+
+def test_download_resume(bucket_server, tmp_path):
+    content = bytes(range(256)) * 40
+    RangeHandler.files = {"/media/file.jpg": content}
+    item = {"media_id": 1, "content_name": _content_name(content), "size_bytes": len(content), "offset": None}
+    item.update(size=None, url=f"{bucket_server}/media/file.jpg")
+    cache = ContentCache(tmp_path)
+    # Interrupted transfer
+    cache.partial_path(item["content_name"]).parent.mkdir(parents=True)
+    cache.partial_path(item["content_name"]).write_bytes(content[:1000])
+
+    stats = download_media(FakeClient([item]), media_ids=[1], cache_dir=tmp_path)
+    assert stats["downloaded"] == 1 and stats["bytes"] == len(content) - 1000
+    assert RangeHandler.requests == [("/media/file.jpg", f"bytes=1000-{len(content) - 1}")]
+    assert cache.get(item["content_name"]).read_bytes() == content
+    assert ContentCache.verify(cache.path(item["content_name"]), item["content_name"])
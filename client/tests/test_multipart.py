@@ -0,0 +1,73 @@
+import base64
+import gzip
+import hashlib
+import io
+from email.parser import BytesParser
+
+import pytest
+
+from pyrostorage.multipart import MultipartStream, content_md5, gzip_file, open_file_data
+
+
+def _parse(stream):
+    message = BytesParser().parsebytes(f"Content-Type: {stream.content_type}\r\n\r\n".encode() + stream.read())
+    return message.get_payload()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 8192, -1])
+def test_multipart_stream(tmp_path, chunk_size):
+    content = bytes(range(256)) * 100
+    file_path = tmp_path.joinpath("frame.jpg")
+    file_path.write_bytes(content)
+
+    with open_file_data(file_path) as (file, filename):
+        assert filename == "frame.jpg"
+        stream = MultipartStream("file", file, filename)
+        chunks = []
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            assert chunk_size < 0 or len(chunk) <= chunk_size
+            chunks.append(chunk)
+        body = b"".join(chunks)
+        assert len(body) == len(stream)
+        # Rewind
+        assert stream.seek(0) == 0
+        parts = _parse(stream)
+        assert len(parts) == 1
+        assert parts[0].get_param("name", header="content-disposition") == "file"
+        assert parts[0].get_filename() == "frame.jpg"
+        assert parts[0].get_payload(decode=True) == content
+        stream.seek(0)
+        assert stream.read() == body
+
+
+def test_open_file_data():
+    with open_file_data(b"data") as (file, filename):
+        assert file.read() == b"data" and filename == "file"
+
+    # File objects are read from their current position
+    buffer = io.BytesIO(b"headerdata")
+    buffer.seek(6)
+    with open_file_data(buffer) as (file, filename):
+        stream = MultipartStream("file", file, filename)
+        assert _parse(stream)[0].get_payload(decode=True) == b"data"
+    assert not buffer.closed
+
+
+def test_gzip_file():
+    content = b'{"label": "fire"}' * 1000
+    buffer = io.BytesIO(content)
+    with gzip_file(buffer) as compressed:
+        # The position of the source is restored
+        assert buffer.tell() == 0
+        stream = MultipartStream("file", compressed, "labels.json", {"Content-Encoding": "gzip"})
+        part = _parse(stream)[0]
+        assert part["Content-Encoding"] == "gzip"
+        assert gzip.decompress(part.get_payload(decode=True)) == content
+        assert len(stream) < len(content)
+
+
+def test_content_md5():
+    buffer = io.BytesIO(b"headerdata")
+    buffer.seek(6)
+    assert content_md5(buffer) == base64.b64encode(hashlib.md5(b"data").digest()).decode()
+    assert buffer.tell() == 6
@@ -0,0 +1,148 @@
+import json
+
+import pytest
+import requests
+from requests.models import Response
+
+from pyrostorage.spool import LinkDown, SpoolFullError, UploadSpool
+
+
+def _response(status_code, payload=None):
+    response = Response()
+    response.status_code = status_code
+    response._content = json.dumps(payload).encode()
+    return response
+
+
+class FakeClient:
+    def __init__(self):
+        self.online = True
+        self.statuses = {}
+        self.uploads = []
+        self.num_media = 0
+
+    def create_media(self, media_type="image"):
+        if not self.online:
+            raise requests.ConnectionError("Network is unreachable")
+        self.num_media += 1
+        return _response(201, {"id": self.num_media, "type": media_type})
+
+    def upload_media(self, media_id, media_data, precheck=False):
+        if not self.online:
+            raise requests.ConnectionError("Network is unreachable")
+        status_code = self.statuses.get(media_id, 200)
+        if status_code == 200:
+            self.uploads.append((media_id, media_data.read_bytes()))
+        return _response(status_code, {"detail": "error"})
+
+
+def test_spool_enqueue_and_drain(tmp_path):
+    api_client = FakeClient()
+    api_client.online = False
+    spool = UploadSpool(api_client, tmp_path, num_workers=2, start=False)
+    source = tmp_path.joinpath("frame.jpg")
+    source.write_bytes(b"first")
+    assert spool.enqueue(source)
+    # The spool keeps its own copy
+    source.unlink()
+    assert spool.enqueue(b"second", media_type="video")
+    # Deduplicated by content
+    assert not spool.enqueue(b"first")
+    assert len(spool) == 2 and spool.size == 11
+
+    # Offline
+    with pytest.raises(LinkDown):
+        spool.drain()
+    assert len(spool) == 2 and spool.concurrency == 1
+
+    # Survives restarts
+    spool.close()
+    spool = UploadSpool(api_client, tmp_path, num_workers=2, start=False)
+    api_client.online = True
+    assert spool.drain_batch() == 1
+    # The parallelism grows with successful batches
+    assert spool.concurrency == 2
+    spool.drain()
+    # In order
+    assert api_client.uploads == [(1, b"first"), (2, b"second")]
+    assert len(spool) == 0 and list(spool.files_dir.iterdir()) == []
+    # Content that was sent is not queued again
+    assert not spool.enqueue(b"second")
+    spool.close()
+
+
+def test_spool_rejections(tmp_path):
+    api_client = FakeClient()
+    # The media entry was deleted on the API side
+    api_client.statuses[1] = 404
+    spool = UploadSpool(api_client, tmp_path, start=False)
+    spool.enqueue(b"content")
+    spool.drain_batch()
+    assert len(spool) == 1
+    spool.drain_batch()
+    # Sent with a new media entry
+    assert api_client.uploads == [(2, b"content")]
+
+    # The server is overloaded
+    api_client.statuses[3] = 503
+    spool.enqueue(b"other")
+    with pytest.raises(LinkDown):
+        spool.drain_batch()
+    assert len(spool) == 1
+
+    # Dropped after too many rejections
+    api_client.statuses[3] = 422
+    for _ in range(4):
+        spool.drain_batch()
+    assert len(spool) == 0 and list(spool.files_dir.iterdir()) == []
+
+    # A file the server keeps failing on doesn't hold the queue
+    api_client.statuses[4] = 500
+    spool.enqueue(b"poison")
+    spool.enqueue(b"healthy")
+    for _ in range(5):
+        spool.drain_batch()
+    assert api_client.uploads[-1] == (5, b"healthy")
+    assert len(spool) == 0
+
+    # Files that kept failing while the server was unavailable are sent last
+    api_client.statuses[6] = 503
+    spool.enqueue(b"stuck")
+    for _ in range(5):
+        with pytest.raises(LinkDown):
+            spool.drain_batch()
+    spool.enqueue(b"fresh")
+    spool.drain_batch()
+    assert api_client.uploads[-1] == (7, b"fresh")
+    assert spool._query("SELECT attempts, last_error FROM entries")[0]["attempts"] == 5
+    spool.close()
+
+
+def test_spool_disk_bound(tmp_path):
+    spool = UploadSpool(FakeClient(), tmp_path, max_bytes=10, start=False)
+    spool.enqueue(b"aaaa")
+    spool.enqueue(b"bbbb")
+    # The oldest files are dropped
+    spool.enqueue(b"cccc")
+    assert len(spool) == 2 and spool.size == 8
+    with pytest.raises(SpoolFullError):
+        spool.enqueue(b"d" * 11)
+    spool.close()
+
+    spool = UploadSpool(FakeClient(), tmp_path, max_bytes=10, drop_oldest=False, start=False)
+    with pytest.raises(SpoolFullError):
+        spool.enqueue(b"dddd")
+    assert len(spool) == 2
+    spool.close()
+
+
+def test_spool_background_drainer(tmp_path):
+    api_client = FakeClient()
+    # Created lazily
+    with UploadSpool(lambda: api_client, tmp_path, retry_interval=0.05) as spool:
+        spool.enqueue(b"content")
+        for _ in range(100):
+            if len(api_client.uploads) > 0:
+                break
+            spool._stop.wait(0.05)
+    assert api_client.uploads == [(1, b"content")]
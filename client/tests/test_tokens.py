@@ -0,0 +1,159 @@
+import asyncio
+import base64
+import io
+import json
+import os
+import stat
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from pyrostorage.async_client import AsyncClient
+from pyrostorage.client import Client
+from pyrostorage.tokens import TokenCache, decode_expiry
+
+
+def _make_token(exp, sub="1"):
+    payload = base64.urlsafe_b64encode(json.dumps({"sub": sub, "exp": exp}).encode()).decode().rstrip("=")
+    return f"header.{payload}.signature"
+
+
+def test_decode_expiry():
+    assert decode_expiry(_make_token(1234567890)) == 1234567890
+    assert decode_expiry("not-a-jwt") is None
+    assert decode_expiry("a.b.c") is None
+
+
+def test_token_cache(tmp_path):
+    cache = TokenCache()
+    token = _make_token(time.time() + 3600)
+    cache.set("http://api", "login", "pwd", token)
+    assert cache.get("http://api", "login", "pwd") == token
+    # Other credentials or API
+    assert cache.get("http://api", "login", "wrong_pwd") is None
+    assert cache.get("http://api", "other", "pwd") is None
+    assert cache.get("http://other", "login", "pwd") is None
+    # Tokens about to expire are not handed out
+    cache.set("http://api", "login", "pwd", _make_token(time.time() + 10))
+    assert cache.get("http://api", "login", "pwd") is None
+    # Rejected tokens
+    cache.set("http://api", "login", "pwd", token)
+    cache.discard("http://api", "login", "other_token")
+    assert cache.get("http://api", "login", "pwd") == token
+    cache.discard("http://api", "login", token)
+    assert cache.get("http://api", "login", "pwd") is None
+
+    # Persistence
+    path = tmp_path.joinpath("tokens.json")
+    cache.set("http://api", "login", "pwd", token, path)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert "pwd" not in path.read_text()
+    assert TokenCache().get("http://api", "login", "pwd", path) == token
+    assert TokenCache().get("http://api", "login", "wrong_pwd", path) is None
+
+
+class AuthHandler(BaseHTTPRequestHandler):
+    # Tokens accepted by the server, and number of logins
+    valid_tokens = set()
+    num_logins = 0
+    token_lifetime = 3600
+
+    def _reply(self, status_code, content):
+        body = json.dumps(content).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/login/access-token":
+            AuthHandler.num_logins += 1
+            token = _make_token(time.time() + self.token_lifetime, sub=str(AuthHandler.num_logins))
+            AuthHandler.valid_tokens.add(token)
+            self._reply(200, {"access_token": token, "token_type": "bearer"})
+        elif self.headers["Authorization"].partition(" ")[-1] not in AuthHandler.valid_tokens:
+            self._reply(401, {"detail": "Invalid credentials"})
+        elif self.path.endswith("/upload"):
+            self._reply(200, {"body": body.decode()})
+        else:
+            self._reply(201, {"id": 1})
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers["Authorization"].partition(" ")[-1] in AuthHandler.valid_tokens:
+            self._reply(200, {"body": body.decode()})
+        else:
+            self._reply(401, {"detail": "Invalid credentials"})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="function")
+def auth_server():
+    AuthHandler.valid_tokens = set()
+    AuthHandler.num_logins = 0
+    AuthHandler.token_lifetime = 3600
+    server = HTTPServer(("127.0.0.1", 0), AuthHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_client_token_reuse(auth_server, tmp_path):
+    path = tmp_path.joinpath("tokens.json")
+    with Client(auth_server, "login", "pwd", token_cache_path=path) as api_client:
+        assert api_client.create_media().status_code == 201
+    # Other clients reuse the token
+    with Client(auth_server, "login", "pwd") as api_client:
+        assert api_client.create_media().status_code == 201
+    assert AuthHandler.num_logins == 1
+
+    # Revoked token: logs in again and retries once
+    AuthHandler.valid_tokens.clear()
+    with Client(auth_server, "login", "pwd", token_cache_path=path) as api_client:
+        assert api_client.create_media().status_code == 201
+    assert AuthHandler.num_logins == 2
+
+    # File bodies are sent again from the position they were passed at
+    AuthHandler.valid_tokens.clear()
+    with Client(auth_server, "login", "pwd") as api_client:
+        file = io.BytesIO(b"header:content")
+        file.seek(7)
+        response = api_client.put_media_content(1, file)
+        assert response.status_code == 200 and response.json()["body"] == "content"
+    assert AuthHandler.num_logins == 3
+
+    # Tokens about to expire are renewed proactively
+    AuthHandler.token_lifetime = 30
+    with Client(auth_server, "login", "other_pwd") as api_client:
+        assert AuthHandler.num_logins == 4
+        assert api_client.create_media().status_code == 201
+        assert AuthHandler.num_logins == 5
+
+
+def test_async_client_token_reuse(auth_server):
+    async def _run():
+        async with AsyncClient(auth_server, "login", "pwd") as api_client:
+            responses = await asyncio.gather(*[api_client.create_media() for _ in range(4)])
+            assert all(response.status_code == 201 for response in responses)
+            assert AuthHandler.num_logins == 1
+            # Revoked token: a single login for all the concurrent requests
+            AuthHandler.valid_tokens.clear()
+            responses = await asyncio.gather(*[api_client.create_media() for _ in range(4)])
+            assert all(response.status_code == 201 for response in responses)
+            assert AuthHandler.num_logins == 2
+            # File bodies are streamed from the position they were passed at, and sent again after a login
+            AuthHandler.valid_tokens.clear()
+            file = io.BytesIO(b"header:content")
+            file.seek(7)
+            response = await api_client.upload_media(1, file)
+            assert response.status_code == 200 and AuthHandler.num_logins == 3
+            assert "\r\n\r\ncontent\r\n" in response.json()["body"] and "header" not in response.json()["body"]
+
+    asyncio.run(_run())
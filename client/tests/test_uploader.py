@@ -0,0 +1,84 @@
+from requests.models import Response
+
+from pyrostorage.uploader import UploadManifest, hash_file, upload_directory
+
+
+class FakeClient:
+    def __init__(self, failing_media=None, stored=None):
+        self.created = 0
+        self.uploads = []
+        self.failing_media = failing_media or set()
+        self.stored = stored or set()
+
+    @staticmethod
+    def _response(status_code, content=b"{}"):
+        response = Response()
+        response.status_code = status_code
+        response._content = content
+        return response
+
+    def create_media(self, media_type="image"):
+        self.created += 1
+        return self._response(201, f'{{"id": {self.created}}}'.encode())
+
+    def precheck_media(self, media_id, sha256, size, filename):
+        return self._response(200 if sha256 in self.stored else 204)
+
+    def upload_media(self, media_id, media_data, precheck=False):
+        self.uploads.append(media_id)
+        return self._response(500 if media_id in self.failing_media else 200)
+
+
+def test_upload_directory(tmp_path):
+    tmp_path.joinpath("sub").mkdir()
+    for name in ("a.jpg", "b.jpg", "sub/c.mp4", "notes.txt"):
+        tmp_path.joinpath(name).write_bytes(name.encode())
+
+    # The second file fails
+    api_client = FakeClient(failing_media={2})
+    stats = upload_directory(api_client, tmp_path, num_workers=1, extensions=[".jpg", ".mp4"])
+    assert stats["uploaded"] == 2 and stats["skipped"] == 0 and list(stats["failed"]) == ["b.jpg"]
+    assert stats["bytes"] == len("a.jpg") + len("sub/c.mp4")
+    manifest = UploadManifest(tmp_path.joinpath(".pyrostorage_manifest.json"))
+    assert manifest.entries["a.jpg"] == {
+        "media_id": 1,
+        "sha256": hash_file(tmp_path.joinpath("a.jpg")),
+        "uploaded": True,
+    }
+    assert manifest.entries["b.jpg"]["uploaded"] is False
+
+    # Rerun: uploaded files are skipped, the interrupted one reuses its media
+    api_client = FakeClient()
+    stats = upload_directory(api_client, tmp_path, num_workers=2, extensions=[".jpg", ".mp4"])
+    assert stats["uploaded"] == 1 and stats["skipped"] == 2 and len(stats["failed"]) == 0
+    assert api_client.created == 0 and api_client.uploads == [2]
+
+    # Modified files are uploaded again
+    tmp_path.joinpath("a.jpg").write_bytes(b"new content")
+    api_client = FakeClient()
+    stats = upload_directory(api_client, tmp_path, extensions=[".jpg", ".mp4"])
+    assert stats["uploaded"] == 1 and api_client.created == 1
+
+    # Content already stored by the server isn't sent
+    tmp_path.joinpath("d.jpg").write_bytes(b"stored content")
+    tmp_path.joinpath("e.jpg").write_bytes(b"other content")
+    api_client = FakeClient(stored={hash_file(tmp_path.joinpath("d.jpg"))})
+    stats = upload_directory(api_client, tmp_path, num_workers=1, extensions=[".jpg"], precheck=True)
+    assert stats["uploaded"] == 2 and stats["bytes"] == len(b"other content") and api_client.uploads == [2]
+
+
+def test_upload_manifest(tmp_path):
+    manifest = UploadManifest(tmp_path.joinpath("manifest.json"))
+    manifest.update("a.jpg", 1, "sha_a", uploaded=True)
+    manifest.update("b.jpg", 2, "sha_b", uploaded=False)
+    # Only the journal is written until the manifest is compacted
+    assert not manifest.path.is_file() and len(manifest.journal_path.read_text().splitlines()) == 2
+    manifest.compact()
+    assert not manifest.journal_path.is_file()
+    # Interrupted run, with a truncated last record
+    manifest.update("b.jpg", 2, "sha_b", uploaded=True)
+    with open(manifest.journal_path, "a") as f:
+        f.write('{"path": "c.jpg", "med')
+    manifest = UploadManifest(tmp_path.joinpath("manifest.json"))
+    assert manifest.get("a.jpg", "sha_a")["uploaded"] and manifest.get("b.jpg", "sha_b")["uploaded"]
+    assert manifest.get("c.jpg", "sha_c") is None
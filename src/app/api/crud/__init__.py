@@ -1,2 +1,2 @@
 from .base import *
-from . import accesses, authorizations
+from . import accesses, authorizations, datasets, jobs, media, partitions, shards
@@ -40,8 +40,12 @@ async def fetch_all(
     query_filters: Optional[Dict[str, Any]] = None,
     exclusions: Optional[Dict[str, Any]] = None,
     limit: int = 50,
+    conditions: Optional[List[Any]] = None,
 ) -> List[Mapping[str, Any]]:
     query = table.select().order_by(table.c.id.desc())
+    # Arbitrary SQL expressions (ranges, etc.)
+    if isinstance(conditions, list):
+        query = query.where(*conditions)
     if isinstance(query_filters, dict):
         for key, value in query_filters.items():
             query = query.where(getattr(table.c, key) == value)
@@ -59,9 +63,14 @@ async def fetch_one(table: Table, query_filters: Dict[str, Any]) -> Mapping[str,
     return await database.fetch_one(query=query)
 
 
-async def put(entry_id: int, payload: Dict, table: Table) -> int:
-    query = table.update().where(entry_id == table.c.id).values(**payload).returning(table.c.id)
-    return await database.execute(query=query)
+async def put(entry_id: int, payload: Dict, table: Table, version: Optional[int] = None) -> int:
+    query = table.update().where(entry_id == table.c.id)
+    # Versioned tables: each update makes a new version, conditional updates only apply to the expected one
+    if "version" in table.c:
+        payload = {**payload, "version": table.c.version + 1}
+        if isinstance(version, int):
+            query = query.where(table.c.version == version)
+    return await database.execute(query=query.values(**payload).returning(table.c.id))
 
 
 async def delete(entry_id: int, table: Table) -> None:
@@ -85,7 +94,11 @@ async def get_entry(table: Table, entry_id: int = Path(..., gt=0)) -> Dict[str,
 
 
 async def update_entry(
-    table: Table, payload: BaseModel, entry_id: int = Path(..., gt=0), only_specified: bool = True
+    table: Table,
+    payload: BaseModel,
+    entry_id: int = Path(..., gt=0),
+    only_specified: bool = True,
+    version: Optional[int] = None,
 ) -> Dict[str, Any]:
     payload_dict = payload.dict()
 
@@ -93,9 +106,15 @@ async def update_entry(
         # Dont update columns for null fields
         payload_dict = {k: v for k, v in payload_dict.items() if v is not None}
 
-    _id = await put(entry_id, payload_dict, table)
+    _id = await put(entry_id, payload_dict, table, version)
 
     if not isinstance(_id, int):
+        # Optimistic concurrency: the entry was modified since the expected version was read
+        if isinstance(version, int) and await get(entry_id, table) is not None:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Table {table.name} entry with id={entry_id} was modified concurrently",
+            )
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail=f"Table {table.name} has no entry with id={entry_id}"
         )
@@ -0,0 +1,117 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+from datetime import datetime
+from typing import Any, Dict, List, Mapping, Optional
+
+from sqlalchemy import Table, func, literal, select
+
+from app.api.crud import base
+from app.db import database
+from app.db.models import UploadStatus
+
+__all__ = ["create_snapshot", "fetch_items", "delete_snapshot"]
+
+
+async def create_snapshot(
+    datasets: Table,
+    dataset_items: Table,
+    media: Table,
+    annotations: Table,
+    name: str,
+    filters: Dict[str, Any],
+    conditions: List[Any],
+    include_annotations: bool = True,
+    limit: Optional[int] = None,
+) -> Mapping[str, Any]:
+    """Freeze the verified media matching the conditions (and their verified annotations) as the next version of a
+    dataset. The selection is copied within the DB, without going through the API process.
+
+    Args:
+        datasets: table of the datasets
+        dataset_items: table of the dataset items
+        media: table of the media
+        annotations: table of the annotations
+        name: name of the dataset
+        filters: selection criteria, recorded with the snapshot
+        conditions: SQL conditions on the media
+        include_annotations: whether the annotations of the selected media are part of the snapshot
+        limit: max number of media
+
+    Returns:
+        the dataset entry
+    """
+    async with database.transaction():
+        # Concurrent snapshots of the same dataset are numbered one after the other
+        await database.fetch_val(query=select([func.pg_advisory_xact_lock(func.hashtext(name))]))
+        last_version = await database.fetch_val(
+            query=select([func.max(datasets.c.version)]).where(datasets.c.name == name)
+        )
+        dataset_id = await database.execute(
+            query=datasets.insert().values(
+                name=name, version=(last_version or 0) + 1, filters=filters, num_items=0, created_at=datetime.utcnow()
+            )
+        )
+        selection = (
+            select([literal(dataset_id), media.c.id, media.c.bucket_key, media.c.size_bytes])
+            .where(media.c.status == UploadStatus.verified)
+            .where(media.c.bucket_key.isnot(None))
+            .order_by(media.c.id)
+            .limit(limit)
+        )
+        for condition in conditions:
+            selection = selection.where(condition)
+        await database.execute(
+            query=dataset_items.insert().from_select(["dataset_id", "media_id", "bucket_key", "size_bytes"], selection)
+        )
+        if include_annotations:
+            selected_ids = select([dataset_items.c.media_id]).where(dataset_items.c.dataset_id == dataset_id)
+            selection = (
+                select([literal(dataset_id), annotations.c.media_id, annotations.c.id, annotations.c.bucket_key])
+                .where(annotations.c.status == UploadStatus.verified)
+                .where(annotations.c.bucket_key.isnot(None))
+                .where(annotations.c.media_id.in_(selected_ids))
+                .order_by(annotations.c.id)
+            )
+            await database.execute(
+                query=dataset_items.insert().from_select(
+                    ["dataset_id", "media_id", "annotation_id", "bucket_key"], selection
+                )
+            )
+        totals = await database.fetch_one(
+            query=select([func.count(dataset_items.c.id), func.sum(dataset_items.c.size_bytes)]).where(
+                dataset_items.c.dataset_id == dataset_id
+            )
+        )
+        await database.execute(
+            query=datasets.update().where(datasets.c.id == dataset_id).values(num_items=totals[0], size_bytes=totals[1])
+        )
+    return await base.get_entry(datasets, dataset_id)
+
+
+async def fetch_items(
+    dataset_items: Table, dataset_id: int, after_id: int = 0, limit: Optional[int] = None
+) -> List[Mapping[str, Any]]:
+    """Retrieve the items of a dataset by pages, in the order of the snapshot"""
+    query = (
+        dataset_items.select()
+        .where(dataset_items.c.dataset_id == dataset_id)
+        .where(dataset_items.c.id > after_id)
+        .order_by(dataset_items.c.id)
+        .limit(limit)
+    )
+    return await database.fetch_all(query=query)
+
+
+async def delete_snapshot(datasets: Table, dataset_items: Table, dataset_id: int) -> List[str]:
+    """Delete a dataset version, returns the bucket keys it was referring to"""
+    async with database.transaction():
+        rows = await database.fetch_all(
+            query=dataset_items.delete()
+            .where(dataset_items.c.dataset_id == dataset_id)
+            .returning(dataset_items.c.bucket_key)
+        )
+        await database.execute(query=datasets.delete().where(datasets.c.id == dataset_id))
+    return list({row["bucket_key"] for row in rows})
@@ -0,0 +1,97 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Mapping, Optional
+
+from sqlalchemy import Table, and_, func, or_, select
+
+from app import config as cfg
+from app.api.crud import base
+from app.api.schemas import JobCreation
+from app.db import database
+from app.db.models import JobKind, JobStatus
+
+__all__ = ["enqueue", "enqueue_many", "claim", "claim_batch", "complete", "fail", "last_created_at"]
+
+
+def _is_available(jobs: Table, now: datetime) -> Any:
+    # Due pending jobs, or running jobs whose lease expired (their process was interrupted)
+    return and_(
+        or_(jobs.c.status == JobStatus.pending, jobs.c.status == JobStatus.running),
+        jobs.c.run_after <= now,
+    )
+
+
+async def enqueue(jobs: Table, kind: JobKind, payload: Dict[str, Any]) -> int:
+    """Persist a job to be executed, and return its ID"""
+    return await base.post(JobCreation(kind=kind, payload=payload), jobs)
+
+
+async def enqueue_many(jobs: Table, kind: JobKind, payloads: List[Dict[str, Any]]) -> None:
+    """Persist several jobs of the same kind in a single query"""
+    if len(payloads) > 0:
+        query = jobs.insert().values([JobCreation(kind=kind, payload=payload).dict() for payload in payloads])
+        await database.execute(query=query)
+
+
+async def claim(jobs: Table, job_id: int) -> Optional[Mapping[str, Any]]:
+    """Atomically mark an available job as running, returns None if it's not (done, taken or not due)"""
+    now = datetime.utcnow()
+    query = (
+        jobs.update()
+        .where(jobs.c.id == job_id)
+        .where(_is_available(jobs, now))
+        .values(
+            status=JobStatus.running, attempts=jobs.c.attempts + 1, run_after=now + timedelta(seconds=cfg.JOB_LEASE)
+        )
+        .returning(*jobs.c)
+    )
+    return await database.fetch_one(query=query)
+
+
+async def claim_batch(jobs: Table, kinds: List[JobKind], limit: int) -> List[Mapping[str, Any]]:
+    """Atomically mark the oldest available jobs of given kinds as running, skipping those locked by other workers"""
+    now = datetime.utcnow()
+    job_ids = (
+        select([jobs.c.id])
+        .where(jobs.c.kind.in_(kinds))
+        .where(_is_available(jobs, now))
+        .order_by(jobs.c.run_after)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    query = (
+        jobs.update()
+        .where(jobs.c.id.in_(job_ids))
+        .values(
+            status=JobStatus.running, attempts=jobs.c.attempts + 1, run_after=now + timedelta(seconds=cfg.JOB_LEASE)
+        )
+        .returning(*jobs.c)
+    )
+    return await database.fetch_all(query=query)
+
+
+async def complete(jobs: Table, job_id: int) -> None:
+    await base.put(job_id, {"status": JobStatus.done, "last_error": None}, jobs)
+
+
+async def fail(jobs: Table, job: Mapping[str, Any], error: str) -> Optional[datetime]:
+    """Record a failed attempt and return the time of the next one (None if the job ran out of attempts)"""
+    if job["attempts"] >= cfg.JOB_MAX_ATTEMPTS:
+        await base.put(job["id"], {"status": JobStatus.failed, "last_error": error[:255]}, jobs)
+        return None
+
+    # Exponential backoff
+    run_after = datetime.utcnow() + timedelta(seconds=cfg.JOB_RETRY_DELAY * 2 ** (job["attempts"] - 1))
+    await base.put(job["id"], {"status": JobStatus.pending, "last_error": error[:255], "run_after": run_after}, jobs)
+    return run_after
+
+
+async def last_created_at(jobs: Table, kind: JobKind) -> Optional[datetime]:
+    """Creation time of the most recent job of a given kind"""
+    query = select([func.max(jobs.c.created_at)]).where(jobs.c.kind == kind)
+    return await database.fetch_val(query=query)
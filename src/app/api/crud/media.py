@@ -0,0 +1,176 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException, status
+from sqlalchemy import Table, or_, select
+
+from app.api.schemas import MediaFilters
+from app.db import database
+from app.db.models import UploadStatus
+from app.services import NUM_BANDS, band_neighbors, hamming_distance, hash_fields
+
+__all__ = [
+    "fetch_annotations_of_media",
+    "fetch_all_with_annotations",
+    "metadata_conditions",
+    "filter_conditions",
+    "fetch_near_duplicates",
+    "clear_duplicate_of",
+]
+
+
+def _annotation_columns(annotations: Table) -> List[Any]:
+    # Prefix annotation columns to avoid name collisions with the media ones
+    return [col.label(f"annotation_{col.name}") for col in annotations.c if col.name != "bucket_key"]
+
+
+def _collect_annotations(rows: List[Any], annotations: Table) -> Dict[int, List[Dict[str, Any]]]:
+    """Group joined annotation columns by media ID, in the order of the rows"""
+    grouped: Dict[int, List[Dict[str, Any]]] = {}
+    for row in rows:
+        media_annotations = grouped.setdefault(row["id"], [])
+        # Outer join: media without annotations yield a row of NULL annotation columns
+        if row["annotation_id"] is not None:
+            media_annotations.append(
+                {col.name: row[f"annotation_{col.name}"] for col in annotations.c if col.name != "bucket_key"}
+            )
+    return grouped
+
+
+async def fetch_annotations_of_media(media: Table, annotations: Table, media_id: int) -> List[Dict[str, Any]]:
+    """Retrieve all the annotations of a media, raises a 404 if the media does not exist (single query)"""
+    query = (
+        select([media.c.id, *_annotation_columns(annotations)])
+        .select_from(media.outerjoin(annotations, annotations.c.media_id == media.c.id))
+        .where(media.c.id == media_id)
+        .order_by(annotations.c.id)
+    )
+    rows = await database.fetch_all(query=query)
+    if len(rows) == 0:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail=f"Table {media.name} has no entry with id={media_id}"
+        )
+
+    return _collect_annotations(rows, annotations)[media_id]
+
+
+def metadata_conditions(
+    media: Table,
+    content_type: Optional[str] = None,
+    min_width: Optional[int] = None,
+    min_height: Optional[int] = None,
+    min_size: Optional[int] = None,
+    max_size: Optional[int] = None,
+    captured_after: Optional[datetime] = None,
+    captured_before: Optional[datetime] = None,
+    device_id: Optional[int] = None,
+) -> List[Any]:
+    """Translate the specified filters on file properties & origin into SQL conditions (served by the column indexes,
+    a capture time range of a device by the composite one)"""
+    bounds = [
+        (device_id, media.c.device_id.__eq__),
+        (content_type, media.c.content_type.__eq__),
+        (min_width, media.c.width.__ge__),
+        (min_height, media.c.height.__ge__),
+        (min_size, media.c.size_bytes.__ge__),
+        (max_size, media.c.size_bytes.__le__),
+        (captured_after, media.c.captured_at.__ge__),
+        (captured_before, media.c.captured_at.__lt__),
+    ]
+    return [condition(value) for value, condition in bounds if value is not None]
+
+
+def filter_conditions(media: Table, annotations: Table, filters: MediaFilters) -> List[Any]:
+    """Translate a media selection (file properties, type & annotation) into SQL conditions"""
+    conditions = metadata_conditions(
+        media,
+        filters.content_type,
+        filters.min_width,
+        filters.min_height,
+        filters.min_size,
+        filters.max_size,
+        filters.captured_after,
+        filters.captured_before,
+        filters.device_id,
+    )
+    if filters.type is not None:
+        conditions.append(media.c.type == filters.type)
+    if filters.annotated:
+        conditions.append(
+            media.c.id.in_(select([annotations.c.media_id]).where(annotations.c.status == UploadStatus.verified))
+        )
+    return conditions
+
+
+async def fetch_all_with_annotations(
+    media: Table,
+    annotations: Table,
+    query_filters: Optional[Dict[str, Any]] = None,
+    limit: int = 50,
+    conditions: Optional[List[Any]] = None,
+) -> List[Dict[str, Any]]:
+    """Retrieve the last media entries along with their annotations, using a single joined query"""
+    # Paginate on media, not on the joined rows
+    media_query = media.select().order_by(media.c.id.desc())
+    if isinstance(conditions, list):
+        media_query = media_query.where(*conditions)
+    if isinstance(query_filters, dict):
+        for key, value in query_filters.items():
+            media_query = media_query.where(getattr(media.c, key) == value)
+    last_media = media_query.limit(limit).subquery()
+
+    query = (
+        select([*last_media.c, *_annotation_columns(annotations)])
+        .select_from(last_media.outerjoin(annotations, annotations.c.media_id == last_media.c.id))
+        .order_by(last_media.c.id, annotations.c.id)
+    )
+    rows = await database.fetch_all(query=query)
+
+    grouped = _collect_annotations(rows, annotations)
+    entries: Dict[int, Dict[str, Any]] = {}
+    for row in rows:
+        if row["id"] not in entries:
+            entries[row["id"]] = {
+                **{col.name: row[col.name] for col in media.c},
+                "annotations": grouped[row["id"]],
+            }
+
+    return list(entries.values())
+
+
+async def fetch_near_duplicates(
+    media: Table,
+    phash: int,
+    max_distance: int,
+    exclude_id: Optional[int] = None,
+    limit: int = 50,
+) -> List[Dict[str, Any]]:
+    """Retrieve the media whose perceptual hash is within a Hamming distance, closest first
+
+    Candidates are looked up on the indexed hash bands (multi-index hashing), then filtered on the full hash.
+    """
+    bands = [hash_fields(phash)[f"phash_band{idx}"] for idx in range(NUM_BANDS)]
+    radius = max_distance // NUM_BANDS
+    query = media.select().where(
+        or_(*[media.c[f"phash_band{idx}"].in_(band_neighbors(band, radius)) for idx, band in enumerate(bands)])
+    )
+    if isinstance(exclude_id, int):
+        query = query.where(media.c.id != exclude_id)
+    candidates = await database.fetch_all(query=query)
+
+    matches = []
+    for row in candidates:
+        distance = hamming_distance(phash, row["phash"])
+        if distance <= max_distance:
+            matches.append({**{col.name: row[col.name] for col in media.c}, "distance": distance})
+    return sorted(matches, key=lambda entry: (entry["distance"], entry["id"]))[:limit]
+
+
+async def clear_duplicate_of(media: Table, media_id: int) -> None:
+    """Untag the near-duplicates of a deleted media"""
+    await database.execute(query=media.update().where(media.c.duplicate_of == media_id).values(duplicate_of=None))
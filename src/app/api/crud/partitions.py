@@ -0,0 +1,95 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+import re
+from datetime import date, datetime
+from typing import Dict
+
+from sqlalchemy import Table, text
+
+from app.db import database
+
+__all__ = ["shift_month", "partition_ddl", "fetch_partitions", "create_partition", "archive_partition"]
+
+
+def shift_month(month: date, offset: int) -> date:
+    """First day of the month that is `offset` months away"""
+    idx = month.year * 12 + month.month - 1 + offset
+    return date(idx // 12, idx % 12 + 1, 1)
+
+
+def _qualified_name(table: Table, name: str) -> str:
+    return name if table.schema is None else f"{table.schema}.{name}"
+
+
+def partition_ddl(table: Table, month: date) -> str:
+    """Statement creating the partition of a table for the month of creation of its rows"""
+    name = _qualified_name(table, f"{table.name}_{month:%Y_%m}")
+    return (
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table.fullname} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{shift_month(month, 1).isoformat()}')"
+    )
+
+
+async def fetch_partitions(table: Table) -> Dict[date, str]:
+    """Retrieve the monthly partitions attached to a table, by month"""
+    rows = await database.fetch_all(
+        query=text(
+            "SELECT child.relname AS name FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.oid = CAST(:table AS regclass)"
+        ),
+        values={"table": table.fullname},
+    )
+    partitions = {}
+    for row in rows:
+        # The default partition has no month
+        match = re.fullmatch(rf"{table.name}_(\d{{4}})_(\d{{2}})", row["name"])
+        if match is not None:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = row["name"]
+    return partitions
+
+
+async def create_partition(table: Table, month: date) -> None:
+    """Create the partition of a month, moving the rows of that month that were stored in the default partition
+
+    PostgreSQL refuses to create a partition for rows already in the default one (e.g. after a fresh deploy, or if the
+    partitions weren't created ahead of time): the default partition is then detached while they are moved, which
+    blocks the writes to the table until the transaction is committed.
+    """
+    default_name = _qualified_name(table, f"{table.name}_default")
+    bounds = {
+        "start": datetime.combine(month, datetime.min.time()),
+        "end": datetime.combine(shift_month(month, 1), datetime.min.time()),
+    }
+    month_condition = "created_at >= :start AND created_at < :end"
+    async with database.transaction():
+        has_rows = await database.fetch_val(
+            query=text(f"SELECT EXISTS (SELECT 1 FROM {default_name} WHERE {month_condition})"), values=bounds
+        )
+        if not has_rows:
+            await database.execute(query=partition_ddl(table, month))
+            return
+        await database.execute(query=f"ALTER TABLE {table.fullname} DETACH PARTITION {default_name}")
+        await database.execute(query=partition_ddl(table, month))
+        # Inserted through the parent table, so that they are routed to the new partition
+        await database.execute(
+            query=text(
+                f"WITH moved AS (DELETE FROM {default_name} WHERE {month_condition} RETURNING *) "
+                f"INSERT INTO {table.fullname} SELECT * FROM moved"
+            ),
+            values=bounds,
+        )
+        await database.execute(query=f"ALTER TABLE {table.fullname} ATTACH PARTITION {default_name} DEFAULT")
+
+
+async def archive_partition(table: Table, name: str, schema: str) -> None:
+    """Detach a partition from its table (its rows leave the table at once) and move it to another schema"""
+    name = _qualified_name(table, name)
+    async with database.transaction():
+        await database.execute(query=f"CREATE SCHEMA IF NOT EXISTS {schema}")
+        await database.execute(query=f"ALTER TABLE {table.fullname} DETACH PARTITION {name}")
+        await database.execute(query=f"ALTER TABLE {name} SET SCHEMA {schema}")
@@ -0,0 +1,114 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+from datetime import datetime
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from sqlalchemy import Table, func, select
+
+from app.db import database
+from app.db.models import UploadStatus
+
+__all__ = ["locate", "locate_many", "fetch_packing_candidates", "register_shard", "release"]
+
+
+async def locate(shard_items: Table, shards: Table, bucket_key: str) -> Optional[Mapping]:
+    """Find the shard holding a content, along with its position, None if it's stored as an individual object"""
+    query = (
+        select(
+            [
+                shards.c.id.label("shard_id"),
+                shards.c.bucket_key.label("shard_key"),
+                shard_items.c.offset,
+                shard_items.c.size,
+            ]
+        )
+        .select_from(shard_items.join(shards, shard_items.c.shard_id == shards.c.id))
+        .where(shard_items.c.bucket_key == bucket_key)
+    )
+    return await database.fetch_one(query=query)
+
+
+async def locate_many(shard_items: Table, shards: Table, bucket_keys: List[str]) -> Dict[str, Mapping]:
+    """Find the shards holding several contents at once (cf. locate), indexed by bucket key of the packed content"""
+    if len(bucket_keys) == 0:
+        return {}
+    query = (
+        select(
+            [
+                shard_items.c.bucket_key,
+                shards.c.bucket_key.label("shard_key"),
+                shard_items.c.offset,
+                shard_items.c.size,
+            ]
+        )
+        .select_from(shard_items.join(shards, shard_items.c.shard_id == shards.c.id))
+        .where(shard_items.c.bucket_key.in_(bucket_keys))
+    )
+    return {row["bucket_key"]: row for row in await database.fetch_all(query=query)}
+
+
+async def fetch_packing_candidates(media: Table, shard_items: Table, max_item_size: int, limit: int) -> List[Mapping]:
+    """Retrieve the verified small media content not packed yet, oldest first (once per content)"""
+    query = (
+        select(
+            [
+                media.c.bucket_key,
+                func.max(media.c.size_bytes).label("size"),
+                func.min(media.c.created_at).label("created_at"),
+            ]
+        )
+        .where(media.c.status == UploadStatus.verified)
+        .where(media.c.size_bytes <= max_item_size)
+        .where(media.c.bucket_key.notin_(select([shard_items.c.bucket_key])))
+        .group_by(media.c.bucket_key)
+        .order_by(func.min(media.c.created_at))
+        .limit(limit)
+    )
+    return await database.fetch_all(query=query)
+
+
+async def register_shard(
+    shards: Table, shard_items: Table, bucket_key: str, size: int, items: List[Tuple[str, int, int]]
+) -> int:
+    """Record a shard and the position of its items (bucket key, offset, size), returns the shard ID"""
+    async with database.transaction():
+        shard_id = await database.execute(
+            query=shards.insert().values(
+                bucket_key=bucket_key, size=size, num_items=len(items), created_at=datetime.utcnow()
+            )
+        )
+        await database.execute(
+            query=shard_items.insert().values(
+                [
+                    {"shard_id": shard_id, "bucket_key": key, "offset": offset, "size": item_size}
+                    for key, offset, item_size in items
+                ]
+            )
+        )
+    return shard_id
+
+
+async def release(shards: Table, shard_items: Table, bucket_keys: List[str]) -> List[str]:
+    """Remove packed content from the index, returns the bucket keys of the shards that don't hold anything anymore"""
+    if len(bucket_keys) == 0:
+        return []
+    shard_ids = {
+        row["shard_id"]
+        for row in await database.fetch_all(
+            query=shard_items.delete()
+            .where(shard_items.c.bucket_key.in_(bucket_keys))
+            .returning(shard_items.c.shard_id)
+        )
+    }
+    if len(shard_ids) == 0:
+        return []
+    query = (
+        shards.delete()
+        .where(shards.c.id.in_(shard_ids))
+        .where(shards.c.id.notin_(select([shard_items.c.shard_id])))
+        .returning(shards.c.bucket_key)
+    )
+    return [row["bucket_key"] for row in await database.fetch_all(query=query)]
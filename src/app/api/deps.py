@@ -3,14 +3,22 @@
 # This program is licensed under the Apache License 2.0.
 # See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
 
-from fastapi import Depends, HTTPException, status
+import math
+from typing import Any, Callable, List, Sequence, TypeVar
+
+from fastapi import Depends, HTTPException, Request, Security, status
+from fastapi.routing import APIRoute
 from fastapi.security import OAuth2PasswordBearer, SecurityScopes
-from jose import JWTError, jwt
+from fastapi.security.utils import get_authorization_scheme_param
+from jose import JWTError
 from pydantic import ValidationError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 import app.config as cfg
 from app.api import crud
+from app.api.ratelimit import ConcurrencyLimiter, rate_limit_store
 from app.api.schemas import AccessRead, AccessType, TokenPayload
+from app.api.security import keyset
 from app.db import accesses
 
 # Scope definition
@@ -37,7 +45,7 @@ async def get_current_access(security_scopes: SecurityScopes, token: str = Depen
         authenticate_value = "Bearer"
 
     try:
-        payload = jwt.decode(token, cfg.SECRET_KEY, algorithms=[cfg.JWT_ENCODING_ALGORITHM])
+        payload = keyset.decode(token)
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -66,3 +74,108 @@ async def get_current_access(security_scopes: SecurityScopes, token: str = Depen
         )
 
     return AccessRead(**entry)
+
+
+async def check_rate_limit(access_id: int, scope: str) -> None:
+    """Consume a request from the rate limit of an access, raises a 429 if it is exceeded"""
+    rate, burst = cfg.RATE_LIMITS[scope]
+    if rate > 0:
+        wait_time = await rate_limit_store.consume(f"access:{access_id}", rate, burst)
+        if wait_time > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Rate limit exceeded.",
+                headers={"Retry-After": str(math.ceil(wait_time))},
+            )
+
+
+async def get_rate_limited_access(access: AccessRead = Security(get_current_access)) -> AccessRead:
+    """Dependency to use instead of get_current_access (same scopes) to enforce the rate limit of the access scope"""
+    await check_rate_limit(access.id, access.scope)
+    return access
+
+
+def _busy_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="The server is busy, please try again later.",
+        headers={"Retry-After": "1"},
+    )
+
+
+async def check_request_rate_limit(request: Request) -> None:
+    """Enforce the rate limit of the access of the bearer token of a request, from the token claims alone"""
+    scheme, token = get_authorization_scheme_param(request.headers.get("Authorization"))
+    if scheme.lower() != "bearer":
+        return
+    try:
+        payload = keyset.decode(token)
+        access_id = int(payload["sub"])
+    except (JWTError, KeyError, ValueError):
+        # Left to the authentication of the route
+        return
+    for scope in payload.get("scopes", []):
+        if scope in cfg.RATE_LIMITS:
+            await check_rate_limit(access_id, scope)
+            return
+
+
+Endpoint = TypeVar("Endpoint", bound=Callable[..., Any])
+
+
+def admission(*limiters: ConcurrencyLimiter) -> Callable[[Endpoint], Endpoint]:
+    """Decorator of the endpoints of an AdmissionRoute, their requests are rate limited and take a slot of each limiter
+    before their body is read (the endpoint then authenticates with get_current_access)
+
+    >>> @router.post("/{media_id}/upload")
+    >>> @admission(upload_limiter, bucket_limiter)
+    >>> async def upload_media(file: UploadFile = File(...), _=Security(get_current_access, scopes=["admin"])):
+    """
+
+    def decorator(endpoint: Endpoint) -> Endpoint:
+        setattr(endpoint, "limiters", limiters)
+        return endpoint
+
+    return decorator
+
+
+class AdmissionRoute(APIRoute):
+    """Route class admitting the requests of endpoints decorated with `admission` before FastAPI reads their body
+
+    Uploads are parsed (and spooled to disk) before the dependencies are solved, so a client exceeding its limits
+    would otherwise cost the transfer of its whole file before being refused. The slots are released as soon as the
+    response is sent, before its background tasks run.
+    """
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs: Any) -> None:
+        super().__init__(path, endpoint, **kwargs)
+        limiters = getattr(endpoint, "limiters", None)
+        if limiters is not None:
+            self.app = self._admit(self.app, limiters)
+
+    @staticmethod
+    def _admit(app: ASGIApp, limiters: Sequence[ConcurrencyLimiter]) -> ASGIApp:
+        async def admitted_app(scope: Scope, receive: Receive, send: Send) -> None:
+            await check_request_rate_limit(Request(scope))
+            acquired: List[ConcurrencyLimiter] = []
+
+            def release() -> None:
+                while len(acquired) > 0:
+                    acquired.pop().release()
+
+            async def send_and_release(message: Message) -> None:
+                await send(message)
+                # The background tasks run once the last chunk of the body is sent
+                if message["type"] == "http.response.body" and not message.get("more_body", False):
+                    release()
+
+            try:
+                for limiter in limiters:
+                    if not limiter.try_acquire():
+                        raise _busy_exception()
+                    acquired.append(limiter)
+                await app(scope, receive, send_and_release)
+            finally:
+                release()
+
+        return admitted_app
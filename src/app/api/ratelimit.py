@@ -0,0 +1,124 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Tuple
+
+from sqlalchemy import Table, case, extract, func
+from sqlalchemy.dialects.postgresql import insert
+
+from app import config as cfg
+from app.db import database, rate_limits
+
+__all__ = ["RateLimitStore", "MemoryStore", "DatabaseStore", "ConcurrencyLimiter", "rate_limit_store"]
+
+
+class RateLimitStore(ABC):
+    """Token bucket states, indexed by key"""
+
+    @abstractmethod
+    async def consume(self, key: str, rate: float, burst: int, cost: float = 1.0) -> float:
+        """Take tokens from the bucket of a key
+
+        Args:
+            key: identifier of the bucket
+            rate: number of tokens refilled per second
+            burst: capacity of the bucket
+            cost: number of tokens to take
+
+        Returns:
+            0 if the tokens were taken, otherwise the number of seconds to wait until they are available
+        """
+        raise NotImplementedError
+
+
+class MemoryStore(RateLimitStore):
+    """States held by the process, only suitable for a single worker
+
+    Args:
+        eviction_interval: seconds between two sweeps of the buckets that are full again
+    """
+
+    def __init__(self, eviction_interval: float = 60.0) -> None:
+        # Tokens, last update & time at which the bucket is full again
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self.eviction_interval = eviction_interval
+        self._next_eviction = time.monotonic() + eviction_interval
+
+    def evict_idle(self) -> None:
+        """Forget the buckets that are full again, which is the state of an unknown key"""
+        now = time.monotonic()
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+        self._next_eviction = now + self.eviction_interval
+
+    async def consume(self, key: str, rate: float, burst: int, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        if now >= self._next_eviction:
+            self.evict_idle()
+        tokens, updated_at, _ = self._buckets.get(key, (burst, now, now))
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        wait_time = 0.0 if tokens >= cost else (cost - tokens) / rate
+        if wait_time == 0:
+            tokens -= cost
+        self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+        return wait_time
+
+
+class DatabaseStore(RateLimitStore):
+    """States shared by all workers through the DB, updated with a single atomic query"""
+
+    def __init__(self, table: Table) -> None:
+        self.table = table
+
+    async def consume(self, key: str, rate: float, burst: int, cost: float = 1.0) -> float:
+        now = datetime.utcnow()
+        refilled = func.least(burst, self.table.c.tokens + extract("epoch", now - self.table.c.updated_at) * rate)
+        is_allowed = refilled >= cost
+        # A refused request leaves the bucket untouched, which is how it is told apart
+        query = (
+            insert(self.table)
+            .values(key=key, tokens=burst - cost, updated_at=now)
+            .on_conflict_do_update(
+                index_elements=[self.table.c.key],
+                set_={
+                    "tokens": case((is_allowed, refilled - cost), else_=self.table.c.tokens),
+                    "updated_at": case((is_allowed, now), else_=self.table.c.updated_at),
+                },
+            )
+            .returning(self.table.c.tokens, self.table.c.updated_at)
+        )
+        entry = await database.fetch_one(query=query)
+        if entry["updated_at"] == now:
+            return 0.0
+        tokens = min(burst, entry["tokens"] + (now - entry["updated_at"]).total_seconds() * rate)
+        return (cost - tokens) / rate
+
+
+class ConcurrencyLimiter:
+    """Caps the number of operations in flight in the process, without queuing
+
+    Args:
+        max_concurrency: maximum number of operations at the same time
+    """
+
+    def __init__(self, max_concurrency: int) -> None:
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= self.max_concurrency:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+
+rate_limit_store: RateLimitStore = DatabaseStore(rate_limits) if cfg.RATE_LIMIT_BACKEND == "database" else MemoryStore()
+upload_limiter = ConcurrencyLimiter(cfg.MAX_CONCURRENT_UPLOADS)
+bucket_limiter = ConcurrencyLimiter(cfg.MAX_CONCURRENT_BUCKET_OPS)
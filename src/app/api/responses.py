@@ -0,0 +1,57 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+from typing import Any, Dict, Iterable, Mapping, Type
+
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+from starlette.types import Message, Receive, Scope, Send
+
+__all__ = ["project", "fast_response", "JSONGZipMiddleware"]
+
+
+def project(entry: Mapping[str, Any], model: Type[BaseModel]) -> Dict[str, Any]:
+    """Restrict a trusted entry (e.g. a DB row) to the fields of a response model, without validating it"""
+    projected = {}
+    for name, field in model.__fields__.items():
+        value = entry[name] if name in entry else field.default
+        # Nested models (e.g. the annotations of a media)
+        if value is not None and isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+            if isinstance(value, list):
+                value = [project(item, field.type_) for item in value]
+            else:
+                value = project(value, field.type_)
+        projected[field.alias] = value
+    return projected
+
+
+def fast_response(entries: Iterable[Mapping[str, Any]], model: Type[BaseModel]) -> ORJSONResponse:
+    """Serialize a listing of DB rows with orjson, skipping the validation of the route response model.
+    The route keeps its response_model for the documentation."""
+    return ORJSONResponse([project(entry, model) for entry in entries])
+
+
+class _JSONGZipResponder(GZipResponder):
+    async def send_with_gzip(self, message: Message) -> None:
+        await super().send_with_gzip(message)
+        if message["type"] == "http.response.start":
+            # Other contents are passed through, like responses that are already encoded
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            if not content_type.startswith("application/json"):
+                self.content_encoding_set = True
+
+
+class JSONGZipMiddleware(GZipMiddleware):
+    """Compress JSON responses only: media, shards & archives are already compressed, and are streamed with their
+    length"""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and "gzip" in Headers(scope=scope).get("Accept-Encoding", ""):
+            responder = _JSONGZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
@@ -9,6 +9,7 @@ from fastapi import APIRouter, Path, Security, status
 
 from app.api import crud
 from app.api.deps import get_current_access
+from app.api.responses import fast_response
 from app.api.schemas import AccessAuth, AccessRead, AccessType, Cred
 from app.db import accesses
 
@@ -40,8 +41,7 @@ async def fetch_accesses(_=Security(get_current_access, scopes=[AccessType.admin
     """
     Retrieves the list of all accesses and their information
     """
-    entries = await crud.fetch_all(accesses)
-    return [AccessRead(**entry) for entry in entries]
+    return fast_response(await crud.fetch_all(accesses), AccessRead)
 
 
 @router.put("/{access_id}/", response_model=None, summary="Update information about a specific access")
@@ -5,17 +5,32 @@
 
 from typing import Any, Dict, List
 
-from fastapi import APIRouter, BackgroundTasks, File, HTTPException, Path, Security, UploadFile, status
+from fastapi import APIRouter, BackgroundTasks, File, HTTPException, Path, Response, Security, UploadFile, status
 
+from app import config as cfg
 from app.api import crud
 from app.api.crud.authorizations import check_access_read, is_admin_access
-from app.api.deps import get_current_access
-from app.api.schemas import AccessType, AnnotationCreation, AnnotationIn, AnnotationOut, AnnotationUrl
-from app.api.security import hash_content_file
-from app.db import annotations
-from app.services import resolve_bucket_key, s3_bucket
+from app.api.deps import AdmissionRoute, admission, get_current_access, get_rate_limited_access
+from app.api.ratelimit import bucket_limiter, upload_limiter
+from app.api.responses import fast_response
+from app.api.schemas import (
+    AccessType,
+    AnnotationCreation,
+    AnnotationIn,
+    AnnotationOut,
+    AnnotationUrl,
+    ContentDigest,
+    UploadStatus,
+)
+from app.api.security import hash_content_file, hash_gzip_content
+from app.api.tasks import is_content_stored, schedule_deletion, schedule_upload_checks
+from app.db import annotations, media
+from app.services import resolve_bucket_key, resolve_content_file_name, s3_bucket
+
+router = APIRouter(route_class=AdmissionRoute)
 
-router = APIRouter()
+# Encodings of annotation files accepted on upload
+SUPPORTED_ENCODINGS = ("identity", "gzip")
 
 
 async def check_annotation_registration(annotation_id: int) -> Dict[str, Any]:
@@ -23,6 +38,11 @@ async def check_annotation_registration(annotation_id: int) -> Dict[str, Any]:
     return await crud.get_entry(annotations, annotation_id)
 
 
+async def check_annotated_media(media_id: int) -> None:
+    """Checks whether the annotated media is registered in the DB (no foreign key on partitioned tables)"""
+    await crud.get_entry(media, media_id)
+
+
 @router.post(
     "/",
     response_model=AnnotationOut,
@@ -30,7 +50,7 @@ async def check_annotation_registration(annotation_id: int) -> Dict[str, Any]:
     summary="Create an annotation related to a specific media",
 )
 async def create_annotation(
-    payload: AnnotationIn, _=Security(get_current_access, scopes=[AccessType.admin, AccessType.user])
+    payload: AnnotationIn, _=Security(get_rate_limited_access, scopes=[AccessType.admin, AccessType.user])
 ):
     """
     Creates an annotation related to specific media, based on media_id as argument
@@ -38,6 +58,7 @@ async def create_annotation(
     Below, click on "Schema" for more detailed information about arguments
     or "Example Value" to get a concrete idea of arguments
     """
+    await check_annotated_media(payload.media_id)
     return await crud.create_entry(annotations, payload)
 
 
@@ -61,7 +82,7 @@ async def fetch_annotations(
     Retrieves the list of all annotations and their information
     """
     if await is_admin_access(requester.id):
-        return await crud.fetch_all(annotations)
+        return fast_response(await crud.fetch_all(annotations), AnnotationOut)
     else:
         return []
 
@@ -75,6 +96,7 @@ async def update_annotation(
     """
     Based on a annotation_id, updates information about the specified annotation
     """
+    await check_annotated_media(payload.media_id)
     return await crud.update_entry(annotations, payload, annotation_id)
 
 
@@ -85,29 +107,89 @@ async def delete_annotation(
     """
     Based on a annotation_id, deletes the specified annotation
     """
-    return await crud.delete_entry(annotations, annotation_id)
+    entry = await crud.delete_entry(annotations, annotation_id)
+    # The bucket file is removed asynchronously by the worker
+    await schedule_deletion(entry["bucket_key"])
+    return entry
+
+
+@router.post(
+    "/{annotation_id}/precheck",
+    response_model=AnnotationOut,
+    status_code=200,
+    responses={204: {"description": "Content not stored yet, the file has to be uploaded"}},
+    summary="Link an annotation to already stored content",
+)
+@admission(bucket_limiter)
+async def precheck_annotation_upload(
+    payload: ContentDigest,
+    annotation_id: int = Path(..., gt=0),
+    _=Security(get_current_access, scopes=[AccessType.admin, AccessType.user]),
+):
+    """
+    Check whether a file with this SHA256 and size is already stored, before uploading it.
 
+    If it is, the annotation is linked to the stored content and returned, so the upload can be skipped.
+    Otherwise, responds with 204 and the file has to be uploaded.
+    """
+    entry = await check_annotation_registration(annotation_id)
+    bucket_key = resolve_bucket_key(resolve_content_file_name(payload.sha256, payload.filename), "annotations")
+    if entry["bucket_key"] == bucket_key:
+        return entry
+    if not await is_content_stored(bucket_key, payload.size):
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
 
-@router.post("/{annotation_id}/upload", response_model=AnnotationOut, status_code=200)
+    entry_dict = dict(**entry)
+    entry_dict["bucket_key"] = bucket_key
+    entry_dict["status"] = UploadStatus.verified
+    updated_entry = await crud.update_entry(annotations, AnnotationCreation(**entry_dict), annotation_id)
+    await schedule_deletion(entry["bucket_key"])
+    return updated_entry
+
+
+@router.post(
+    "/{annotation_id}/upload",
+    response_model=AnnotationOut,
+    status_code=200,
+)
+@admission(upload_limiter, bucket_limiter)
 async def upload_annotation(
     background_tasks: BackgroundTasks,
     annotation_id: int = Path(..., gt=0),
     file: UploadFile = File(...),
+    _=Security(get_current_access, scopes=[AccessType.admin, AccessType.user]),
 ):
     """
     Upload a annotation (image or video) linked to an existing annotation object in the DB
+
+    The file can be sent gzip-compressed by setting `Content-Encoding: gzip` in the headers of the file part: it is
+    stored compressed, and served with this encoding so that HTTP clients decompress it on download.
     """
 
     # Check in DB
     entry = await check_annotation_registration(annotation_id)
 
-    # Concatenate the first 32 chars (to avoid system interactions issues) of SHA256 hash with file extension
-    file_hash = hash_content_file(file.file.read())
-    file_name = f"{file_hash[:32]}.{file.filename.rpartition('.')[-1]}"
-    # Reset byte position of the file (cf. https://fastapi.tiangolo.com/tutorial/request-files/#uploadfile)
-    await file.seek(0)
+    # Compressed uploads are stored as is, their encoding being declared in the headers of the file part
+    content_encoding = file.headers.get("content-encoding", "identity").lower()
+    if content_encoding not in SUPPORTED_ENCODINGS:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Unsupported content encoding: {content_encoding}",
+            headers={"Accept-Encoding": ", ".join(SUPPORTED_ENCODINGS)},
+        )
+    file_content = file.file.read()
+    if content_encoding == "gzip":
+        # Named after the decompressed content, but with a distinct key since the stored bytes differ
+        try:
+            file_hash = hash_gzip_content(file_content, cfg.MAX_DECOMPRESSED_SIZE)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        file_name = f"{resolve_content_file_name(file_hash, file.filename)}.gz"
+    else:
+        file_name = resolve_content_file_name(hash_content_file(file_content), file.filename)
     # Use MD5 to verify upload
-    md5_hash = hash_content_file(file.file.read(), use_md5=True)
+    md5_hash = hash_content_file(file_content, use_md5=True)
+    # Reset byte position of the file (cf. https://fastapi.tiangolo.com/tutorial/request-files/#uploadfile)
     await file.seek(0)
     # If files are in a subfolder of the bucket, prepend the folder path
     bucket_key = resolve_bucket_key(file_name, "annotations")
@@ -117,29 +199,30 @@ async def upload_annotation(
         return await crud.get_entry(annotations, annotation_id)
     else:
         # Failed upload
-        if not await s3_bucket.upload_file(bucket_key=bucket_key, file_binary=file.file):
+        if not await s3_bucket.upload_file(
+            bucket_key=bucket_key,
+            file_binary=file.file,
+            content_encoding=None if content_encoding == "identity" else content_encoding,
+        ):
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed upload")
-        # Data integrity check
-        file_meta = await s3_bucket.get_file_metadata(bucket_key)
-        # Corrupted file
-        if md5_hash != file_meta["ETag"].replace('"', ""):
-            # Delete the corrupted upload
-            await s3_bucket.delete_file(bucket_key)
-            # Raise the exception
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Data was corrupted during upload",
-            )
-        # If a file was previously uploaded, delete it
-        if isinstance(entry["bucket_key"], str):
-            await s3_bucket.delete_file(entry["bucket_key"])
 
         entry_dict = dict(**entry)
         entry_dict["bucket_key"] = bucket_key
-        return await crud.update_entry(annotations, AnnotationCreation(**entry_dict), annotation_id)
-
-
-@router.get("/{annotation_id}/url", response_model=AnnotationUrl, status_code=200)
+        entry_dict["status"] = UploadStatus.uploaded
+        updated_entry = await crud.update_entry(annotations, AnnotationCreation(**entry_dict), annotation_id)
+        # Data integrity check & removal of the previous file are done after sending the response
+        await schedule_upload_checks(
+            background_tasks, "annotations", annotation_id, bucket_key, md5_hash, len(file_content), entry["bucket_key"]
+        )
+        return updated_entry
+
+
+@router.get(
+    "/{annotation_id}/url",
+    response_model=AnnotationUrl,
+    status_code=200,
+)
+@admission(bucket_limiter)
 async def get_annotation_url(
     annotation_id: int = Path(..., gt=0),
     requester=Security(get_current_access, scopes=[AccessType.admin, AccessType.user]),
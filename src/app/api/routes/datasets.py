@@ -0,0 +1,194 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+import asyncio
+import json
+import logging
+from collections import deque
+from pathlib import PurePosixPath
+from typing import Any, AsyncIterator, Deque, List, Mapping, Optional, Tuple
+
+from fastapi import APIRouter, Path, Query, Security, status
+from fastapi.responses import StreamingResponse
+
+from app import config as cfg
+from app.api import crud
+from app.api.crud.authorizations import check_access_read
+from app.api.deps import AdmissionRoute, admission, get_current_access, get_rate_limited_access
+from app.api.ratelimit import bucket_limiter
+from app.api.responses import fast_response
+from app.api.schemas import AccessType, DatasetIn, DatasetItemUrl, DatasetOut
+from app.api.tasks import locate_contents, schedule_deletions, sign_contents
+from app.db import annotations, dataset_items, datasets, media
+from app.services import TAR_END, s3_bucket, tar_header, tar_padding
+
+router = APIRouter(route_class=AdmissionRoute)
+
+logger = logging.getLogger("uvicorn.warning")
+
+# Number of items resolved at once when streaming an archive
+ARCHIVE_PAGE_SIZE = 500
+
+
+def item_name(item: Mapping[str, Any]) -> str:
+    """Path of a dataset item in its archive"""
+    suffix = PurePosixPath(item["bucket_key"]).suffix
+    if item["annotation_id"] is None:
+        return f"media/{item['media_id']}{suffix}"
+    return f"annotations/{item['annotation_id']}{suffix}"
+
+
+async def locate_items(
+    items: List[Mapping[str, Any]]
+) -> List[Tuple[Mapping[str, Any], str, Optional[Tuple[int, int]]]]:
+    """Resolve the bucket file of each item, and its byte range for packed content"""
+    locations = await locate_contents([item["bucket_key"] for item in items])
+    return [(item, *locations[item["bucket_key"]]) for item in items]
+
+
+async def _write_member(name: str, opening: asyncio.Future) -> AsyncIterator[bytes]:
+    try:
+        size, chunks = await opening
+    except Exception as e:
+        # Removed from the bucket since the snapshot
+        logger.warning(f"Skipping '{name}' in dataset archive: {e}")
+        return
+    yield tar_header(name, size)
+    num_bytes = 0
+    async for chunk in chunks:
+        num_bytes += len(chunk)
+        yield chunk
+    # The headers are already sent: abort rather than emit a corrupted archive
+    if num_bytes != size:
+        raise RuntimeError(f"Truncated content of '{name}' ({num_bytes} / {size} bytes)")
+    yield tar_padding(size)
+
+
+async def stream_archive(dataset_id: int) -> AsyncIterator[bytes]:
+    """Relay the files of a dataset from the bucket as a tar archive, one chunk at a time. The next files are requested
+    while the current one is streamed, so that the bucket latency is only paid once."""
+    pending: Deque[Tuple[str, asyncio.Future]] = deque()
+    try:
+        after_id = 0
+        while True:
+            page = await crud.datasets.fetch_items(dataset_items, dataset_id, after_id, ARCHIVE_PAGE_SIZE)
+            for item, file_key, byte_range in await locate_items(page):
+                pending.append((item_name(item), asyncio.ensure_future(s3_bucket.stream_file(file_key, byte_range))))
+                if len(pending) > cfg.ARCHIVE_PREFETCH:
+                    async for chunk in _write_member(*pending.popleft()):
+                        yield chunk
+            if len(page) < ARCHIVE_PAGE_SIZE:
+                break
+            after_id = page[-1]["id"]
+        while len(pending) > 0:
+            async for chunk in _write_member(*pending.popleft()):
+                yield chunk
+        yield TAR_END
+    finally:
+        # Client disconnection
+        for _, opening in pending:
+            opening.cancel()
+
+
+@router.post("/", response_model=DatasetOut, status_code=status.HTTP_201_CREATED, summary="Snapshot a dataset")
+async def create_dataset(payload: DatasetIn, _=Security(get_current_access, scopes=[AccessType.admin])):
+    """
+    Freezes the verified media matching the filters (and their annotations) as a new version of the dataset
+
+    The content of a snapshot stays available even if the media are modified or deleted afterwards.
+    """
+    return await crud.datasets.create_snapshot(
+        datasets,
+        dataset_items,
+        media,
+        annotations,
+        payload.name,
+        json.loads(payload.filters.json(exclude_defaults=True)),
+        crud.media.filter_conditions(media, annotations, payload.filters),
+        payload.include_annotations,
+        payload.limit,
+    )
+
+
+@router.get("/", response_model=List[DatasetOut], summary="Get the list of all datasets")
+async def fetch_datasets(requester=Security(get_current_access, scopes=[AccessType.admin, AccessType.user])):
+    """
+    Retrieves the list of all dataset versions
+    """
+    await check_access_read(requester.id)
+    return fast_response(await crud.fetch_all(datasets), DatasetOut)
+
+
+@router.get("/{dataset_id}/", response_model=DatasetOut, summary="Get information about a specific dataset")
+async def get_dataset(
+    dataset_id: int = Path(..., gt=0),
+    requester=Security(get_current_access, scopes=[AccessType.admin, AccessType.user]),
+):
+    """
+    Based on a dataset_id, retrieves information about the specified dataset version
+    """
+    await check_access_read(requester.id)
+    return await crud.get_entry(datasets, dataset_id)
+
+
+@router.delete("/{dataset_id}/", response_model=DatasetOut, summary="Delete a specific dataset")
+async def delete_dataset(dataset_id: int = Path(..., gt=0), _=Security(get_current_access, scopes=[AccessType.admin])):
+    """
+    Based on a dataset_id, deletes the specified dataset version
+    """
+    entry = await crud.get_entry(datasets, dataset_id)
+    # Content that is not used anymore is removed asynchronously by the worker
+    await schedule_deletions(await crud.datasets.delete_snapshot(datasets, dataset_items, dataset_id))
+    return entry
+
+
+@router.get("/{dataset_id}/manifest", response_model=List[DatasetItemUrl], summary="Get the URLs of a dataset")
+async def get_dataset_manifest(
+    dataset_id: int = Path(..., gt=0),
+    after_id: int = Query(0, ge=0, description="ID of the last item of the previous page"),
+    limit: int = Query(ARCHIVE_PAGE_SIZE, gt=0, le=1000),
+    requester=Security(get_rate_limited_access, scopes=[AccessType.admin, AccessType.user]),
+):
+    """
+    Lists the files of a dataset version with temporary URLs, to be downloaded in parallel
+
+    Packed media are a byte range of their shard (`offset` & `size`). Items are listed by pages, the next one starts
+    after the `id` of the last item.
+    """
+    await check_access_read(requester.id)
+    await crud.get_entry(datasets, dataset_id)
+
+    items = await crud.datasets.fetch_items(dataset_items, dataset_id, after_id, limit)
+    urls = await sign_contents([item["bucket_key"] for item in items], cfg.MANIFEST_URL_EXPIRATION)
+    return fast_response(
+        (
+            {
+                "id": item["id"],
+                "media_id": item["media_id"],
+                "annotation_id": item["annotation_id"],
+                "name": item_name(item),
+                **urls[item["bucket_key"]],
+            }
+            for item in items
+        ),
+        DatasetItemUrl,
+    )
+
+
+@router.get("/{dataset_id}/archive", status_code=200)
+@admission(bucket_limiter)
+async def get_dataset_archive(
+    dataset_id: int = Path(..., gt=0),
+    requester=Security(get_current_access, scopes=[AccessType.admin, AccessType.user]),
+):
+    """Stream the files of a dataset version as a tar archive (media under `media/`, annotations under
+    `annotations/`), relayed from the bucket without buffering"""
+    await check_access_read(requester.id)
+    dataset = await crud.get_entry(datasets, dataset_id)
+    return StreamingResponse(
+        stream_archive(dataset_id),
+        media_type="application/x-tar",
+        headers={"Content-Disposition": f'attachment; filename="{dataset["name"]}-v{dataset["version"]}.tar"'},
+    )
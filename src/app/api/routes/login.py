@@ -4,6 +4,7 @@
 # See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
 
 from datetime import timedelta
+from typing import Any, Dict
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
@@ -37,3 +38,13 @@ async def create_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     )
 
     return {"access_token": token, "token_type": "bearer"}
+
+
+@router.get("/jwks", summary="Get the public keys verifying the access tokens")
+async def get_jwks() -> Dict[str, Any]:
+    """
+    Public keys of the asymmetric token signing keys, in the JSON Web Key Set format (RFC 7517)
+
+    Tokens can be verified without calling the API, using the key matching the `kid` of their header
+    """
+    return security.keyset.jwks()
@@ -3,19 +3,79 @@
 # This program is licensed under the Apache License 2.0.
 # See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
 
-from typing import Any, Dict, List
+import base64
+import hashlib
+import io
+from datetime import datetime
+from typing import Any, Dict, List, Literal, Mapping, Optional, Union
+from uuid import uuid4
 
-from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Path, Security, UploadFile, status
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    File,
+    Header,
+    HTTPException,
+    Path,
+    Query,
+    Request,
+    Response,
+    Security,
+    UploadFile,
+    status,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 
+from app import config as cfg
 from app.api import crud
 from app.api.crud.authorizations import check_access_read, is_admin_access
-from app.api.deps import get_current_access
-from app.api.schemas import AccessType, MediaCreation, MediaIn, MediaOut, MediaUrl
+from app.api.deps import AdmissionRoute, admission, get_current_access, get_rate_limited_access
+from app.api.ratelimit import bucket_limiter, upload_limiter
+from app.api.responses import fast_response
+from app.api.schemas import (
+    AccessType,
+    AnnotationOut,
+    ContentDigest,
+    MediaAnnotationsOut,
+    MediaContentUrl,
+    MediaCreation,
+    MediaDuplicateOut,
+    MediaIn,
+    MediaOut,
+    MediaUrl,
+    MediaUrlsQuery,
+    UploadStatus,
+)
 from app.api.security import hash_content_file
-from app.db import get_session, media
-from app.services import resolve_bucket_key, s3_bucket
+from app.api.tasks import (
+    is_content_stored,
+    locate_content,
+    schedule_deletion,
+    schedule_thumbnail,
+    schedule_upload_checks,
+    sign_contents,
+)
+from app.db import annotations, database, get_session, media
+from app.services import (
+    FILE_METADATA_FIELDS,
+    MAX_SEARCH_DISTANCE,
+    PHASH_FIELDS,
+    compute_dhash,
+    extract_file_metadata,
+    hash_fields,
+    resolve_bucket_key,
+    resolve_content_file_name,
+    s3_bucket,
+    thumbnail_key,
+)
+from app.services.bucket import StreamingUpload
 
-router = APIRouter()
+router = APIRouter(route_class=AdmissionRoute)
+
+# Attempts at registering an upload while the media is modified by concurrent requests
+MAX_REGISTRATION_ATTEMPTS = 3
 
 
 async def check_media_registration(media_id: int) -> Dict[str, Any]:
@@ -23,15 +83,78 @@ async def check_media_registration(media_id: int) -> Dict[str, Any]:
     return await crud.get_entry(media, media_id)
 
 
+async def check_near_duplicates(media_id: int, phash: Optional[int]) -> Optional[int]:
+    """Apply the near-duplicate policy to uploaded content, returns the closest near-duplicate (if tagged)"""
+    if phash is None or cfg.NEAR_DUPLICATE_POLICY == "none":
+        return None
+    near_duplicates = await crud.media.fetch_near_duplicates(
+        media, phash, cfg.NEAR_DUPLICATE_DISTANCE, exclude_id=media_id, limit=1
+    )
+    if len(near_duplicates) == 0:
+        return None
+    if cfg.NEAR_DUPLICATE_POLICY == "reject":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail=f"Near-duplicate of media {near_duplicates[0]['id']}"
+        )
+    return near_duplicates[0]["id"]
+
+
+async def register_media_upload(
+    background_tasks: BackgroundTasks,
+    entry: Mapping[str, Any],
+    bucket_key: str,
+    md5_hash: str,
+    file_metadata: Dict[str, Any],
+    phash: Optional[int],
+    duplicate_of: Optional[int],
+) -> Mapping[str, Any]:
+    """Point the media to its uploaded content, and schedule the post-upload jobs
+
+    The entry is only updated if it wasn't modified since it was read: otherwise (concurrent upload), it is read again
+    and the registration retried, the last upload wins.
+    """
+    for attempt in range(1, MAX_REGISTRATION_ATTEMPTS + 1):
+        entry_dict = dict(**entry)
+        entry_dict.update(file_metadata)
+        # The capture time declared by the device prevails over the EXIF one
+        if entry["captured_at"] is not None:
+            entry_dict["captured_at"] = entry["captured_at"]
+        entry_dict.update(hash_fields(phash))
+        entry_dict["duplicate_of"] = duplicate_of
+        entry_dict["bucket_key"] = bucket_key
+        entry_dict["status"] = UploadStatus.uploaded
+        try:
+            updated_entry = await crud.update_entry(
+                media, MediaCreation(**entry_dict), entry["id"], version=entry["version"]
+            )
+            break
+        except HTTPException as e:
+            latest = await crud.get(entry["id"], media) if e.status_code == status.HTTP_409_CONFLICT else None
+            # The same content was uploaded concurrently
+            if latest is not None and latest["bucket_key"] == bucket_key:
+                return dict(latest)
+            if latest is None or attempt == MAX_REGISTRATION_ATTEMPTS:
+                # Only the object of this upload is removed, the entry points to another one
+                await schedule_deletion(bucket_key)
+                raise
+            entry = latest
+    # Data integrity check & removal of the previous file are done after sending the response
+    await schedule_upload_checks(
+        background_tasks, "media", entry["id"], bucket_key, md5_hash, file_metadata["size_bytes"], entry["bucket_key"]
+    )
+    await schedule_thumbnail(bucket_key, entry["type"])
+    return updated_entry
+
+
 @router.post(
     "/",
     response_model=MediaOut,
     status_code=status.HTTP_201_CREATED,
     summary="Create a media related to a specific device",
 )
-async def create_media(payload: MediaIn, _=Security(get_current_access, scopes=[AccessType.admin])):
+async def create_media(payload: MediaIn, _=Security(get_rate_limited_access, scopes=[AccessType.admin])):
     """
-    Creates a media related to specific device, based on device_id as argument
+    Creates a media related to specific device, based on device_id as argument (and the capture time, if known)
 
     Below, click on "Schema" for more detailed information about arguments
     or "Example Value" to get a concrete idea of arguments
@@ -51,15 +174,75 @@ async def get_media(
     return await crud.get_entry(media, media_id)
 
 
-@router.get("/", response_model=List[MediaOut], summary="Get the list of all media")
+@router.get(
+    "/{media_id}/annotations", response_model=List[AnnotationOut], summary="Get the annotations of a specific media"
+)
+async def fetch_media_annotations(
+    media_id: int = Path(..., gt=0), requester=Security(get_current_access, scopes=[AccessType.admin, AccessType.user])
+):
+    """
+    Based on a media_id, retrieves the list of annotations related to the specified media
+    """
+    await check_access_read(requester.id)
+
+    return fast_response(await crud.media.fetch_annotations_of_media(media, annotations, media_id), AnnotationOut)
+
+
+@router.get(
+    "/{media_id}/duplicates",
+    response_model=List[MediaDuplicateOut],
+    summary="Get the near-duplicates of a specific media",
+)
+async def fetch_media_duplicates(
+    media_id: int = Path(..., gt=0),
+    max_distance: int = Query(cfg.NEAR_DUPLICATE_DISTANCE, ge=0, le=MAX_SEARCH_DISTANCE),
+    requester=Security(get_current_access, scopes=[AccessType.admin, AccessType.user]),
+):
+    """
+    Based on a media_id, retrieves the images that look the same (closest first), using their perceptual hash
+    """
+    await check_access_read(requester.id)
+
+    entry = await check_media_registration(media_id)
+    if entry["phash"] is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Media has no perceptual hash")
+    return fast_response(
+        await crud.media.fetch_near_duplicates(media, entry["phash"], max_distance, exclude_id=media_id),
+        MediaDuplicateOut,
+    )
+
+
+@router.get("/", response_model=List[Union[MediaAnnotationsOut, MediaOut]], summary="Get the list of all media")
 async def fetch_media(
-    requester=Security(get_current_access, scopes=[AccessType.admin, AccessType.user]), session=Depends(get_session)
+    include: Optional[Literal["annotations"]] = None,
+    device_id: Optional[int] = Query(None, gt=0),
+    content_type: Optional[str] = Query(None, max_length=50, example="image/jpeg"),
+    min_width: Optional[int] = Query(None, gt=0),
+    min_height: Optional[int] = Query(None, gt=0),
+    min_size: Optional[int] = Query(None, ge=0, description="minimum file size in bytes"),
+    max_size: Optional[int] = Query(None, ge=0, description="maximum file size in bytes"),
+    captured_after: Optional[datetime] = None,
+    captured_before: Optional[datetime] = None,
+    requester=Security(get_current_access, scopes=[AccessType.admin, AccessType.user]),
+    session=Depends(get_session),
 ):
     """
     Retrieves the list of all media and their information
+
+    Use `include=annotations` to resolve the annotations of each media in the same request.
+    Media can be filtered on their file properties (type, dimensions, size, capture time) and on the camera that took
+    them.
     """
     if await is_admin_access(requester.id):
-        return await crud.fetch_all(media)
+        conditions = crud.media.metadata_conditions(
+            media, content_type, min_width, min_height, min_size, max_size, captured_after, captured_before, device_id
+        )
+        if include == "annotations":
+            return fast_response(
+                await crud.media.fetch_all_with_annotations(media, annotations, conditions=conditions),
+                MediaAnnotationsOut,
+            )
+        return fast_response(await crud.fetch_all(media, conditions=conditions), MediaOut)
     return []
 
 
@@ -78,14 +261,66 @@ async def delete_media(media_id: int = Path(..., gt=0), _=Security(get_current_a
     """
     Based on a media_id, deletes the specified media
     """
-    return await crud.delete_entry(media, media_id)
+    await check_media_registration(media_id)
+    # Enforced by the API: partitioned tables can't be referenced by foreign keys
+    if await crud.fetch_one(annotations, {"media_id": media_id}) is not None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Media has annotations")
+    entry = await crud.delete_entry(media, media_id)
+    await crud.media.clear_duplicate_of(media, media_id)
+    # The bucket file is removed asynchronously by the worker
+    await schedule_deletion(entry["bucket_key"])
+    return entry
+
+
+@router.post(
+    "/{media_id}/precheck",
+    response_model=MediaOut,
+    status_code=200,
+    responses={204: {"description": "Content not stored yet, the file has to be uploaded"}},
+    summary="Link a media to already stored content",
+)
+@admission(bucket_limiter)
+async def precheck_media_upload(
+    payload: ContentDigest,
+    media_id: int = Path(..., gt=0),
+    _=Security(get_current_access, scopes=[AccessType.admin]),
+):
+    """
+    Check whether a file with this SHA256 and size is already stored, before uploading it.
+
+    If it is, the media is linked to the stored content and returned, so the upload can be skipped.
+    Otherwise, responds with 204 and the file has to be uploaded.
+    """
+    entry = await check_media_registration(media_id)
+    bucket_key = resolve_bucket_key(resolve_content_file_name(payload.sha256, payload.filename), "media")
+    if entry["bucket_key"] == bucket_key:
+        return entry
+    if not await is_content_stored(bucket_key, payload.size):
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    entry_dict = dict(**entry)
+    # The file properties are those of the stored content
+    source = await crud.fetch_one(media, {"bucket_key": bucket_key})
+    if source is not None:
+        entry_dict.update({key: source[key] for key in (*FILE_METADATA_FIELDS, *PHASH_FIELDS)})
+    entry_dict["bucket_key"] = bucket_key
+    entry_dict["status"] = UploadStatus.verified
+    updated_entry = await crud.update_entry(media, MediaCreation(**entry_dict), media_id, version=entry["version"])
+    await schedule_deletion(entry["bucket_key"])
+    return updated_entry
 
 
-@router.post("/{media_id}/upload", response_model=MediaOut, status_code=200)
+@router.post(
+    "/{media_id}/upload",
+    response_model=MediaOut,
+    status_code=200,
+)
+@admission(upload_limiter, bucket_limiter)
 async def upload_media(
     background_tasks: BackgroundTasks,
     media_id: int = Path(..., gt=0),
     file: UploadFile = File(...),
+    _=Security(get_current_access, scopes=[AccessType.admin]),
 ):
     """
     Upload a media (image or video) linked to an existing media object in the DB
@@ -94,14 +329,18 @@ async def upload_media(
     # Check in DB
     entry = await check_media_registration(media_id)
 
-    # Concatenate the first 32 chars (to avoid system interactions issues) of SHA256 hash with file extension
     file_hash = hash_content_file(file.file.read())
-    file_name = f"{file_hash[:32]}.{file.filename.rpartition('.')[-1]}"
+    file_name = resolve_content_file_name(file_hash, file.filename)
     # Reset byte position of the file (cf. https://fastapi.tiangolo.com/tutorial/request-files/#uploadfile)
     await file.seek(0)
     # Use MD5 to verify upload
-    md5_hash = hash_content_file(file.file.read(), use_md5=True)
+    file_content = file.file.read()
+    md5_hash = hash_content_file(file_content, use_md5=True)
     await file.seek(0)
+    # Image dimensions & capture time are read from the headers only
+    file_metadata = extract_file_metadata(file.file, file.filename)
+    # Decoding the pixels is CPU-bound
+    phash = await run_in_threadpool(compute_dhash, file.file)
     # If files are in a subfolder of the bucket, prepend the folder path
     bucket_key = resolve_bucket_key(file_name, "media")
 
@@ -109,38 +348,187 @@ async def upload_media(
     if isinstance(entry["bucket_key"], str) and entry["bucket_key"] == bucket_key:
         return await crud.get_entry(media, media_id)
     else:
+        duplicate_of = await check_near_duplicates(media_id, phash)
         # Failed upload
         if not await s3_bucket.upload_file(bucket_key=bucket_key, file_binary=file.file):
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed upload")
-        # Data integrity check
-        file_meta = await s3_bucket.get_file_metadata(bucket_key)
-        # Corrupted file
-        if md5_hash != file_meta["ETag"].replace('"', ""):
-            # Delete the corrupted upload
-            await s3_bucket.delete_file(bucket_key)
-            # Raise the exception
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Data was corrupted during upload",
-            )
-        # If a file was previously uploaded, delete it
-        if isinstance(entry["bucket_key"], str):
-            await s3_bucket.delete_file(entry["bucket_key"])
 
-        entry_dict = dict(**entry)
-        entry_dict["bucket_key"] = bucket_key
-        return await crud.update_entry(media, MediaCreation(**entry_dict), media_id)
+        return await register_media_upload(
+            background_tasks, entry, bucket_key, md5_hash, file_metadata, phash, duplicate_of
+        )
+
+
+@router.put(
+    "/{media_id}/content",
+    response_model=MediaOut,
+    status_code=200,
+)
+@admission(upload_limiter, bucket_limiter)
+async def put_media_content(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    media_id: int = Path(..., gt=0),
+    filename: str = Query(..., min_length=1, max_length=100, description="name of the file, for its extension"),
+    content_type: Optional[str] = Header(None),
+    content_length: Optional[int] = Header(None, ge=0),
+    content_md5: Optional[str] = Header(None, description="base64-encoded MD5 of the content (RFC 1864)"),
+    _=Security(get_current_access, scopes=[AccessType.admin]),
+):
+    """
+    Upload the content of a media (image or video) as the raw request body (`application/octet-stream`)
+
+    The body is hashed and sent to the bucket as it is received, without multipart parsing or temporary files.
+    """
+    if content_type is not None and content_type.partition(";")[0].strip() != "application/octet-stream":
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Content should be application/octet-stream"
+        )
+    entry = await check_media_registration(media_id)
+
+    sha256, md5 = hashlib.sha256(), hashlib.md5()  # nosec B324
+    size = 0
+    upload = StreamingUpload(s3_bucket, resolve_bucket_key(f"uploads/{uuid4().hex}", "media"), cfg.UPLOAD_PART_SIZE)
+    try:
+        async for chunk in request.stream():
+            sha256.update(chunk)
+            md5.update(chunk)
+            size += len(chunk)
+            await upload.write(chunk)
+
+        if content_length is not None and size != content_length:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Content-Length mismatch")
+        if content_md5 is not None and content_md5 != base64.b64encode(md5.digest()).decode():
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Content-MD5 mismatch")
 
+        bucket_key = resolve_bucket_key(resolve_content_file_name(sha256.hexdigest(), filename), "media")
+        # Same content
+        if isinstance(entry["bucket_key"], str) and entry["bucket_key"] == bucket_key:
+            await upload.abort()
+            return entry
 
-@router.get("/{media_id}/url", response_model=MediaUrl, status_code=200)
+        # Properties are read from the beginning of the file, the hash needs all of it
+        file_metadata = extract_file_metadata(io.BytesIO(upload.head or upload.getvalue()), filename)
+        file_metadata["size_bytes"] = size
+        phash = (
+            await run_in_threadpool(compute_dhash, io.BytesIO(upload.getvalue()))
+            if upload.is_complete_in_memory
+            else None
+        )
+        duplicate_of = await check_near_duplicates(media_id, phash)
+    except BaseException:
+        await upload.abort()
+        raise
+
+    if not await upload.finalize(bucket_key):
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed upload")
+
+    return await register_media_upload(
+        background_tasks, entry, bucket_key, md5.hexdigest(), file_metadata, phash, duplicate_of
+    )
+
+
+@router.get(
+    "/{media_id}/url",
+    response_model=MediaUrl,
+    status_code=200,
+)
+@admission(bucket_limiter)
 async def get_media_url(
-    media_id: int = Path(..., gt=0), requester=Security(get_current_access, scopes=[AccessType.admin, AccessType.user])
+    media_id: int = Path(..., gt=0),
+    requester=Security(get_current_access, scopes=[AccessType.admin, AccessType.user]),
 ):
     """Resolve the temporary media image URL"""
     await check_access_read(requester.id)
 
     # Check in DB
     media_instance = await check_media_registration(media_id)
+    if not isinstance(media_instance["bucket_key"], str):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Media has no content")
+    file_key, byte_range = await locate_content(media_instance["bucket_key"])
     # Check in bucket
-    temp_public_url = await s3_bucket.get_public_url(media_instance["bucket_key"])
-    return MediaUrl(url=temp_public_url)
+    temp_public_url = await s3_bucket.get_public_url(file_key)
+    if byte_range is None:
+        return MediaUrl(url=temp_public_url)
+    return MediaUrl(url=temp_public_url, offset=byte_range[0], size=byte_range[1])
+
+
+@router.post("/urls", response_model=List[MediaContentUrl], status_code=200, summary="Resolve the URLs of many media")
+async def get_media_urls(
+    payload: MediaUrlsQuery,
+    requester=Security(get_rate_limited_access, scopes=[AccessType.admin, AccessType.user]),
+):
+    """
+    Resolves the temporary URLs of a batch of verified media, selected by ID or by filters, in the order of the IDs
+
+    Use `after_id` (the last `media_id` of the previous batch) to go through a large selection.
+    Packed media are a byte range of their shard (`offset` & `size`).
+    """
+    await check_access_read(requester.id)
+
+    query = (
+        media.select()
+        .where(media.c.status == UploadStatus.verified)
+        .where(media.c.bucket_key.isnot(None))
+        .where(media.c.id > payload.after_id)
+        .order_by(media.c.id)
+        .limit(payload.limit)
+    )
+    if payload.ids is not None:
+        query = query.where(media.c.id.in_(payload.ids))
+    for condition in crud.media.filter_conditions(media, annotations, payload.filters):
+        query = query.where(condition)
+    entries = await database.fetch_all(query=query)
+    urls = await sign_contents([entry["bucket_key"] for entry in entries], cfg.MANIFEST_URL_EXPIRATION)
+    return fast_response(
+        (
+            {
+                "media_id": entry["id"],
+                "content_name": entry["bucket_key"].rpartition("/")[-1],
+                "size_bytes": entry["size_bytes"],
+                **urls[entry["bucket_key"]],
+            }
+            for entry in entries
+        ),
+        MediaContentUrl,
+    )
+
+
+@router.get("/{media_id}/content", status_code=200)
+@admission(bucket_limiter)
+async def get_media_content(
+    media_id: int = Path(..., gt=0),
+    requester=Security(get_current_access, scopes=[AccessType.admin, AccessType.user]),
+):
+    """Stream the media content, wherever it is stored (individual file or shard)"""
+    await check_access_read(requester.id)
+
+    media_instance = await check_media_registration(media_id)
+    if not isinstance(media_instance["bucket_key"], str):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Media has no content")
+    file_key, byte_range = await locate_content(media_instance["bucket_key"])
+    size, chunks = await s3_bucket.stream_file(file_key, byte_range)
+    return StreamingResponse(
+        chunks,
+        media_type=media_instance["content_type"] or "application/octet-stream",
+        headers={"Content-Length": str(size)},
+    )
+
+
+@router.get(
+    "/{media_id}/thumbnail",
+    response_model=MediaUrl,
+    status_code=200,
+)
+@admission(bucket_limiter)
+async def get_media_thumbnail_url(
+    media_id: int = Path(..., gt=0),
+    requester=Security(get_current_access, scopes=[AccessType.admin, AccessType.user]),
+):
+    """Resolve the temporary URL of the media thumbnail (JPEG, generated by the worker after the upload)"""
+    await check_access_read(requester.id)
+
+    media_instance = await check_media_registration(media_id)
+    if not isinstance(media_instance["bucket_key"], str):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Media has no content")
+    # Not found until the worker has generated it
+    return MediaUrl(url=await s3_bucket.get_public_url(thumbnail_key(media_instance["bucket_key"])))
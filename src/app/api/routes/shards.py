@@ -0,0 +1,41 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+from typing import List
+
+from fastapi import APIRouter, Path, Security
+
+from app.api import crud
+from app.api.crud.authorizations import check_access_read
+from app.api.deps import AdmissionRoute, admission, get_current_access
+from app.api.ratelimit import bucket_limiter
+from app.api.responses import fast_response
+from app.api.schemas import AccessType, MediaUrl, ShardOut
+from app.db import shards
+from app.services import s3_bucket
+
+router = APIRouter(route_class=AdmissionRoute)
+
+
+@router.get("/", response_model=List[ShardOut], summary="Get the list of all shards")
+async def fetch_shards(requester=Security(get_current_access, scopes=[AccessType.admin, AccessType.user])):
+    """
+    Retrieves the list of the shards (tar archives packing small media files), which can be streamed sequentially
+    """
+    await check_access_read(requester.id)
+    return fast_response(await crud.fetch_all(shards), ShardOut)
+
+
+@router.get("/{shard_id}/url", response_model=MediaUrl, status_code=200)
+@admission(bucket_limiter)
+async def get_shard_url(
+    shard_id: int = Path(..., gt=0),
+    requester=Security(get_current_access, scopes=[AccessType.admin, AccessType.user]),
+):
+    """Resolve the temporary URL of a shard"""
+    await check_access_read(requester.id)
+
+    shard = await crud.get_entry(shards, shard_id)
+    return MediaUrl(url=await s3_bucket.get_public_url(shard["bucket_key"]))
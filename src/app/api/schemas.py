@@ -4,11 +4,11 @@
 # See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
 
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, Field, validator
 
-from app.db.models import AccessType, MediaType
+from app.db.models import AccessType, JobKind, MediaType, UploadStatus
 
 
 # Template classes
@@ -70,19 +70,107 @@ class BaseMedia(BaseModel):
 
 
 class MediaIn(BaseMedia):
-    pass
+    device_id: Optional[int] = Field(None, gt=0, description="camera that took the media")
+    captured_at: Optional[datetime] = Field(None, description="capture time, takes precedence over the EXIF one")
+
+
+class _Status(BaseModel):
+    status: Optional[UploadStatus] = None
+
+
+class _FileMetadata(BaseModel):
+    size_bytes: Optional[int] = Field(None, ge=0)
+    content_type: Optional[str] = Field(None, max_length=50, example="image/jpeg")
+    width: Optional[int] = Field(None, gt=0)
+    height: Optional[int] = Field(None, gt=0)
+    captured_at: Optional[datetime] = None
+
+
+class _PerceptualHash(BaseModel):
+    phash: Optional[int] = None
+    phash_band0: Optional[int] = None
+    phash_band1: Optional[int] = None
+    phash_band2: Optional[int] = None
+    phash_band3: Optional[int] = None
+
+
+class _DuplicateOf(BaseModel):
+    duplicate_of: Optional[int] = Field(None, gt=0, description="media this one is a near-duplicate of")
 
 
-class MediaCreation(MediaIn):
+class MediaCreation(MediaIn, _Status, _FileMetadata, _PerceptualHash, _DuplicateOf):
     bucket_key: str = Field(...)
 
 
-class MediaOut(MediaIn, _CreatedAt, _Id):
+class MediaOut(MediaIn, _Status, _FileMetadata, _DuplicateOf, _CreatedAt, _Id):
     pass
 
 
+class MediaDuplicateOut(MediaOut):
+    distance: int = Field(..., ge=0, description="Hamming distance between the perceptual hashes")
+
+
 class MediaUrl(BaseModel):
     url: str
+    # Packed media are a byte range of their shard (HTTP Range: bytes=offset-(offset + size - 1))
+    offset: Optional[int] = Field(None, ge=0, description="position of the content in the file")
+    size: Optional[int] = Field(None, ge=0, description="size of the content in the file")
+
+
+class MediaFilters(BaseModel):
+    type: Optional[MediaType] = None
+    device_id: Optional[int] = Field(None, gt=0)
+    content_type: Optional[str] = Field(None, max_length=50, example="image/jpeg")
+    min_width: Optional[int] = Field(None, gt=0)
+    min_height: Optional[int] = Field(None, gt=0)
+    min_size: Optional[int] = Field(None, ge=0, description="minimum file size in bytes")
+    max_size: Optional[int] = Field(None, ge=0, description="maximum file size in bytes")
+    captured_after: Optional[datetime] = None
+    captured_before: Optional[datetime] = None
+    annotated: bool = Field(False, description="only select media with a verified annotation")
+
+
+class MediaUrlsQuery(BaseModel):
+    ids: Optional[List[int]] = Field(None, min_items=1, max_items=1000, description="media to resolve")
+    filters: MediaFilters = MediaFilters()
+    # Keyset pagination, in the order of the IDs
+    after_id: int = Field(0, ge=0)
+    limit: int = Field(500, gt=0, le=1000)
+
+
+class MediaContentUrl(MediaUrl):
+    media_id: int = Field(..., gt=0)
+    content_name: str = Field(..., description="name of the content: SHA256 prefix (32 chars) & extension")
+    size_bytes: Optional[int] = Field(None, ge=0)
+
+
+# Shards
+class ShardOut(_CreatedAt, _Id):
+    size: int = Field(..., ge=0)
+    num_items: int = Field(..., ge=0)
+
+
+# Datasets
+class DatasetIn(BaseModel):
+    name: str = Field(..., min_length=1, max_length=50, regex=r"^[\w.-]+$", example="wildfire-frames")
+    filters: MediaFilters = MediaFilters()
+    include_annotations: bool = True
+    limit: Optional[int] = Field(None, gt=0, description="max number of media")
+
+
+class DatasetOut(_CreatedAt, _Id):
+    name: str
+    version: int = Field(..., gt=0)
+    filters: Dict[str, Any]
+    num_items: int = Field(..., ge=0)
+    size_bytes: Optional[int] = Field(None, ge=0, description="total size of the media")
+
+
+class DatasetItemUrl(MediaUrl):
+    id: int = Field(..., gt=0, description="position of the item in the dataset, to resume the listing from")
+    media_id: int = Field(..., gt=0)
+    annotation_id: Optional[int] = Field(None, gt=0)
+    name: str = Field(..., description="path of the file in the dataset archive")
 
 
 # Annotation
@@ -90,13 +178,29 @@ class AnnotationIn(BaseModel):
     media_id: int = Field(..., gt=0)
 
 
-class AnnotationCreation(AnnotationIn):
+class AnnotationCreation(AnnotationIn, _Status):
     bucket_key: str = Field(...)
 
 
-class AnnotationOut(AnnotationIn, _CreatedAt, _Id):
+class AnnotationOut(AnnotationIn, _Status, _CreatedAt, _Id):
     pass
 
 
 class AnnotationUrl(BaseModel):
     url: str
+
+
+class ContentDigest(BaseModel):
+    sha256: str = Field(..., regex="^[0-9a-f]{64}$", description="SHA256 of the file content")
+    size: int = Field(..., ge=0, description="size of the file in bytes")
+    filename: str = Field(..., min_length=1, max_length=255, example="frame.jpg")
+
+
+class MediaAnnotationsOut(MediaOut):
+    annotations: List[AnnotationOut]
+
+
+# Jobs
+class JobCreation(BaseModel):
+    kind: JobKind
+    payload: Dict[str, Any]
@@ -4,16 +4,84 @@
 # See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
 
 import hashlib
+import zlib
 from datetime import datetime, timedelta
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from jose import jwt
+from jose import JWTError, jwk, jwt
+from jose.backends.base import Key
 from passlib.context import CryptContext
 
 from app import config as cfg
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+HMAC_ALGORITHMS = {"HS256", "HS384", "HS512"}
+ASYMMETRIC_ALGORITHMS = {"RS256", "RS384", "RS512", "ES256", "ES384", "ES512"}
+
+
+class KeySet:
+    """Keys signing & verifying the access tokens, identified by their key ID (kid, in the token header)
+
+    Tokens are signed with the active key and verified with the key they designate, so that keys can be rotated: the
+    new key is added, then made active, and the previous one is removed once the tokens it signed have expired.
+
+    Args:
+        keys: list of {"kid": key ID, "alg": algorithm, "key": secret (HS*) or PEM key (RS*, ES*)}. Public keys
+            can only be used for verification.
+        signing_kid: key ID of the active key, defaults to the first key
+    """
+
+    def __init__(self, keys: List[Dict[str, str]], signing_kid: Optional[str] = None) -> None:
+        # Algorithm, signing key & verifying key of each key ID
+        self._keys: Dict[str, Tuple[str, Key, Key]] = {}
+        for key in keys:
+            if key["alg"] not in HMAC_ALGORITHMS | ASYMMETRIC_ALGORITHMS:
+                raise ValueError(f"unsupported signing algorithm: {key['alg']}")
+            signing_key = jwk.construct(key["key"], key["alg"])
+            # Asymmetric signatures can only be verified with the public key
+            verifying_key = signing_key.public_key() if key["alg"] in ASYMMETRIC_ALGORITHMS else signing_key
+            self._keys[key["kid"]] = (key["alg"], signing_key, verifying_key)
+        if len(self._keys) == 0:
+            raise ValueError("at least one key is required")
+        self.signing_kid = signing_kid or keys[0]["kid"]
+        if self.signing_kid not in self._keys:
+            raise ValueError(f"unknown signing key ID: {self.signing_kid}")
+
+    def encode(self, claims: Dict[str, Any]) -> str:
+        alg, key, _ = self._keys[self.signing_kid]
+        # Nodes that only verify tokens can be configured with the public keys
+        if alg in ASYMMETRIC_ALGORITHMS and key.is_public():
+            raise ValueError("the signing key should be a private key")
+        return jwt.encode(claims, key, algorithm=alg, headers={"kid": self.signing_kid})
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        """Verify a token and return its claims
+
+        Raises:
+            JWTError: if the token is invalid, expired, or signed with an unknown key
+        """
+        # Tokens issued before the introduction of key IDs
+        kid = jwt.get_unverified_header(token).get("kid", self.signing_kid)
+        if kid not in self._keys:
+            raise JWTError(f"unknown key ID: {kid}")
+        alg, _, key = self._keys[kid]
+        # Only the algorithm of the key is accepted, to prevent algorithm confusion
+        return jwt.decode(token, key, algorithms=[alg])
+
+    def jwks(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Public keys in the JSON Web Key Set format (secret keys are never exposed)"""
+        return {
+            "keys": [
+                {**key.to_dict(), "kid": kid, "use": "sig"}
+                for kid, (alg, _, key) in self._keys.items()
+                if alg in ASYMMETRIC_ALGORITHMS
+            ]
+        }
+
+
+keyset = KeySet(cfg.JWT_KEYS, cfg.JWT_SIGNING_KID)
+
 
 async def create_unlimited_access_token(content: Dict[str, Any]) -> str:
     # Used for devices
@@ -25,7 +93,7 @@ async def create_access_token(content: Dict[str, Any], expires_delta: Optional[t
     if expires_delta is None:
         expires_delta = timedelta(minutes=cfg.ACCESS_TOKEN_EXPIRE_MINUTES)
     expire = datetime.utcnow() + expires_delta
-    return jwt.encode({**content, "exp": expire}, cfg.SECRET_KEY, algorithm=cfg.JWT_ENCODING_ALGORITHM)
+    return keyset.encode({**content, "exp": expire})
 
 
 async def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -39,3 +107,29 @@ async def hash_password(password: str) -> str:
 def hash_content_file(content: bytes, use_md5: bool = False) -> str:
     hash_fn = hashlib.md5 if use_md5 else hashlib.sha256
     return hash_fn(content).hexdigest()
+
+
+def hash_gzip_content(content: bytes, max_size: int, chunk_size: int = 1024 * 1024) -> str:
+    """Compute the SHA256 of the decompressed content, without holding it in memory
+
+    Raises:
+        ValueError: if the content is not valid gzip, or decompresses to more than max_size bytes
+    """
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    sha256 = hashlib.sha256()
+    size = 0
+    data = content
+    while len(data) > 0 and not decompressor.eof:
+        # Bound the size of each output chunk
+        try:
+            chunk = decompressor.decompress(data, chunk_size)
+        except zlib.error as e:
+            raise ValueError(f"invalid gzip content: {e}")
+        size += len(chunk)
+        if size > max_size:
+            raise ValueError(f"decompressed content exceeds {max_size} bytes")
+        sha256.update(chunk)
+        data = decompressor.unconsumed_tail
+    if not decompressor.eof:
+        raise ValueError("truncated gzip content")
+    return sha256.hexdigest()
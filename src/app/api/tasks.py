@@ -0,0 +1,457 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+import asyncio
+import io
+import logging
+import tempfile
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Mapping, Optional, Set, Tuple
+
+from fastapi import BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Table, func, select, union
+
+from app import config as cfg
+from app.api import crud
+from app.db import annotations, database, dataset_items, jobs, media, shard_items, shards
+from app.db.models import JobKind, MediaType, UploadStatus
+from app.services import Throttle, render_thumbnail, s3_bucket, thumbnail_key, write_shard
+
+__all__ = [
+    "schedule_upload_checks",
+    "schedule_deletion",
+    "schedule_deletions",
+    "schedule_thumbnail",
+    "run_job",
+    "execute_job",
+    "delete_files",
+    "is_content_stored",
+    "locate_content",
+    "locate_contents",
+    "sign_contents",
+    "create_partitions",
+]
+
+logger = logging.getLogger("uvicorn.warning")
+
+# Tables holding bucket keys, referred to by name in job payloads
+TABLES: Dict[str, Table] = {"media": media, "annotations": annotations}
+# Bucket folders of each table (cf. resolve_bucket_key)
+BUCKET_FOLDERS: List[str] = list(TABLES.keys())
+# Dataset snapshots keep the content they refer to on the bucket
+REFERENCING_TABLES: List[Table] = [*TABLES.values(), dataset_items]
+# Tables partitioned by month of creation
+PARTITIONED_TABLES: List[Table] = [media, annotations]
+
+# Shared by all the jobs of the process so that maintenance never competes with live traffic
+bucket_throttle = Throttle(cfg.WORKER_S3_RATE)
+# Bounds the size of the shard index fetched at once
+SHARD_MAX_ITEMS = 10000
+
+
+async def get_referenced_keys(bucket_keys: List[str]) -> Set[str]:
+    """Return the bucket keys that are still used by an entry (identical content shares the same key)"""
+    if len(bucket_keys) == 0:
+        return set()
+    query = union(
+        *[select([table.c.bucket_key]).where(table.c.bucket_key.in_(bucket_keys)) for table in REFERENCING_TABLES]
+    )
+    return {row[0] for row in await database.fetch_all(query=query)}
+
+
+async def is_content_stored(bucket_key: str, size: int) -> bool:
+    """Check whether verified content is stored under a bucket key, so that it can be shared without a transfer"""
+    for table in TABLES.values():
+        query = (
+            select([table.c.id])
+            .where(table.c.bucket_key == bucket_key)
+            .where(table.c.status == UploadStatus.verified)
+            .limit(1)
+        )
+        if await database.fetch_val(query=query) is not None:
+            break
+    else:
+        return False
+    location = await crud.shards.locate(shard_items, shards, bucket_key)
+    if location is not None:
+        return location["size"] == size
+    # The entry could be outdated
+    try:
+        file_meta = await s3_bucket.get_file_metadata(bucket_key)
+    except Exception as e:
+        logger.warning(e)
+        return False
+    return file_meta["ContentLength"] == size
+
+
+async def locate_content(bucket_key: str) -> Tuple[str, Optional[Tuple[int, int]]]:
+    """Resolve where content is stored: its own bucket file, or a byte range (offset, size) of a shard"""
+    location = await crud.shards.locate(shard_items, shards, bucket_key)
+    if location is None:
+        return bucket_key, None
+    return location["shard_key"], (location["offset"], location["size"])
+
+
+async def locate_contents(bucket_keys: List[str]) -> Dict[str, Tuple[str, Optional[Tuple[int, int]]]]:
+    """Resolve where several contents are stored at once (cf. locate_content)"""
+    locations = await crud.shards.locate_many(shard_items, shards, bucket_keys)
+    return {
+        key: (key, None)
+        if key not in locations
+        else (locations[key]["shard_key"], (locations[key]["offset"], locations[key]["size"]))
+        for key in bucket_keys
+    }
+
+
+async def sign_contents(bucket_keys: List[str], url_expiration: int = 3600) -> Dict[str, Dict[str, Any]]:
+    """Sign the temporary URLs of several contents at once, along with their byte range for packed content. URLs are
+    signed locally, without checking each file on the bucket."""
+    locations = await locate_contents(bucket_keys)
+    file_keys = {file_key for file_key, _ in locations.values()}
+    urls = await run_in_threadpool(lambda: {key: s3_bucket.presign_url(key, url_expiration) for key in file_keys})
+    return {
+        key: {
+            "url": urls[file_key],
+            "offset": None if byte_range is None else byte_range[0],
+            "size": None if byte_range is None else byte_range[1],
+        }
+        for key, (file_key, byte_range) in locations.items()
+    }
+
+
+def get_derived_keys(bucket_key: str) -> List[str]:
+    """Bucket keys of the files generated from a media file"""
+    return [thumbnail_key(bucket_key)] if bucket_key.startswith("media/") else []
+
+
+async def delete_files(bucket_keys: List[str]) -> List[str]:
+    """Delete unreferenced bucket files (and their derivatives) in batches, and return the keys that failed"""
+    referenced_keys = await get_referenced_keys(bucket_keys)
+    if len(referenced_keys) > 0:
+        logger.info(f"Skipping deletion of {len(referenced_keys)} files still referenced")
+    to_delete = [key for key in bucket_keys if key not in referenced_keys]
+    if len(to_delete) == 0:
+        return []
+    # Packed content is removed from its shard, which is deleted once empty
+    empty_shards = await crud.shards.release(shards, shard_items, to_delete)
+    await bucket_throttle.acquire()
+    return await s3_bucket.delete_files(
+        to_delete + empty_shards + [derived for key in to_delete for derived in get_derived_keys(key)]
+    )
+
+
+async def delete_file(payload: Dict[str, Any]) -> None:
+    if len(await get_referenced_keys([payload["bucket_key"]])) > 0:
+        logger.info(f"Skipping deletion of '{payload['bucket_key']}', still referenced")
+        return
+    empty_shards = await crud.shards.release(shards, shard_items, [payload["bucket_key"]])
+    for bucket_key in [payload["bucket_key"], *get_derived_keys(payload["bucket_key"]), *empty_shards]:
+        await bucket_throttle.acquire()
+        await s3_bucket.delete_file(bucket_key)
+
+
+async def verify_upload(payload: Dict[str, Any]) -> None:
+    """Compare the uploaded object with the hash computed on reception, then clean up the previous object"""
+    table = TABLES[payload["table"]]
+    await bucket_throttle.acquire()
+    file_meta = await s3_bucket.get_file_metadata(payload["bucket_key"])
+    etag = file_meta["ETag"].replace('"', "")
+    # Multipart uploads have an ETag of the form "<md5 of part md5s>-<nb of parts>", only the size can be checked
+    if "-" in etag:
+        is_valid = payload.get("size") is None or file_meta["ContentLength"] == payload["size"]
+    else:
+        is_valid = etag == payload["md5"]
+
+    # Only update the entry if it still points to this upload
+    query = table.update().where(table.c.id == payload["entry_id"]).where(table.c.bucket_key == payload["bucket_key"])
+    if is_valid:
+        await database.execute(query=query.values(status=UploadStatus.verified))
+        if isinstance(payload.get("previous_key"), str):
+            await delete_file({"bucket_key": payload["previous_key"]})
+    else:
+        logger.warning(f"Data was corrupted during upload of '{payload['bucket_key']}'")
+        # Roll back to the previous content
+        values = {"bucket_key": payload.get("previous_key"), "status": UploadStatus.corrupted}
+        if "version" in table.c:
+            values["version"] = table.c.version + 1
+        await database.execute(query=query.values(**values))
+        await delete_file({"bucket_key": payload["bucket_key"]})
+
+
+async def scan_orphans(payload: Dict[str, Any]) -> None:
+    """Look for bucket files that are not referenced anymore, one page at a time"""
+    await bucket_throttle.acquire()
+    bucket_files, next_token = await s3_bucket.list_files(payload["prefix"], payload.get("continuation_token"))
+    # Files being uploaded are written to the bucket before the DB entry is updated
+    max_modified = datetime.now(timezone.utc) - timedelta(seconds=cfg.ORPHAN_GRACE_PERIOD)
+    candidates = [file["Key"] for file in bucket_files if file["LastModified"] < max_modified]
+    referenced_keys = await get_referenced_keys(candidates)
+    orphans = [key for key in candidates if key not in referenced_keys]
+    if len(orphans) > 0:
+        logger.info(f"Found {len(orphans)} orphan files in '{payload['prefix']}'")
+        await crud.jobs.enqueue_many(jobs, JobKind.delete_file, [{"bucket_key": key} for key in orphans])
+    # Next page
+    if isinstance(next_token, str):
+        await crud.jobs.enqueue(
+            jobs, JobKind.scan_orphans, {"prefix": payload["prefix"], "continuation_token": next_token}
+        )
+
+
+async def reverify(payload: Dict[str, Any]) -> None:
+    """Check that the files of a batch of entries are still on the bucket"""
+    table = TABLES[payload["table"]]
+    query = (
+        select([table.c.id, table.c.bucket_key])
+        .where(table.c.id > payload.get("after_id", 0))
+        .where(table.c.bucket_key.isnot(None))
+        .order_by(table.c.id)
+        .limit(cfg.REVERIFICATION_BATCH_SIZE)
+    )
+    entries = await database.fetch_all(query=query)
+    missing_ids = []
+    # Packed content is checked through its shard, once per batch
+    checked_files: Dict[str, bool] = {}
+    for entry in entries:
+        file_key, _ = await locate_content(entry["bucket_key"])
+        if file_key not in checked_files:
+            await bucket_throttle.acquire()
+            checked_files[file_key] = await s3_bucket.check_file_existence(file_key)
+        if not checked_files[file_key]:
+            missing_ids.append(entry["id"])
+    if len(missing_ids) > 0:
+        logger.warning(f"{len(missing_ids)} files of table {table.name} are missing from the bucket")
+        await database.execute(
+            query=table.update().where(table.c.id.in_(missing_ids)).values(status=UploadStatus.missing)
+        )
+    # Next batch
+    if len(entries) == cfg.REVERIFICATION_BATCH_SIZE:
+        await crud.jobs.enqueue(jobs, JobKind.reverify, {"table": payload["table"], "after_id": entries[-1]["id"]})
+
+
+async def generate_thumbnail(payload: Dict[str, Any]) -> None:
+    """Render the thumbnail of a media file, unless the same content already has one"""
+    derived_key = thumbnail_key(payload["bucket_key"])
+    await bucket_throttle.acquire()
+    if await s3_bucket.check_file_existence(derived_key):
+        return
+    # The content was replaced or removed in the meantime
+    if len(await get_referenced_keys([payload["bucket_key"]])) == 0:
+        return
+    await bucket_throttle.acquire()
+    content = await s3_bucket.download_file(*await locate_content(payload["bucket_key"]))
+    thumbnail = await render_thumbnail(content, payload["media_type"] == MediaType.video)
+    await bucket_throttle.acquire()
+    if not await s3_bucket.upload_file(bucket_key=derived_key, file_binary=io.BytesIO(thumbnail)):
+        raise RuntimeError(f"Failed upload of '{derived_key}'")
+
+
+@asynccontextmanager
+async def try_lock(name: str) -> AsyncIterator[bool]:
+    """Take a lock shared by all the workers without waiting for it, yields whether it was acquired"""
+    key = func.hashtext(name)
+    # Session lock: the queries of the block run on the same connection, and it's released if the worker dies
+    async with database.connection():
+        acquired = await database.fetch_val(query=select([func.pg_try_advisory_lock(key)]))
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                await database.fetch_val(query=select([func.pg_advisory_unlock(key)]))
+
+
+async def pack_shards(payload: Dict[str, Any]) -> None:
+    """Pack small media files into a shard (tar archive), then delete the individual files"""
+    # Concurrent jobs would pack the same candidates
+    async with try_lock("pack_shards") as acquired:
+        if not acquired:
+            logger.info("Shards are already being packed")
+            return
+        await _pack_shard()
+
+
+async def _pack_shard() -> None:
+    candidates = await crud.shards.fetch_packing_candidates(
+        media, shard_items, cfg.PACKING_MAX_ITEM_SIZE, limit=SHARD_MAX_ITEMS
+    )
+    batch: List[Mapping[str, Any]] = []
+    total_size = 0
+    for candidate in candidates:
+        if total_size + candidate["size"] > cfg.SHARD_SIZE and len(batch) > 0:
+            break
+        batch.append(candidate)
+        total_size += candidate["size"]
+    is_full = len(batch) < len(candidates) or len(batch) == SHARD_MAX_ITEMS or total_size >= cfg.SHARD_SIZE
+    # Wait for enough content, unless it has been waiting for too long
+    if len(batch) == 0 or (
+        not is_full and batch[0]["created_at"] > datetime.utcnow() - timedelta(seconds=cfg.SHARD_MAX_WAIT)
+    ):
+        return
+
+    items = []
+    for candidate in batch:
+        await bucket_throttle.acquire()
+        try:
+            items.append((candidate["bucket_key"], await s3_bucket.download_file(candidate["bucket_key"])))
+        except Exception as e:
+            # Deleted in the meantime
+            logger.warning(f"Unable to pack '{candidate['bucket_key']}': {e}")
+    if len(items) == 0:
+        return
+    shard_key = f"shards/{uuid.uuid4().hex}.tar"
+    with tempfile.SpooledTemporaryFile(max_size=cfg.UPLOAD_PART_SIZE) as archive:
+        index = write_shard(items, archive)
+        shard_size = archive.tell()
+        archive.seek(0)
+        await bucket_throttle.acquire()
+        if not await s3_bucket.upload_file(bucket_key=shard_key, file_binary=archive):
+            raise RuntimeError(f"Failed upload of '{shard_key}'")
+    try:
+        shard_id = await crud.shards.register_shard(shards, shard_items, shard_key, shard_size, index)
+    except Exception:
+        # Shards are only known through the index, it would never be removed
+        await s3_bucket.delete_file(shard_key)
+        raise
+    logger.info(f"Packed {len(index)} files into shard {shard_id} ({shard_size / 1e6:.1f} MB)")
+
+    packed_keys = [key for key, _, _ in index]
+    # Content removed while being packed
+    referenced_keys = await get_referenced_keys(packed_keys)
+    empty_shards = await crud.shards.release(
+        shards, shard_items, [key for key in packed_keys if key not in referenced_keys]
+    )
+    await bucket_throttle.acquire()
+    failed_keys = await s3_bucket.delete_files(packed_keys + empty_shards)
+    if len(failed_keys) > 0:
+        logger.warning(f"Unable to delete {len(failed_keys)} packed files, they are still served from the shard")
+    # Next shard
+    if is_full:
+        await crud.jobs.enqueue(jobs, JobKind.pack_shards, {})
+
+
+async def create_partitions() -> List[Exception]:
+    """Create the missing monthly partitions of the current & coming months, returns the failures (the other months
+    and tables are still processed)"""
+    this_month = datetime.utcnow().date().replace(day=1)
+    errors: List[Exception] = []
+    for table in PARTITIONED_TABLES:
+        partitions = await crud.partitions.fetch_partitions(table)
+        for offset in range(cfg.PARTITION_PREMAKE_MONTHS + 1):
+            month = crud.partitions.shift_month(this_month, offset)
+            if month in partitions:
+                continue
+            try:
+                await crud.partitions.create_partition(table, month)
+                logger.info(f"Created the partition of {table.name} for {month:%Y-%m}")
+            except Exception as e:
+                logger.error(f"Unable to create the partition of {table.name} for {month:%Y-%m}: {e}")
+                errors.append(e)
+    return errors
+
+
+async def manage_partitions(payload: Dict[str, Any]) -> None:
+    """Create the monthly partitions of the coming months, and archive the ones past the retention period"""
+    errors = await create_partitions()
+    if cfg.PARTITION_RETENTION_MONTHS > 0:
+        oldest_month = crud.partitions.shift_month(
+            datetime.utcnow().date().replace(day=1), -cfg.PARTITION_RETENTION_MONTHS
+        )
+        for table in PARTITIONED_TABLES:
+            # The bucket files of archived media are reclaimed by the orphan scan, unless a dataset refers to them
+            for month, name in sorted((await crud.partitions.fetch_partitions(table)).items()):
+                if month >= oldest_month:
+                    break
+                try:
+                    await crud.partitions.archive_partition(table, name, cfg.PARTITION_ARCHIVE_SCHEMA)
+                    logger.info(f"Archived the partition of {table.name} for {month:%Y-%m}")
+                except Exception as e:
+                    logger.error(f"Unable to archive the partition of {table.name} for {month:%Y-%m}: {e}")
+                    errors.append(e)
+    # Retried by the worker
+    if len(errors) > 0:
+        raise errors[0]
+
+
+JOB_HANDLERS: Dict[JobKind, Callable[[Dict[str, Any]], Awaitable[None]]] = {
+    JobKind.verify_upload: verify_upload,
+    JobKind.delete_file: delete_file,
+    JobKind.scan_orphans: scan_orphans,
+    JobKind.reverify: reverify,
+    JobKind.generate_thumbnail: generate_thumbnail,
+    JobKind.pack_shards: pack_shards,
+    JobKind.manage_partitions: manage_partitions,
+}
+
+
+async def execute_job(job: Mapping[str, Any]) -> Optional[datetime]:
+    """Execute a claimed job and record the outcome, returns the time of the next attempt if it failed"""
+    try:
+        await JOB_HANDLERS[job["kind"]](job["payload"])
+    except Exception as e:
+        logger.warning(f"Job {job['id']} ({job['kind']}) failed on attempt {job['attempts']}: {e}")
+        return await crud.jobs.fail(jobs, job, repr(e))
+    await crud.jobs.complete(jobs, job["id"])
+    return None
+
+
+async def run_job(job_id: int) -> None:
+    """Execute a job, retrying in-process with exponential backoff. The job row keeps the state, so that an
+    interrupted job can be resumed by the worker."""
+    while True:
+        job = await crud.jobs.claim(jobs, job_id)
+        # Done, failed, or taken by another process
+        if job is None:
+            return
+        retry_at = await execute_job(job)
+        if retry_at is None:
+            return
+        await asyncio.sleep(max((retry_at - datetime.utcnow()).total_seconds(), 0))
+
+
+async def schedule_deletion(bucket_key: Optional[str]) -> None:
+    """Queue the removal of a bucket file, performed in batches by the worker"""
+    if isinstance(bucket_key, str):
+        await crud.jobs.enqueue(jobs, JobKind.delete_file, {"bucket_key": bucket_key})
+
+
+async def schedule_deletions(bucket_keys: List[str]) -> None:
+    """Queue the removal of several bucket files at once (cf. schedule_deletion)"""
+    if len(bucket_keys) > 0:
+        await crud.jobs.enqueue_many(jobs, JobKind.delete_file, [{"bucket_key": key} for key in bucket_keys])
+
+
+async def schedule_thumbnail(bucket_key: str, media_type: MediaType) -> None:
+    """Queue the generation of the thumbnail of a media file, performed by the worker"""
+    await crud.jobs.enqueue(jobs, JobKind.generate_thumbnail, {"bucket_key": bucket_key, "media_type": media_type})
+
+
+async def schedule_upload_checks(
+    background_tasks: BackgroundTasks,
+    table_name: str,
+    entry_id: int,
+    bucket_key: str,
+    md5_hash: str,
+    size: int,
+    previous_key: Optional[str] = None,
+) -> None:
+    """Persist the post-upload operations, and run them once the response has been sent"""
+    if cfg.UPLOAD_VERIFICATION:
+        payload = {
+            "table": table_name,
+            "entry_id": entry_id,
+            "bucket_key": bucket_key,
+            "md5": md5_hash,
+            "size": size,
+            "previous_key": previous_key,
+        }
+        job_id = await crud.jobs.enqueue(jobs, JobKind.verify_upload, payload)
+    elif isinstance(previous_key, str):
+        job_id = await crud.jobs.enqueue(jobs, JobKind.delete_file, {"bucket_key": previous_key})
+    else:
+        return
+
+    background_tasks.add_task(run_job, job_id)
@@ -3,9 +3,10 @@
 # This program is licensed under the Apache License 2.0.
 # See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
 
+import json
 import os
 import secrets
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 PROJECT_NAME: str = "Pyronear - Storage API"
 PROJECT_DESCRIPTION: str = "API for wildfire data curation"
@@ -20,15 +21,29 @@ if DATABASE_URL.startswith("postgres://"):
 TEST_DATABASE_URL: str = os.getenv("TEST_DATABASE_URL", "")
 LOGO_URL: str = "https://pyronear.org/img/logo_letters.png"
 
-SECRET_KEY: str = secrets.token_urlsafe(32)
-if DEBUG:
-    # To keep the same Auth at every app loading in debug mode and not having to redo the auth.
-    debug_secret_key = "000000000000000000000000000000000000"  # nosec B105
-    SECRET_KEY = debug_secret_key
+# Should be shared by all the API processes, otherwise tokens issued by one of them are rejected by the others
+SECRET_KEY: str = os.getenv("SECRET_KEY", "")
+if len(SECRET_KEY) == 0:
+    SECRET_KEY = secrets.token_urlsafe(32)
+    if DEBUG:
+        # To keep the same Auth at every app loading in debug mode and not having to redo the auth.
+        debug_secret_key = "000000000000000000000000000000000000"  # nosec B105
+        SECRET_KEY = debug_secret_key
 
 ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
 ACCESS_TOKEN_UNLIMITED_MINUTES = 60 * 24 * 365 * 10
 JWT_ENCODING_ALGORITHM = "HS256"
+# Token signing keys, as a JSON list of {"kid": key ID, "alg": algorithm, "key": secret or PEM key} (inline or in a
+# file). Tokens are signed with the first key (or the one of JWT_SIGNING_KID), the others are kept to verify the
+# tokens they issued during a rotation. With RS*/ES* algorithms, the public keys are exposed as a JWKS.
+JWT_KEYS_FILE: Optional[str] = os.getenv("JWT_KEYS_FILE")
+JWT_KEYS: List[Dict[str, str]] = json.loads(os.getenv("JWT_KEYS", "[]"))
+if isinstance(JWT_KEYS_FILE, str):
+    with open(JWT_KEYS_FILE) as f:
+        JWT_KEYS = json.load(f)
+if len(JWT_KEYS) == 0:
+    JWT_KEYS = [{"kid": "default", "alg": JWT_ENCODING_ALGORITHM, "key": SECRET_KEY}]
+JWT_SIGNING_KID: Optional[str] = os.getenv("JWT_SIGNING_KID")
 
 CORS_ORIGIN: List[str] = os.getenv("CORS_ORIGIN", "*").split(",")
 
@@ -46,6 +61,87 @@ S3_SECRET_KEY: str = os.getenv("S3_SECRET_KEY", "")
 S3_REGION: str = os.getenv("S3_REGION", "")
 S3_ENDPOINT_URL: str = os.getenv("S3_ENDPOINT_URL", "")
 
+# Admission control
+# "memory" keeps rate limit states in the worker process, "database" shares them between workers
+RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")
+# Token buckets per access scope: sustained requests per second and burst size (a rate of 0 disables the limit)
+RATE_LIMITS: Dict[str, Tuple[float, int]] = {
+    "user": (float(os.getenv("RATE_LIMIT_USER", 10)), int(os.getenv("RATE_LIMIT_USER_BURST", 50))),
+    "admin": (float(os.getenv("RATE_LIMIT_ADMIN", 20)), int(os.getenv("RATE_LIMIT_ADMIN_BURST", 100))),
+}
+# Max number of requests being processed at the same time by a worker process
+MAX_CONCURRENT_UPLOADS: int = int(os.getenv("MAX_CONCURRENT_UPLOADS", 32))
+MAX_CONCURRENT_BUCKET_OPS: int = int(os.getenv("MAX_CONCURRENT_BUCKET_OPS", 64))
+
+# Size of the parts of the uploads streamed to the bucket (in bytes, at least 5MB), smaller uploads are kept in memory
+UPLOAD_PART_SIZE: int = max(int(os.getenv("UPLOAD_PART_SIZE", 8 * 1024**2)), 5 * 1024**2)
+
+# JSON responses larger than this are gzip-compressed (in bytes, 0 to disable)
+GZIP_MIN_SIZE: int = int(os.getenv("GZIP_MIN_SIZE", 1024))
+# Compression level of the JSON responses (the default of Starlette, 9, costs a lot of CPU for little gain)
+GZIP_LEVEL: int = int(os.getenv("GZIP_LEVEL", 5))
+
+# Max size of compressed uploads once decompressed (in bytes)
+MAX_DECOMPRESSED_SIZE: int = int(os.getenv("MAX_DECOMPRESSED_SIZE", 1024**3))
+
+# Background jobs
+# Whether uploads are checked against the bucket (ETag) after the response is sent
+UPLOAD_VERIFICATION: bool = os.getenv("UPLOAD_VERIFICATION", "") != "False"
+JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+# Delay before the first retry of a failed job (in seconds), doubled after each attempt
+JOB_RETRY_DELAY: float = float(os.getenv("JOB_RETRY_DELAY", 2))
+# Time after which a running job is considered abandoned by its process (in seconds)
+JOB_LEASE: int = int(os.getenv("JOB_LEASE", 300))
+
+# Bucket maintenance worker
+WORKER_POLL_INTERVAL: float = float(os.getenv("WORKER_POLL_INTERVAL", 5))
+WORKER_BATCH_SIZE: int = int(os.getenv("WORKER_BATCH_SIZE", 10))
+# Max number of bucket requests per second issued by background jobs, to leave room for live traffic
+WORKER_S3_RATE: float = float(os.getenv("WORKER_S3_RATE", 10))
+ORPHAN_SCAN_INTERVAL: int = int(os.getenv("ORPHAN_SCAN_INTERVAL", 24 * 3600))
+# Bucket objects more recent than this are never considered orphans (upload in progress)
+ORPHAN_GRACE_PERIOD: int = int(os.getenv("ORPHAN_GRACE_PERIOD", 3600))
+REVERIFICATION_INTERVAL: int = int(os.getenv("REVERIFICATION_INTERVAL", 7 * 24 * 3600))
+REVERIFICATION_BATCH_SIZE: int = int(os.getenv("REVERIFICATION_BATCH_SIZE", 100))
+
+# Near-duplicate detection (perceptual hash of images)
+# Max Hamming distance between the 64-bit hashes of near-duplicates
+NEAR_DUPLICATE_DISTANCE: int = int(os.getenv("NEAR_DUPLICATE_DISTANCE", 4))
+# What to do with uploaded near-duplicates of existing media: "none", "tag" (set duplicate_of) or "reject"
+NEAR_DUPLICATE_POLICY: str = os.getenv("NEAR_DUPLICATE_POLICY", "none")
+if NEAR_DUPLICATE_POLICY not in {"none", "tag", "reject"}:
+    raise ValueError("NEAR_DUPLICATE_POLICY should be one of 'none', 'tag' or 'reject'")
+
+# Packing of small media into shards (tar archives read by byte ranges), performed by the worker
+PACKING_ENABLED: bool = os.getenv("PACKING_ENABLED", "") == "True"
+PACKING_INTERVAL: int = int(os.getenv("PACKING_INTERVAL", 3600))
+# Media larger than this are kept as individual objects (in bytes)
+PACKING_MAX_ITEM_SIZE: int = int(os.getenv("PACKING_MAX_ITEM_SIZE", 1024**2))
+SHARD_SIZE: int = int(os.getenv("SHARD_SIZE", 256 * 1024**2))
+# A shard smaller than SHARD_SIZE is only written once its oldest item has waited this long (in seconds)
+SHARD_MAX_WAIT: int = int(os.getenv("SHARD_MAX_WAIT", 24 * 3600))
+
+# Monthly partitions of the media & annotations tables, managed by the worker
+PARTITION_INTERVAL: int = int(os.getenv("PARTITION_INTERVAL", 24 * 3600))
+# Number of months whose partitions are created in advance
+PARTITION_PREMAKE_MONTHS: int = int(os.getenv("PARTITION_PREMAKE_MONTHS", 3))
+# Partitions older than this many months are detached & moved to the archive schema (0 to keep everything)
+PARTITION_RETENTION_MONTHS: int = int(os.getenv("PARTITION_RETENTION_MONTHS", 0))
+PARTITION_ARCHIVE_SCHEMA: str = os.getenv("PARTITION_ARCHIVE_SCHEMA", "archive")
+
+# Dataset snapshots
+# Number of bucket files requested ahead of the one being streamed in an archive
+ARCHIVE_PREFETCH: int = max(int(os.getenv("ARCHIVE_PREFETCH", 4)), 1)
+# Lifetime of the URLs resolved in batches, for dataset manifests and downloads (in seconds)
+MANIFEST_URL_EXPIRATION: int = int(os.getenv("MANIFEST_URL_EXPIRATION", 6 * 3600))
+
+# Thumbnails (generated by the worker)
+# Max size of the largest side (in pixels)
+THUMBNAIL_SIZE: int = int(os.getenv("THUMBNAIL_SIZE", 256))
+THUMBNAIL_QUALITY: int = int(os.getenv("THUMBNAIL_QUALITY", 85))
+# Number of processes rendering thumbnails
+THUMBNAIL_WORKERS: int = int(os.getenv("THUMBNAIL_WORKERS", os.cpu_count() or 1))
+
 DUMMY_BUCKET_FILE = (
     "https://ec.europa.eu/jrc/sites/jrcsh/files/styles/normal-responsive/"
     + "public/growing-risk-future-wildfires_adobestock_199370851.jpeg"
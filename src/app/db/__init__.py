@@ -1,7 +1,7 @@
 from .tables import *
 from .session import Base, SessionLocal, database, engine
 from .init_db import init_db
-from .models import AccessType, MediaType
+from .models import AccessType, JobKind, JobStatus, MediaType, UploadStatus
 
 
 # Dependency
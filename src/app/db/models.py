@@ -5,7 +5,21 @@
 
 import enum
 
-from sqlalchemy import Column, DateTime, Enum, ForeignKey, Integer, String
+from sqlalchemy import (
+    DDL,
+    JSON,
+    BigInteger,
+    Column,
+    DateTime,
+    Enum,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    UniqueConstraint,
+    event,
+)
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -34,13 +48,51 @@ class MediaType(str, enum.Enum):
     video: str = "video"
 
 
+class UploadStatus(str, enum.Enum):
+    uploaded: str = "uploaded"
+    verified: str = "verified"
+    corrupted: str = "corrupted"
+    missing: str = "missing"
+
+
 class Media(Base):
     __tablename__ = "media"
 
-    id = Column(Integer, primary_key=True)
-    bucket_key = Column(String(100), nullable=True)
+    # Partitioned by month of creation: the partition key is part of the primary key
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    bucket_key = Column(String(100), nullable=True, index=True)  # index for dedup & reference lookups
     type = Column(Enum(MediaType), default=MediaType.image)
-    created_at = Column(DateTime, default=func.now())
+    # Camera that took the media (devices are managed by the alert API)
+    device_id = Column(Integer, nullable=True)
+    status = Column(Enum(UploadStatus), nullable=True)
+    # File properties, extracted on upload
+    size_bytes = Column(BigInteger, nullable=True, index=True)
+    content_type = Column(String(50), nullable=True, index=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    captured_at = Column(DateTime, nullable=True, index=True)
+    # Perceptual hash (64 bits) and its 16-bit bands, indexed separately for near-duplicate lookups
+    phash = Column(BigInteger, nullable=True)
+    phash_band0 = Column(Integer, nullable=True, index=True)
+    phash_band1 = Column(Integer, nullable=True, index=True)
+    phash_band2 = Column(Integer, nullable=True, index=True)
+    phash_band3 = Column(Integer, nullable=True, index=True)
+    # Not a foreign key: a partitioned table can't be referenced by ID alone (cleared on deletion by the API)
+    duplicate_of = Column(Integer, nullable=True)
+    # Incremented on each update, so that concurrent uploads don't overwrite each other
+    version = Column(Integer, default=1, nullable=False)
+    created_at = Column(DateTime, default=func.now(), primary_key=True)
+
+    annotations = relationship(
+        "Annotations", primaryjoin="Media.id == foreign(Annotations.media_id)", back_populates="media"
+    )
+
+    __table_args__ = (
+        Index("ix_media_width_height", "width", "height"),
+        # Time ranges of a camera, resolved from the index alone (IDs are stored in the leaf pages)
+        Index("ix_media_device_id_captured_at", "device_id", "captured_at", postgresql_include=["id"]),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
     def __repr__(self):
         return f"<Media(bucket_key='{self.bucket_key}', type='{self.type}'>"
@@ -49,12 +101,144 @@ class Media(Base):
 class Annotations(Base):
     __tablename__ = "annotations"
 
+    # Partitioned by month of creation, like the media
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # Not a foreign key (cf. Media.duplicate_of), the existence of the media is checked by the API
+    media_id = Column(Integer, index=True)
+    bucket_key = Column(String(100), nullable=True, index=True)
+    status = Column(Enum(UploadStatus), nullable=True)
+    created_at = Column(DateTime, default=func.now(), primary_key=True)
+
+    media = relationship(
+        "Media", primaryjoin="foreign(Annotations.media_id) == Media.id", uselist=False, back_populates="annotations"
+    )
+
+    __table_args__ = ({"postgresql_partition_by": "RANGE (created_at)"},)
+
+    def __repr__(self):
+        return f"<Media(media_id='{self.media_id}', bucket_key='{self.bucket_key}'>"
+
+
+# Rows outside of the monthly partitions (created by the worker ahead of time) land in a default one
+for partitioned_table in (Media.__table__, Annotations.__table__):
+    event.listen(
+        partitioned_table, "after_create", DDL("CREATE TABLE %(table)s_default PARTITION OF %(table)s DEFAULT")
+    )
+
+
+class JobKind(str, enum.Enum):
+    verify_upload: str = "verify_upload"
+    delete_file: str = "delete_file"
+    scan_orphans: str = "scan_orphans"
+    reverify: str = "reverify"
+    generate_thumbnail: str = "generate_thumbnail"
+    pack_shards: str = "pack_shards"
+    manage_partitions: str = "manage_partitions"
+
+
+class Shards(Base):
+    __tablename__ = "shards"
+
     id = Column(Integer, primary_key=True)
-    media_id = Column(Integer, ForeignKey("media.id"))
-    bucket_key = Column(String(100), nullable=True)
+    bucket_key = Column(String(100), unique=True, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    num_items = Column(Integer, nullable=False)
     created_at = Column(DateTime, default=func.now())
 
-    media = relationship("Media", uselist=False, back_populates="annotations")
+    items = relationship("ShardItems", back_populates="shard")
 
     def __repr__(self):
-        return f"<Media(media_id='{self.media_id}', bucket_key='{self.bucket_key}'>"
+        return f"<Shard(bucket_key='{self.bucket_key}', num_items={self.num_items}>"
+
+
+class ShardItems(Base):
+    __tablename__ = "shard_items"
+
+    id = Column(Integer, primary_key=True)
+    # Key of the packed content (shared by the entries with the same content)
+    bucket_key = Column(String(100), unique=True, nullable=False)
+    shard_id = Column(Integer, ForeignKey("shards.id"), nullable=False, index=True)
+    # Position of the content in the shard
+    offset = Column(BigInteger, nullable=False)
+    size = Column(BigInteger, nullable=False)
+
+    shard = relationship("Shards", back_populates="items")
+
+    def __repr__(self):
+        return f"<ShardItem(bucket_key='{self.bucket_key}', shard_id={self.shard_id}, offset={self.offset}>"
+
+
+class Datasets(Base):
+    __tablename__ = "datasets"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), nullable=False)
+    version = Column(Integer, nullable=False)
+    # Selection criteria, kept for reference (the items are frozen)
+    filters = Column(JSON, nullable=False)
+    num_items = Column(Integer, default=0, nullable=False)
+    size_bytes = Column(BigInteger, nullable=True)
+    created_at = Column(DateTime, default=func.now())
+
+    items = relationship("DatasetItems", back_populates="dataset")
+
+    __table_args__ = (UniqueConstraint("name", "version", name="uq_datasets_name_version"),)
+
+    def __repr__(self):
+        return f"<Dataset(name='{self.name}', version={self.version}, num_items={self.num_items}>"
+
+
+class DatasetItems(Base):
+    __tablename__ = "dataset_items"
+
+    id = Column(Integer, primary_key=True)
+    dataset_id = Column(Integer, ForeignKey("datasets.id"), nullable=False, index=True)
+    # Not foreign keys: snapshots outlive the entries they were taken from
+    media_id = Column(Integer, nullable=False)
+    annotation_id = Column(Integer, nullable=True)
+    # The content is kept on the bucket as long as a snapshot refers to it
+    bucket_key = Column(String(100), nullable=False, index=True)
+    size_bytes = Column(BigInteger, nullable=True)
+
+    dataset = relationship("Datasets", back_populates="items")
+
+    def __repr__(self):
+        return f"<DatasetItem(dataset_id={self.dataset_id}, bucket_key='{self.bucket_key}'>"
+
+
+class JobStatus(str, enum.Enum):
+    pending: str = "pending"
+    running: str = "running"
+    done: str = "done"
+    failed: str = "failed"
+
+
+class Jobs(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(Enum(JobKind), nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(Enum(JobStatus), default=JobStatus.pending, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(String(255), nullable=True)
+    run_after = Column(DateTime, default=func.now(), nullable=False)
+    created_at = Column(DateTime, default=func.now())
+
+    # Pending jobs are polled by due date
+    __table_args__ = (Index("ix_jobs_status_run_after", "status", "run_after"),)
+
+    def __repr__(self):
+        return f"<Job(kind='{self.kind}', status='{self.status}', attempts={self.attempts})>"
+
+
+class RateLimits(Base):
+    __tablename__ = "rate_limits"
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String(100), unique=True, nullable=False)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<RateLimit(key='{self.key}', tokens={self.tokens})>"
@@ -4,13 +4,30 @@
 # See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
 
 
-from .models import Accesses, Annotations, Media
+from .models import Accesses, Annotations, DatasetItems, Datasets, Jobs, Media, RateLimits, ShardItems, Shards
 from .session import Base
 
-__all__ = ["metadata", "accesses", "media", "annotations"]
+__all__ = [
+    "metadata",
+    "accesses",
+    "media",
+    "annotations",
+    "jobs",
+    "rate_limits",
+    "shards",
+    "shard_items",
+    "datasets",
+    "dataset_items",
+]
 
 accesses = Accesses.__table__
 media = Media.__table__
 annotations = Annotations.__table__
+jobs = Jobs.__table__
+rate_limits = RateLimits.__table__
+shards = Shards.__table__
+shard_items = ShardItems.__table__
+datasets = Datasets.__table__
+dataset_items = DatasetItems.__table__
 
 metadata = Base.metadata
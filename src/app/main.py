@@ -6,22 +6,24 @@
 import logging
 import time
 
-import sentry_sdk
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
-from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
+from fastapi.responses import ORJSONResponse
 
 from app import config as cfg
-from app.api.routes import accesses, annotations, login, media
+from app.api.responses import JSONGZipMiddleware
+from app.api.routes import accesses, annotations, datasets, login, media, shards
+from app.api.tasks import create_partitions
 from app.db import database, engine, init_db, metadata
 
 logger = logging.getLogger("uvicorn.error")
 
-metadata.create_all(bind=engine)
-
-# Sentry
+# Sentry (only imported when enabled, the SDK and its integrations are slow to load)
 if isinstance(cfg.SENTRY_DSN, str):
+    import sentry_sdk
+    from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
+
     sentry_sdk.init(
         cfg.SENTRY_DSN,
         release=cfg.VERSION,
@@ -32,13 +34,23 @@ if isinstance(cfg.SENTRY_DSN, str):
     logger.info(f"Sentry middleware enabled on server {cfg.SERVER_NAME}")
 
 
-app = FastAPI(title=cfg.PROJECT_NAME, description=cfg.PROJECT_DESCRIPTION, debug=cfg.DEBUG, version=cfg.VERSION)
+app = FastAPI(
+    title=cfg.PROJECT_NAME,
+    description=cfg.PROJECT_DESCRIPTION,
+    debug=cfg.DEBUG,
+    version=cfg.VERSION,
+    default_response_class=ORJSONResponse,
+)
 
 
 # Database connection
 @app.on_event("startup")
 async def startup():
+    # Schema creation is deferred to startup so that importing the app doesn't open a DB connection
+    metadata.create_all(bind=engine)
     await database.connect()
+    # Rows of a month without partition land in the default one, don't wait for the worker to create them
+    await create_partitions()
     await init_db()
 
 
@@ -52,6 +64,8 @@ app.include_router(login.router, prefix="/login", tags=["login"])
 app.include_router(media.router, prefix="/media", tags=["media"])
 app.include_router(annotations.router, prefix="/annotations", tags=["annotations"])
 app.include_router(accesses.router, prefix="/accesses", tags=["accesses"])
+app.include_router(shards.router, prefix="/shards", tags=["shards"])
+app.include_router(datasets.router, prefix="/datasets", tags=["datasets"])
 
 
 # Middleware
@@ -73,6 +87,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compression of large JSON responses (e.g. listings), for clients that accept it
+if cfg.GZIP_MIN_SIZE > 0:
+    app.add_middleware(JSONGZipMiddleware, minimum_size=cfg.GZIP_MIN_SIZE, compresslevel=cfg.GZIP_LEVEL)
+
 
 if isinstance(cfg.SENTRY_DSN, str):
     app.add_middleware(SentryAsgiMiddleware)
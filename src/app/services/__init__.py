@@ -1,2 +1,7 @@
 from .services import *
+from .throttle import *
 from .utils import *
+from .metadata import *
+from .thumbnails import *
+from .similarity import *
+from .shards import *
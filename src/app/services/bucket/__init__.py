@@ -1 +1,2 @@
 from .s3 import *
+from .streaming import *
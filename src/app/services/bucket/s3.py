@@ -4,13 +4,16 @@
 # See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
 
 import logging
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-import boto3
 from fastapi import HTTPException
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
 
 __all__ = ["S3Bucket"]
 
+# Max number of keys per DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+
 
 logger = logging.getLogger("uvicorn.warning")
 
@@ -27,13 +30,28 @@ class S3Bucket:
     """
 
     def __init__(self, region: str, endpoint_url: str, access_key: str, secret_key: str, bucket_name: str) -> None:
-        _session = boto3.Session(access_key, secret_key, region_name=region)
-        self._s3 = _session.client("s3", endpoint_url=endpoint_url)
+        self.region = region
+        self.endpoint_url = endpoint_url
+        self._access_key = access_key
+        self._secret_key = secret_key
         self.bucket_name = bucket_name
+        self._client: Optional[Any] = None
+
+    @property
+    def _s3(self) -> Any:
+        """S3 client, instantiated on first use to keep boto3 out of the import path"""
+        if self._client is None:
+            # boto3 loads its whole service model catalog on import, only pay for it when needed
+            import boto3
+
+            _session = boto3.Session(self._access_key, self._secret_key, region_name=self.region)
+            self._client = _session.client("s3", endpoint_url=self.endpoint_url)
+        return self._client
 
     async def get_file_metadata(self, bucket_key: str) -> Dict[str, Any]:
         # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#S3.Client.head_object
-        return self._s3.head_object(Bucket=self.bucket_name, Key=bucket_key)
+        # boto3 calls are blocking, run them in the threadpool to keep the event loop free
+        return await run_in_threadpool(self._s3.head_object, Bucket=self.bucket_name, Key=bucket_key)
 
     async def check_file_existence(self, bucket_key: str) -> bool:
         """Check whether a file exists on the bucket"""
@@ -49,23 +67,137 @@ class S3Bucket:
         """Generate a temporary public URL for a bucket file"""
         if not (await self.check_file_existence(bucket_key)):
             raise HTTPException(status_code=404, detail="File cannot be found on the bucket storage")
+        return self.presign_url(bucket_key, url_expiration)
 
+    def presign_url(self, bucket_key: str, url_expiration: int = 3600) -> str:
+        """Sign a temporary public URL for a bucket file, without checking its existence (no request is sent)"""
         # Point to the bucket file
         file_params = {"Bucket": self.bucket_name, "Key": bucket_key}
         # Generate a public URL for it using boto3 presign URL generation
         return self._s3.generate_presigned_url("get_object", Params=file_params, ExpiresIn=url_expiration)
 
-    async def upload_file(self, bucket_key: str, file_binary: bytes) -> bool:
+    async def _get_object(self, bucket_key: str, byte_range: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/get_object.html
+        kwargs = {"Bucket": self.bucket_name, "Key": bucket_key}
+        if byte_range is not None:
+            # Inclusive bounds
+            kwargs["Range"] = f"bytes={byte_range[0]}-{byte_range[0] + byte_range[1] - 1}"
+        try:
+            return await run_in_threadpool(self._s3.get_object, **kwargs)
+        except self._s3.exceptions.ClientError as e:
+            # Other errors (throttling, credentials, invalid range, etc.) are left to surface as such
+            if e.response["ResponseMetadata"]["HTTPStatusCode"] == 404:
+                raise HTTPException(status_code=404, detail="File cannot be found on the bucket storage")
+            raise
+
+    async def download_file(self, bucket_key: str, byte_range: Optional[Tuple[int, int]] = None) -> bytes:
+        """Read the content of a bucket file, or only a part of it
+
+        Args:
+            bucket_key: key of the file
+            byte_range: offset and size of the part to read
+        """
+        response = await self._get_object(bucket_key, byte_range)
+        return await run_in_threadpool(response["Body"].read)
+
+    async def stream_file(
+        self, bucket_key: str, byte_range: Optional[Tuple[int, int]] = None, chunk_size: int = 1024 * 1024
+    ) -> Tuple[int, AsyncIterator[bytes]]:
+        """Open the content of a bucket file (or a part of it, cf. download_file) as chunks, so that it can be relayed
+        without holding it in memory. Missing files raise a 404 HTTPException before any chunk is read.
+
+        Returns:
+            the size of the content and the iterator over its chunks
+        """
+        response = await self._get_object(bucket_key, byte_range)
+        return response["ContentLength"], iterate_in_threadpool(response["Body"].iter_chunks(chunk_size))
+
+    async def upload_file(self, bucket_key: str, file_binary: bytes, content_encoding: Optional[str] = None) -> bool:
         """Upload a file to bucket and return whether the upload succeeded"""
         # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#S3.Bucket.upload_fileobj
+        # The encoding is returned in the headers of downloads, for clients to decompress the content
+        extra_args = {} if content_encoding is None else {"ContentEncoding": content_encoding}
         try:
-            self._s3.upload_fileobj(file_binary, self.bucket_name, bucket_key)
+            await run_in_threadpool(
+                self._s3.upload_fileobj, file_binary, self.bucket_name, bucket_key, ExtraArgs=extra_args
+            )
         except Exception as e:
             logger.warning(e)
             return False
         return True
 
+    async def start_multipart_upload(self, bucket_key: str) -> str:
+        """Initiate the upload of a file in parts, and return the ID of the upload"""
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/create_multipart_upload.html
+        response = await run_in_threadpool(self._s3.create_multipart_upload, Bucket=self.bucket_name, Key=bucket_key)
+        return response["UploadId"]
+
+    async def upload_part(self, bucket_key: str, upload_id: str, part_number: int, data: bytes) -> Dict[str, Any]:
+        """Upload a part (at least 5MB, except for the last one) and return its reference for the completion"""
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/upload_part.html
+        response = await run_in_threadpool(
+            self._s3.upload_part,
+            Bucket=self.bucket_name,
+            Key=bucket_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        return {"ETag": response["ETag"], "PartNumber": part_number}
+
+    async def complete_multipart_upload(self, bucket_key: str, upload_id: str, parts: List[Dict[str, Any]]) -> None:
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/complete_multipart_upload.html
+        await run_in_threadpool(
+            self._s3.complete_multipart_upload,
+            Bucket=self.bucket_name,
+            Key=bucket_key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+
+    async def abort_multipart_upload(self, bucket_key: str, upload_id: str) -> None:
+        """Discard the parts uploaded so far"""
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/abort_multipart_upload.html
+        await run_in_threadpool(
+            self._s3.abort_multipart_upload, Bucket=self.bucket_name, Key=bucket_key, UploadId=upload_id
+        )
+
+    async def copy_file(self, source_key: str, bucket_key: str) -> None:
+        """Copy a file within the bucket, without transferring it"""
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/copy.html
+        # Managed copy: a single CopyObject is limited to 5GB, larger files are copied in parts
+        await run_in_threadpool(
+            self._s3.copy,
+            {"Bucket": self.bucket_name, "Key": source_key},
+            self.bucket_name,
+            bucket_key,
+        )
+
     async def delete_file(self, bucket_key: str) -> None:
         """Remove bucket file and return whether the deletion succeeded"""
         # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#S3.Client.delete_object
-        self._s3.delete_object(Bucket=self.bucket_name, Key=bucket_key)
+        await run_in_threadpool(self._s3.delete_object, Bucket=self.bucket_name, Key=bucket_key)
+
+    async def delete_files(self, bucket_keys: List[str]) -> List[str]:
+        """Remove bucket files by batches and return the keys that could not be deleted"""
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/delete_objects.html
+        failed_keys: List[str] = []
+        for idx in range(0, len(bucket_keys), DELETE_BATCH_SIZE):
+            response = await run_in_threadpool(
+                self._s3.delete_objects,
+                Bucket=self.bucket_name,
+                Delete={"Objects": [{"Key": key} for key in bucket_keys[idx : idx + DELETE_BATCH_SIZE]], "Quiet": True},
+            )
+            failed_keys.extend(error["Key"] for error in response.get("Errors", []))
+        return failed_keys
+
+    async def list_files(
+        self, prefix: str, continuation_token: Optional[str] = None, max_keys: int = 1000
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """List a page of bucket files and return them with the token of the next page"""
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/list_objects_v2.html
+        kwargs = {"Bucket": self.bucket_name, "Prefix": prefix, "MaxKeys": max_keys}
+        if isinstance(continuation_token, str):
+            kwargs["ContinuationToken"] = continuation_token
+        response = await run_in_threadpool(self._s3.list_objects_v2, **kwargs)
+        return response.get("Contents", []), response.get("NextContinuationToken")
@@ -0,0 +1,95 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+import io
+import logging
+from typing import Any, Dict, List, Optional
+
+from .s3 import S3Bucket
+
+__all__ = ["StreamingUpload"]
+
+logger = logging.getLogger("uvicorn.warning")
+
+
+class StreamingUpload:
+    """Upload of a file to the bucket while it is being received, without spooling it to disk.
+
+    The content is kept in memory as long as it fits in a single part, and then written under its final key. Beyond
+    that, it is uploaded in parts to a staging key (its final key, which depends on the whole content, is not known
+    yet), then copied within the bucket.
+
+    Args:
+        bucket: the bucket to write to
+        staging_key: the bucket key of the content while it is being uploaded in parts
+        part_size: size of the uploaded parts (S3 requires at least 5MB)
+    """
+
+    def __init__(self, bucket: S3Bucket, staging_key: str, part_size: int) -> None:
+        self.bucket = bucket
+        self.staging_key = staging_key
+        self.part_size = part_size
+        # Beginning of the file, enough for the headers of most formats
+        self.head = b""
+        self._buffer = bytearray()
+        self._is_multipart = False
+        self._upload_id: Optional[str] = None
+        self._parts: List[Dict[str, Any]] = []
+
+    @property
+    def is_complete_in_memory(self) -> bool:
+        """Whether the whole content is held in memory (no part was uploaded yet)"""
+        return not self._is_multipart
+
+    async def write(self, data: bytes) -> None:
+        self._buffer += data
+        if len(self._buffer) >= self.part_size:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        if self._upload_id is None:
+            self.head = bytes(self._buffer[: self.part_size])
+            self._is_multipart = True
+            self._upload_id = await self.bucket.start_multipart_upload(self.staging_key)
+        part = await self.bucket.upload_part(
+            self.staging_key, self._upload_id, len(self._parts) + 1, bytes(self._buffer)
+        )
+        self._parts.append(part)
+        self._buffer.clear()
+
+    def getvalue(self) -> bytes:
+        """Content of the file, only available if it was kept in memory"""
+        if not self.is_complete_in_memory:
+            raise AssertionError("the content was uploaded in parts")
+        return bytes(self._buffer)
+
+    async def finalize(self, bucket_key: str) -> bool:
+        """Store the received content under its final key, and return whether it succeeded"""
+        if not self._is_multipart:
+            return await self.bucket.upload_file(bucket_key=bucket_key, file_binary=io.BytesIO(self._buffer))
+        try:
+            # The last part can be smaller than the others
+            if len(self._buffer) > 0:
+                await self._flush()
+            await self.bucket.complete_multipart_upload(self.staging_key, str(self._upload_id), self._parts)
+            self._upload_id = None
+        except Exception as e:
+            logger.warning(e)
+            await self.abort()
+            return False
+        try:
+            await self.bucket.copy_file(self.staging_key, bucket_key)
+        except Exception as e:
+            logger.warning(e)
+            return False
+        finally:
+            await self.bucket.delete_file(self.staging_key)
+        return True
+
+    async def abort(self) -> None:
+        """Discard the parts uploaded so far"""
+        if self._upload_id is not None:
+            await self.bucket.abort_multipart_upload(self.staging_key, self._upload_id)
+            self._upload_id = None
@@ -0,0 +1,66 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+import logging
+import mimetypes
+import os
+from datetime import datetime
+from typing import Any, BinaryIO, Dict, Optional
+
+from PIL import Image, UnidentifiedImageError
+
+__all__ = ["FILE_METADATA_FIELDS", "extract_file_metadata"]
+
+logger = logging.getLogger("uvicorn.warning")
+
+# EXIF tags (cf. https://exiftool.org/TagNames/EXIF.html)
+EXIF_IFD = 0x8769
+DATETIME_ORIGINAL = 0x9003
+DATETIME = 0x0132
+
+FILE_METADATA_FIELDS = ("size_bytes", "content_type", "width", "height", "captured_at")
+
+
+def _parse_exif_datetime(value: Any) -> Optional[datetime]:
+    try:
+        return datetime.strptime(str(value).strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def extract_file_metadata(file: BinaryIO, file_name: str) -> Dict[str, Any]:
+    """Read the properties of a file from its headers, without decoding the pixels. The file position is restored.
+
+    Args:
+        file: binary file object
+        file_name: name of the file, used to guess the type of non-image content
+
+    Returns:
+        the size in bytes, the MIME type and, for images, the dimensions and the capture time (EXIF)
+    """
+    start = file.tell()
+    size_bytes = file.seek(0, os.SEEK_END) - start
+    file.seek(start)
+    metadata: Dict[str, Any] = dict.fromkeys(FILE_METADATA_FIELDS)
+    metadata["size_bytes"] = size_bytes
+    metadata["content_type"] = mimetypes.guess_type(file_name)[0]
+    try:
+        # Only the headers are parsed until the pixels are accessed
+        with Image.open(file) as img:
+            if img.format is not None:
+                metadata["content_type"] = Image.MIME.get(img.format, metadata["content_type"])
+            metadata["width"], metadata["height"] = img.size
+            exif = img.getexif()
+            captured_at = exif.get_ifd(EXIF_IFD).get(DATETIME_ORIGINAL) or exif.get(DATETIME)
+            if captured_at is not None:
+                metadata["captured_at"] = _parse_exif_datetime(captured_at)
+    except UnidentifiedImageError:
+        # Videos or unsupported formats
+        pass
+    except Exception as e:
+        logger.warning(f"Unable to read the metadata of {file_name}: {e}")
+    finally:
+        file.seek(start)
+    return metadata
@@ -0,0 +1,54 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+import io
+import tarfile
+from typing import IO, Iterable, List, Tuple
+
+__all__ = ["write_shard", "tar_header", "tar_padding", "TAR_END"]
+
+# End-of-archive marker: two empty blocks
+TAR_END = tarfile.NUL * 2 * tarfile.BLOCKSIZE
+
+
+def _tar_info(name: str, size: int) -> tarfile.TarInfo:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = 0o644
+    # Content is immutable, no need for actual timestamps
+    info.mtime = 0
+    return info
+
+
+def tar_header(name: str, size: int) -> bytes:
+    """Header of a file in a tar archive, to write an archive on the fly (followed by the content and its padding)"""
+    return _tar_info(name, size).tobuf(tarfile.USTAR_FORMAT, tarfile.ENCODING, "surrogateescape")
+
+
+def tar_padding(size: int) -> bytes:
+    """Padding of a file content of a given size, up to the next tar block"""
+    return tarfile.NUL * (-size % tarfile.BLOCKSIZE)
+
+
+def write_shard(items: Iterable[Tuple[str, bytes]], file: IO[bytes]) -> List[Tuple[str, int, int]]:
+    """Write files as an uncompressed tar archive (WebDataset-style shard), which can be streamed sequentially, or
+    read file by file with byte ranges
+
+    Args:
+        items: name & content of each file
+        file: binary file object to write the archive to
+
+    Returns:
+        the name, offset in the archive and size of each file
+    """
+    index = []
+    with tarfile.open(fileobj=file, mode="w", format=tarfile.USTAR_FORMAT) as tar:
+        for name, content in items:
+            info = _tar_info(name, len(content))
+            # The content follows its header
+            offset = tar.offset + len(info.tobuf(tar.format, tar.encoding, tar.errors))
+            tar.addfile(info, io.BytesIO(content))
+            index.append((name, offset, info.size))
+    return index
@@ -0,0 +1,88 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+from itertools import combinations
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from PIL import Image, UnidentifiedImageError
+
+__all__ = [
+    "PHASH_FIELDS",
+    "NUM_BANDS",
+    "MAX_SEARCH_DISTANCE",
+    "compute_dhash",
+    "hash_fields",
+    "hamming_distance",
+    "band_neighbors",
+]
+
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+# Multi-index hashing: the hash is split in bands that are indexed separately. If two hashes are within a distance d,
+# at least one of their bands is within a distance d // NUM_BANDS (pigeonhole principle).
+NUM_BANDS = 4
+BAND_BITS = HASH_BITS // NUM_BANDS
+# Beyond this, the number of band values to look up explodes
+MAX_SEARCH_DISTANCE = 3 * NUM_BANDS - 1
+
+PHASH_FIELDS = ("phash", *(f"phash_band{idx}" for idx in range(NUM_BANDS)))
+
+
+def compute_dhash(file: BinaryIO) -> Optional[int]:
+    """Compute the difference hash of an image, robust to rescaling, recompression and small exposure changes.
+    The file position is restored.
+
+    Args:
+        file: binary file object
+
+    Returns:
+        the 64-bit hash as an unsigned integer, None if the file is not an image
+    """
+    start = file.tell()
+    try:
+        with Image.open(file) as img:
+            # Decode at a reduced scale when the format allows it (JPEG)
+            img.draft("L", (4 * HASH_SIZE, 4 * HASH_SIZE))
+            pixels = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS).tobytes()
+    except (UnidentifiedImageError, OSError):
+        return None
+    finally:
+        file.seek(start)
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            offset = row * (HASH_SIZE + 1) + col
+            value = (value << 1) | int(pixels[offset] > pixels[offset + 1])
+    return value
+
+
+def _split(value: int) -> List[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (idx * BAND_BITS)) & mask for idx in range(NUM_BANDS)]
+
+
+def hash_fields(value: Optional[int]) -> Dict[str, Any]:
+    """Column values of a hash: the full hash (as a signed 64-bit integer, for BIGINT) and its bands"""
+    if value is None:
+        return dict.fromkeys(PHASH_FIELDS)
+    signed = value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+    return dict(zip(PHASH_FIELDS, [signed, *_split(value)]))
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two hashes (signed or not)"""
+    return bin((a ^ b) & ((1 << HASH_BITS) - 1)).count("1")
+
+
+def band_neighbors(band: int, radius: int) -> List[int]:
+    """All the band values within a Hamming distance of a band value"""
+    values = [band]
+    for num_bits in range(1, radius + 1):
+        for bits in combinations(range(BAND_BITS), num_bits):
+            value = band
+            for bit in bits:
+                value ^= 1 << bit
+            values.append(value)
+    return values
@@ -0,0 +1,32 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+import asyncio
+import time
+
+__all__ = ["Throttle"]
+
+
+class Throttle:
+    """Paces asynchronous operations so that they don't exceed a given rate
+
+    Args:
+        rate: max number of operations per second (0 to disable)
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self._next_slot = 0.0
+
+    async def acquire(self, cost: float = 1.0) -> None:
+        """Wait until the operation can be performed"""
+        if self.rate <= 0:
+            return
+        # Reserve the next slot (no await in between, so no concurrent reservation)
+        now = time.monotonic()
+        wait_time = self._next_slot - now
+        self._next_slot = max(now, self._next_slot) + cost / self.rate
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
@@ -0,0 +1,90 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+import asyncio
+import io
+import shutil
+import subprocess  # nosec B404
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import PurePosixPath
+from typing import Optional
+
+from PIL import Image
+
+from app import config as cfg
+from app.services.utils import resolve_bucket_key
+
+__all__ = ["thumbnail_key", "make_thumbnail", "render_thumbnail", "shutdown_thumbnail_pool"]
+
+THUMBNAIL_FOLDER = "thumbnails"
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def thumbnail_key(bucket_key: str) -> str:
+    """Bucket key of the thumbnail of a file. Files are named after their content, so identical content shares the
+    same thumbnail."""
+    return resolve_bucket_key(f"{PurePosixPath(bucket_key).stem}.jpg", THUMBNAIL_FOLDER)
+
+
+def _extract_poster_frame(content: bytes) -> bytes:
+    """Extract the first frame of a video as PNG"""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg is required to generate video thumbnails")
+    # Some containers (e.g. MP4) can only be parsed from a seekable file
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(content)
+        f.flush()
+        result = subprocess.run(  # nosec B603
+            [ffmpeg, "-v", "error", "-i", f.name, "-frames:v", "1", "-f", "image2", "-c:v", "png", "pipe:1"],
+            capture_output=True,
+            check=True,
+            timeout=60,
+        )
+    return result.stdout
+
+
+def make_thumbnail(content: bytes, is_video: bool = False, max_size: int = 256, quality: int = 85) -> bytes:
+    """Render the JPEG thumbnail of an image, or of the first frame of a video
+
+    Args:
+        content: file content
+        is_video: whether the file is a video
+        max_size: max size of the largest side of the thumbnail
+        quality: JPEG quality
+
+    Returns:
+        the JPEG content
+    """
+    if is_video:
+        content = _extract_poster_frame(content)
+    with Image.open(io.BytesIO(content)) as source:
+        # Decode at a reduced scale when the format allows it (JPEG)
+        source.draft("RGB", (max_size, max_size))
+        img = source.convert("RGB")
+    img.thumbnail((max_size, max_size))
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+async def render_thumbnail(content: bytes, is_video: bool = False) -> bytes:
+    """Render a thumbnail in the process pool, to keep the event loop & the GIL free"""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=cfg.THUMBNAIL_WORKERS)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _pool, make_thumbnail, content, is_video, cfg.THUMBNAIL_SIZE, cfg.THUMBNAIL_QUALITY
+    )
+
+
+def shutdown_thumbnail_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
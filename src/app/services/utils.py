@@ -5,9 +5,14 @@
 
 from typing import Optional
 
-__all__ = ["resolve_bucket_key"]
+__all__ = ["resolve_bucket_key", "resolve_content_file_name"]
 
 
 def resolve_bucket_key(file_name: str, bucket_folder: Optional[str] = None) -> str:
     """Prepend file name with bucket subfolder"""
     return f"{bucket_folder}/{file_name}" if isinstance(bucket_folder, str) else file_name
+
+
+def resolve_content_file_name(file_hash: str, file_name: str) -> str:
+    """Name a file after its content: first 32 chars (to avoid system interactions issues) of SHA256 + extension"""
+    return f"{file_hash[:32]}.{file_name.rpartition('.')[-1]}"
@@ -0,0 +1,119 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+"""
+Bucket maintenance worker, processing the jobs persisted in the DB: batched deletions, orphan detection,
+re-verification of stored files, thumbnail generation, packing of small files into shards, creation & archival of
+monthly table partitions, and post-upload checks that could not be performed by the API.
+
+>>> python -m app.worker
+"""
+
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+from sqlalchemy import func, select
+
+from app import config as cfg
+from app.api import crud, tasks
+from app.db import database, engine, jobs, metadata
+from app.db.models import JobKind
+from app.services import shutdown_thumbnail_pool
+
+logger = logging.getLogger("uvicorn.warning")
+
+# Jobs executed one by one (deletions are grouped, thumbnails are rendered concurrently)
+SINGLE_JOB_KINDS = [kind for kind in JobKind if kind not in {JobKind.delete_file, JobKind.generate_thumbnail}]
+
+
+async def process_deletions() -> int:
+    """Delete pending files with as few bucket requests as possible, returns the number of processed jobs"""
+    batch = await crud.jobs.claim_batch(jobs, [JobKind.delete_file], limit=1000)
+    if len(batch) == 0:
+        return 0
+
+    try:
+        failed_keys = set(await tasks.delete_files(list({job["payload"]["bucket_key"] for job in batch})))
+    except Exception as e:
+        logger.warning(f"Batch deletion failed: {e}")
+        for job in batch:
+            await crud.jobs.fail(jobs, job, repr(e))
+        return len(batch)
+
+    for job in batch:
+        if job["payload"]["bucket_key"] in failed_keys:
+            await crud.jobs.fail(jobs, job, "Deletion refused by the bucket")
+        else:
+            await crud.jobs.complete(jobs, job["id"])
+    return len(batch)
+
+
+async def process_jobs() -> int:
+    """Execute due jobs, returns the number of processed jobs"""
+    batch = await crud.jobs.claim_batch(jobs, SINGLE_JOB_KINDS, limit=cfg.WORKER_BATCH_SIZE)
+    for job in batch:
+        await tasks.execute_job(job)
+    return len(batch)
+
+
+async def process_thumbnails() -> int:
+    """Generate thumbnails concurrently (the rendering is spread over a process pool), returns the number of
+    processed jobs"""
+    batch = await crud.jobs.claim_batch(jobs, [JobKind.generate_thumbnail], limit=cfg.THUMBNAIL_WORKERS)
+    await asyncio.gather(*[tasks.execute_job(job) for job in batch])
+    return len(batch)
+
+
+async def schedule_periodic_jobs() -> None:
+    """Enqueue the periodic maintenance jobs that are due"""
+    periodic_jobs: Dict[JobKind, Any] = {
+        JobKind.scan_orphans: (
+            cfg.ORPHAN_SCAN_INTERVAL,
+            [{"prefix": f"{folder}/"} for folder in tasks.BUCKET_FOLDERS],
+        ),
+        JobKind.reverify: (cfg.REVERIFICATION_INTERVAL, [{"table": table} for table in tasks.TABLES]),
+        JobKind.manage_partitions: (cfg.PARTITION_INTERVAL, [{}]),
+    }
+    if cfg.PACKING_ENABLED:
+        periodic_jobs[JobKind.pack_shards] = (cfg.PACKING_INTERVAL, [{}])
+    async with database.transaction():
+        # Workers polling at the same time would all find the jobs due, and enqueue them once each
+        await database.fetch_val(query=select([func.pg_advisory_xact_lock(func.hashtext("periodic_jobs"))]))
+        for kind, (interval, payloads) in periodic_jobs.items():
+            last_run = await crud.jobs.last_created_at(jobs, kind)
+            if last_run is None or last_run < datetime.utcnow() - timedelta(seconds=interval):
+                logger.info(f"Scheduling periodic job: {kind}")
+                await crud.jobs.enqueue_many(jobs, kind, payloads)
+
+
+async def main(run_once: bool = False) -> None:
+    metadata.create_all(bind=engine)
+    await database.connect()
+    try:
+        while True:
+            await schedule_periodic_jobs()
+            processed = await process_deletions() + await process_thumbnails() + await process_jobs()
+            if run_once:
+                break
+            # Only wait when there is nothing left to do
+            if processed == 0:
+                await asyncio.sleep(cfg.WORKER_POLL_INTERVAL)
+    finally:
+        shutdown_thumbnail_pool()
+        await database.disconnect()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Pyro-storage bucket maintenance worker")
+    parser.add_argument("--once", action="store_true", help="process available jobs once and exit")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(run_once=parse_args().once))
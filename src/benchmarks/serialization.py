@@ -0,0 +1,104 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+"""
+Measures the serialization of large listings: the default FastAPI path (validation through the response model,
+jsonable_encoder & stdlib json) against the fast path (projection of the trusted rows & orjson), and the effect of
+gzip on the response size. No database is needed.
+
+Run it from the `src` folder:
+>>> PYTHONPATH=. python benchmarks/serialization.py --rows 10000
+"""
+
+import argparse
+import gzip
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+
+from app.db.models import MediaType, UploadStatus  # isort: skip (app.db has to be loaded before app.api)
+from app.api.responses import fast_response
+from app.api.schemas import MediaAnnotationsOut, MediaOut
+
+
+def make_rows(num_rows: int, num_annotations: int = 0) -> List[Dict[str, Any]]:
+    start = datetime(2020, 10, 13, 8, 18, 45, 447773)
+    return [
+        {
+            "id": idx,
+            "bucket_key": f"media/{idx:032x}.jpg",
+            "type": MediaType.image,
+            "device_id": 1 + idx % 20,
+            "status": UploadStatus.verified,
+            "size_bytes": 204800 + idx,
+            "content_type": "image/jpeg",
+            "width": 1280,
+            "height": 720,
+            "captured_at": start + timedelta(seconds=idx),
+            "phash": idx * 7919,
+            "duplicate_of": None,
+            "created_at": start + timedelta(seconds=idx),
+            "annotations": [
+                {
+                    "id": idx * num_annotations + jdx,
+                    "media_id": idx,
+                    "bucket_key": f"annotations/{idx:032x}.json",
+                    "status": UploadStatus.verified,
+                    "created_at": start,
+                }
+                for jdx in range(num_annotations)
+            ],
+        }
+        for idx in range(1, num_rows + 1)
+    ]
+
+
+def default_path(rows: List[Dict[str, Any]], model: Any) -> bytes:
+    # What FastAPI does with a response_model: validation, encoding to JSON-compatible types, then json.dumps
+    return json.dumps(jsonable_encoder(parse_obj_as(List[model], rows))).encode()  # type: ignore[valid-type]
+
+
+def fast_path(rows: List[Dict[str, Any]], model: Any) -> bytes:
+    return fast_response(rows, model).body
+
+
+def _time(fn: Callable[[], bytes], runs: int) -> List[float]:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main(args: argparse.Namespace) -> None:
+    for name, model, num_annotations in [("media", MediaOut, 0), ("media+annotations", MediaAnnotationsOut, 2)]:
+        rows = make_rows(args.rows, num_annotations)
+        # Both paths yield the same document
+        assert json.loads(default_path(rows, model)) == json.loads(fast_path(rows, model))
+        body = fast_path(rows, model)
+        print(f"{name} ({args.rows} rows, {len(body) / 1e6:.2f}MB, {len(gzip.compress(body, 6)) / 1e6:.2f}MB gzipped)")
+        for path_name, path in [("default", default_path), ("fast", fast_path)]:
+            timings = _time(lambda: path(rows, model), args.runs)
+            print(
+                f"  {path_name:<8} median: {1000 * statistics.median(timings):8.1f}ms "
+                f"min: {1000 * min(timings):8.1f}ms ({args.runs} runs)"
+            )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Pyro-storage listing serialization benchmark")
+    parser.add_argument("--rows", type=int, default=10000, help="number of rows in the listing")
+    parser.add_argument("--runs", type=int, default=5, help="number of runs")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
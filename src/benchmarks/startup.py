@@ -0,0 +1,95 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+"""
+Measures the cold start of an API worker: the time to import the application module, and the time between
+process spawn and the first successful HTTP response.
+
+Run it from the `src` folder, with the same environment variables as the API (database reachable):
+>>> python benchmarks/startup.py --runs 5
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess  # nosec B404
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+import requests
+
+SRC_FOLDER = Path(__file__).parent.parent.absolute()
+
+
+def _summary(name: str, timings: List[float]) -> None:
+    print(
+        f"{name:<24} median: {1000 * statistics.median(timings):8.1f}ms "
+        f"min: {1000 * min(timings):8.1f}ms max: {1000 * max(timings):8.1f}ms ({len(timings)} runs)"
+    )
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_import(module: str) -> float:
+    """Wall time of a fresh interpreter importing the module (interpreter startup excluded)"""
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    out = subprocess.run(  # nosec B603
+        [sys.executable, "-c", code], cwd=SRC_FOLDER, capture_output=True, check=True, text=True
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def time_first_request(app: str, route: str, timeout: float) -> float:
+    """Time between spawning a uvicorn worker and its first successful response"""
+    port = _free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(  # nosec B603
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--workers", "1", "--log-level", "warning"],
+        cwd=SRC_FOLDER,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                if requests.get(f"http://127.0.0.1:{port}{route}", timeout=1).status_code == 200:
+                    return time.perf_counter() - start
+            except requests.exceptions.ConnectionError:
+                pass
+            time.sleep(0.01)
+        raise TimeoutError(f"The server did not answer within {timeout} seconds")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main(args):
+    os.environ.setdefault("PYTHONPATH", str(SRC_FOLDER))
+    _summary("import app.main", [time_import("app.main") for _ in range(args.runs)])
+    if not args.skip_server:
+        _summary(
+            "time to first request",
+            [time_first_request("app.main:app", args.route, args.timeout) for _ in range(args.runs)],
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Pyro-storage API worker startup benchmark", formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--runs", type=int, default=5, help="number of cold starts to measure")
+    parser.add_argument("--route", type=str, default="/docs", help="route used for the first request")
+    parser.add_argument("--timeout", type=float, default=30.0, help="max time to wait for the server (in seconds)")
+    parser.add_argument("--skip-server", action="store_true", help="only measure the module import")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,137 @@
+# Copyright (C) 2022-2024, Pyronear.
+
+# This program is licensed under the Apache License 2.0.
+# See LICENSE or go to <https://opensource.org/licenses/Apache-2.0> for full license details.
+
+"""
+Measures the retrieval of the frames of a camera over a time range, on a copy of the media table (same columns,
+indexes & monthly partitions) filled with synthetic rows, and checks the plan chosen by PostgreSQL: the media IDs are
+expected to come from an index-only scan of the (device_id, captured_at) index. The plan of the listing page (as
+served by the API) is reported as well.
+
+The rows are generated by the database itself (tens of millions take a few minutes), in a separate schema that is
+kept between runs unless `--drop` is passed. Run it from the `src` folder, with the same environment variables as the
+API (database reachable):
+>>> PYTHONPATH=. python benchmarks/time_range.py --rows 20000000 --devices 500
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from sqlalchemy import MetaData, Table, func, select, text
+from sqlalchemy.engine import Connection
+
+from app.db import engine, media  # isort: skip (app.db has to be loaded before app.api)
+from app.api.crud.media import metadata_conditions
+from app.api.crud.partitions import partition_ddl, shift_month
+
+START_TS = datetime(2023, 1, 1)
+
+
+def create_table(conn: Connection, schema: str, num_rows: int, num_devices: int, interval: int) -> Table:
+    """Copy the media table (and its monthly partitions) in the benchmark schema and fill it, unless it already has
+    the requested rows"""
+    table = media.to_metadata(MetaData(), schema=schema)
+    conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+    table.create(conn, checkfirst=True)
+    end_ts = START_TS + timedelta(seconds=(num_rows // num_devices) * interval)
+    month = START_TS.date().replace(day=1)
+    while month <= end_ts.date():
+        conn.execute(text(partition_ddl(table, month)))
+        month = shift_month(month, 1)
+    if conn.execute(select([func.count()]).select_from(table)).scalar() == num_rows:
+        return table
+    conn.execute(table.delete())
+    start = time.perf_counter()
+    # Each camera takes a frame every `interval` seconds, uploaded right away
+    conn.execute(
+        text(
+            f"INSERT INTO {schema}.media (type, device_id, captured_at, status, size_bytes, created_at) "
+            "SELECT 'image', 1 + idx % :num_devices, ts, 'verified', 200000 + idx % 1000, ts FROM ("
+            " SELECT idx, :start_ts + (idx / :num_devices) * :interval * interval '1 second' AS ts"
+            " FROM generate_series(0, :num_rows - 1) AS idx) AS frames"
+        ),
+        {"num_devices": num_devices, "start_ts": START_TS, "interval": interval, "num_rows": num_rows},
+    )
+    # Index-only scans rely on the visibility map
+    conn.execute(text(f"VACUUM ANALYZE {schema}.media"))
+    print(f"Inserted {num_rows} rows in {time.perf_counter() - start:.1f}s")
+    return table
+
+
+def explain(conn: Connection, query: Any) -> Dict[str, Any]:
+    compiled = query.compile(dialect=engine.dialect)
+    plan = conn.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {compiled}", compiled.params).scalar()[0]
+    # Innermost node: the one reading the table
+    node = plan["Plan"]
+    while "Plans" in node:
+        node = node["Plans"][0]
+    return {
+        "duration": plan["Execution Time"] / 1000,
+        "node": node["Node Type"],
+        "index": node.get("Index Name"),
+        "heap_fetches": node.get("Heap Fetches"),
+        "buffers": plan["Plan"]["Shared Hit Blocks"] + plan["Plan"]["Shared Read Blocks"],
+        "rows": plan["Plan"]["Actual Rows"],
+    }
+
+
+def _summary(name: str, results: List[Dict[str, Any]]) -> None:
+    timings = [result["duration"] for result in results]
+    nodes = {(result["node"], result["index"]) for result in results}
+    print(
+        f"{name:<20} median: {1000 * statistics.median(timings):8.2f}ms max: {1000 * max(timings):8.2f}ms "
+        f"rows: {statistics.median(result['rows'] for result in results):8.0f} "
+        f"buffers: {statistics.median(result['buffers'] for result in results):6.0f} "
+        f"heap fetches: {max(result['heap_fetches'] or 0 for result in results)} plan: {nodes}"
+    )
+
+
+def main(args: argparse.Namespace) -> None:
+    random.seed(args.seed)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        table = create_table(conn, args.schema, args.rows, args.devices, args.interval)
+        total_span = (args.rows // args.devices) * args.interval
+        id_results, page_results = [], []
+        for _ in range(args.runs):
+            device_id = random.randint(1, args.devices)
+            captured_after = START_TS + timedelta(seconds=random.randint(0, max(total_span - args.span, 0)))
+            captured_before = captured_after + timedelta(seconds=args.span)
+            conditions = metadata_conditions(
+                table, captured_after=captured_after, captured_before=captured_before, device_id=device_id
+            )
+            # All the frames of the camera over the range
+            id_results.append(
+                explain(
+                    conn, select([table.c.id, table.c.captured_at]).where(*conditions).order_by(table.c.captured_at)
+                )
+            )
+            # Listing page, as served by the API
+            page_results.append(explain(conn, table.select().where(*conditions).order_by(table.c.id.desc()).limit(50)))
+        _summary("media IDs", id_results)
+        _summary("listing page", page_results)
+        if any(result["node"] != "Index Only Scan" for result in id_results):
+            print("WARNING: the media IDs were not resolved from the index alone")
+        if args.drop:
+            conn.execute(text(f"DROP SCHEMA {args.schema} CASCADE"))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Pyro-storage device time-range query benchmark")
+    parser.add_argument("--rows", type=int, default=1000000, help="number of media rows")
+    parser.add_argument("--devices", type=int, default=200, help="number of cameras")
+    parser.add_argument("--interval", type=int, default=30, help="seconds between two frames of a camera")
+    parser.add_argument("--span", type=int, default=6 * 3600, help="duration of the queried range, in seconds")
+    parser.add_argument("--runs", type=int, default=20, help="number of queried ranges")
+    parser.add_argument("--schema", type=str, default="benchmark", help="schema of the synthetic table")
+    parser.add_argument("--seed", type=int, default=42, help="random seed of the queried ranges")
+    parser.add_argument("--drop", action="store_true", help="drop the synthetic table at the end")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -1,3 +1,4 @@
+import gzip
 import json
 import os
 import tempfile
@@ -7,7 +8,7 @@ import pytest
 import pytest_asyncio
 
 from app import db
-from app.api import crud
+from app.api import crud, tasks
 from app.api.security import hash_content_file
 from app.services import s3_bucket
 from tests.db_utils import TestSessionLocal, fill_table, get_entry
@@ -19,12 +20,12 @@ ACCESS_TABLE = [
 ]
 
 MEDIA_TABLE = [
-    {"id": 1, "type": "image", "created_at": "2020-10-13T08:18:45.447773"},
-    {"id": 2, "type": "video", "created_at": "2020-10-13T09:18:45.447773"},
+    {"id": 1, "type": "image", "status": None, "created_at": "2020-10-13T08:18:45.447773"},
+    {"id": 2, "type": "video", "status": None, "created_at": "2020-10-13T09:18:45.447773"},
 ]
 
 ANNOTATIONS_TABLE = [
-    {"id": 1, "media_id": 1, "bucket_key": "dummy_key", "created_at": "2020-10-13T08:18:45.447773"},
+    {"id": 1, "media_id": 1, "bucket_key": "dummy_key", "status": None, "created_at": "2020-10-13T08:18:45.447773"},
 ]
 
 
@@ -35,6 +36,10 @@ ANNOTATIONS_TABLE_FOR_DB = list(map(update_only_datetime, ANNOTATIONS_TABLE))
 @pytest_asyncio.fixture(scope="function")
 async def init_test_db(monkeypatch, test_db):
     monkeypatch.setattr(crud.base, "database", test_db)
+    monkeypatch.setattr(crud.jobs, "database", test_db)
+    monkeypatch.setattr(crud.media, "database", test_db)
+    monkeypatch.setattr(crud.shards, "database", test_db)
+    monkeypatch.setattr(tasks, "database", test_db)
     monkeypatch.setattr(db, "SessionLocal", TestSessionLocal)
     await fill_table(test_db, db.accesses, ACCESS_TABLE)
     await fill_table(test_db, db.media, MEDIA_TABLE_FOR_DB)
@@ -102,6 +107,7 @@ async def test_fetch_annotations(
         [0, {"media_id": 1}, 201, None],
         [1, {"media_id": 1}, 201, None],
         [1, {"media_id": "alpha"}, 422, None],
+        [1, {"media_id": 999}, 404, "Table media has no entry with id=999"],
         [1, {}, 422, None],
     ],
 )
@@ -123,7 +129,7 @@ async def test_create_annotation(
 
     if response.status_code // 100 == 2:
         json_response = response.json()
-        test_response = {"id": len(ANNOTATIONS_TABLE) + 1, **payload}
+        test_response = {"id": len(ANNOTATIONS_TABLE) + 1, **payload, "status": None}
         assert {k: v for k, v in json_response.items() if k != "created_at"} == test_response
 
         new_annotation = await get_entry(test_db, db.annotations, json_response["id"])
@@ -142,6 +148,7 @@ async def test_create_annotation(
         [1, {}, 1, 422, None],
         [1, {"media_id": "alpha"}, 1, 422, None],
         [1, {"media_id": 1}, 999, 404, "Table annotations has no entry with id=999"],
+        [1, {"media_id": 999}, 1, 404, "Table media has no entry with id=999"],
         [1, {"media_id": 1}, 0, 422, None],
     ],
 )
@@ -213,7 +220,10 @@ async def test_upload_annotation(test_app_asyncio, init_test_db, test_db, monkey
     assert response.status_code == 201
 
     # 2 - Upload something
-    async def mock_upload_file(bucket_key, file_binary):
+    uploads = []
+
+    async def mock_upload_file(bucket_key, file_binary, content_encoding=None):
+        uploads.append((bucket_key, content_encoding))
         return True
 
     monkeypatch.setattr(s3_bucket, "upload_file", mock_upload_file)
@@ -250,11 +260,16 @@ async def test_upload_annotation(test_app_asyncio, init_test_db, test_db, monkey
     updated_annotation = await get_entry(test_db, db.annotations, response_json["id"])
     updated_annotation = dict(**updated_annotation)
     response_json.pop("created_at")
-    assert {k: v for k, v in updated_annotation.items() if k not in ("created_at", "bucket_key")} == response_json
+    assert response_json["status"] == "uploaded"
+    assert {k: v for k, v in updated_annotation.items() if k not in ("created_at", "bucket_key", "status")} == {
+        k: v for k, v in response_json.items() if k != "status"
+    }
     assert updated_annotation["bucket_key"] is not None
+    # Integrity check performed in the background
+    assert updated_annotation["status"] == "verified"
 
     # 2b - Upload failing
-    async def failing_upload(bucket_key, file_binary):
+    async def failing_upload(bucket_key, file_binary, content_encoding=None):
         return False
 
     monkeypatch.setattr(s3_bucket, "upload_file", failing_upload)
@@ -262,3 +277,36 @@ async def test_upload_annotation(test_app_asyncio, init_test_db, test_db, monkey
         f"/annotations/{new_annotation_id}/upload", files=dict(file="bar"), headers=admin_auth
     )
     assert response.status_code == 500
+
+    # 3 - Compressed upload
+    monkeypatch.setattr(s3_bucket, "upload_file", mock_upload_file)
+    raw_content = json.dumps([{"label": "fire"}] * 100).encode()
+    compressed = gzip.compress(raw_content)
+    md5_hash = hash_content_file(compressed, use_md5=True)
+    # Unsupported encoding
+    response = await test_app_asyncio.post(
+        f"/annotations/{new_annotation_id}/upload",
+        files=dict(file=("labels.json", compressed, "application/json", {"Content-Encoding": "br"})),
+        headers=admin_auth,
+    )
+    assert response.status_code == 415
+    assert response.headers["Accept-Encoding"] == "identity, gzip"
+    # Invalid content
+    response = await test_app_asyncio.post(
+        f"/annotations/{new_annotation_id}/upload",
+        files=dict(file=("labels.json", compressed[:-10], "application/json", {"Content-Encoding": "gzip"})),
+        headers=admin_auth,
+    )
+    assert response.status_code == 400
+    response = await test_app_asyncio.post(
+        f"/annotations/{new_annotation_id}/upload",
+        files=dict(file=("labels.json", compressed, "application/json", {"Content-Encoding": "gzip"})),
+        headers=admin_auth,
+    )
+    assert response.status_code == 200
+    # Named after the decompressed content, and stored with its encoding
+    bucket_key = f"annotations/{hash_content_file(raw_content)[:32]}.json.gz"
+    assert uploads[-1] == (bucket_key, "gzip")
+    updated_annotation = await get_entry(test_db, db.annotations, new_annotation_id)
+    assert updated_annotation["bucket_key"] == bucket_key
+    assert updated_annotation["status"] == "verified"
@@ -0,0 +1,169 @@
+import io
+import tarfile
+
+import pytest
+import pytest_asyncio
+
+from app import db
+from app.api import crud, tasks
+from app.services import s3_bucket
+from tests.db_utils import TestSessionLocal, fill_table, get_entry
+
+ACCESS_TABLE = [
+    {"id": 1, "login": "first_login", "hashed_password": "hashed_pwd", "scope": "user"},
+    {"id": 2, "login": "second_login", "hashed_password": "hashed_pwd", "scope": "admin"},
+]
+
+MEDIA_TABLE = [
+    {"id": 1, "type": "image", "bucket_key": "media/a.jpg", "status": "verified", "size_bytes": 10, "width": 1280},
+    {"id": 2, "type": "image", "bucket_key": "media/b.jpg", "status": "verified", "size_bytes": 20, "width": 640},
+    {"id": 3, "type": "video", "bucket_key": "media/c.mp4", "status": "verified", "size_bytes": 30},
+    # Not verified
+    {"id": 4, "type": "image", "bucket_key": "media/d.jpg", "status": "uploaded", "size_bytes": 40, "width": 1280},
+]
+
+ANNOTATIONS_TABLE = [
+    {"id": 1, "media_id": 1, "bucket_key": "annotations/a.json", "status": "verified"},
+    {"id": 2, "media_id": 3, "bucket_key": "annotations/c.json", "status": "uploaded"},
+]
+
+# Media 2 is packed
+SHARDS_TABLE = [{"id": 1, "bucket_key": "shards/first.tar", "size": 2048, "num_items": 1}]
+SHARD_ITEMS_TABLE = [{"id": 1, "bucket_key": "media/b.jpg", "shard_id": 1, "offset": 512, "size": 20}]
+
+STORED_FILES = {
+    "media/a.jpg": b"a" * 10,
+    "media/c.mp4": b"c" * 30,
+    "annotations/a.json": b'{"label": "fire"}',
+    "shards/first.tar": b"\x00" * 512 + b"b" * 20 + b"\x00" * 1516,
+}
+
+
+@pytest_asyncio.fixture(scope="function")
+async def init_test_db(monkeypatch, test_db):
+    monkeypatch.setattr(crud.base, "database", test_db)
+    monkeypatch.setattr(crud.jobs, "database", test_db)
+    monkeypatch.setattr(crud.media, "database", test_db)
+    monkeypatch.setattr(crud.shards, "database", test_db)
+    monkeypatch.setattr(crud.datasets, "database", test_db)
+    monkeypatch.setattr(tasks, "database", test_db)
+    monkeypatch.setattr(db, "SessionLocal", TestSessionLocal)
+    await fill_table(test_db, db.accesses, ACCESS_TABLE)
+    await fill_table(test_db, db.media, MEDIA_TABLE)
+    await fill_table(test_db, db.annotations, ANNOTATIONS_TABLE)
+    await fill_table(test_db, db.shards, SHARDS_TABLE)
+    await fill_table(test_db, db.shard_items, SHARD_ITEMS_TABLE)
+
+
+@pytest.fixture(scope="function")
+def mock_bucket(monkeypatch):
+    async def mock_stream_file(bucket_key, byte_range=None):
+        content = STORED_FILES[bucket_key]
+        if byte_range is not None:
+            content = content[byte_range[0] : byte_range[0] + byte_range[1]]
+
+        async def _chunks():
+            # Several chunks
+            for idx in range(0, len(content), 8):
+                yield content[idx : idx + 8]
+
+        return len(content), _chunks()
+
+    monkeypatch.setattr(s3_bucket, "stream_file", mock_stream_file)
+    monkeypatch.setattr(
+        s3_bucket, "presign_url", lambda bucket_key, url_expiration=3600: f"https://bucket/{bucket_key}"
+    )
+
+
+@pytest.mark.parametrize(
+    "access_idx, payload, status_code, status_details, expected_names",
+    [
+        [None, {"name": "frames"}, 401, "Not authenticated", None],
+        [0, {"name": "frames"}, 403, "Your access scope is not compatible with this operation.", None],
+        [1, {"name": "invalid name"}, 422, None, None],
+        [1, {"name": "frames"}, 201, None, ["media/1.jpg", "media/2.jpg", "media/3.mp4", "annotations/1.json"]],
+        [
+            1,
+            {"name": "frames", "filters": {"type": "image", "min_width": 1000}},
+            201,
+            None,
+            ["media/1.jpg", "annotations/1.json"],
+        ],
+        [
+            1,
+            {"name": "frames", "filters": {"annotated": True}, "include_annotations": False},
+            201,
+            None,
+            ["media/1.jpg"],
+        ],
+        [1, {"name": "frames", "limit": 1}, 201, None, ["media/1.jpg", "annotations/1.json"]],
+    ],
+)
+@pytest.mark.asyncio
+async def test_create_dataset(
+    test_app_asyncio, init_test_db, mock_bucket, access_idx, payload, status_code, status_details, expected_names
+):
+    auth = None
+    if isinstance(access_idx, int):
+        auth = await pytest.get_token(ACCESS_TABLE[access_idx]["id"], ACCESS_TABLE[access_idx]["scope"].split())
+
+    response = await test_app_asyncio.post("/datasets/", json=payload, headers=auth)
+    assert response.status_code == status_code
+    if isinstance(status_details, str):
+        assert response.json()["detail"] == status_details
+    if response.status_code != 201:
+        return
+    dataset = response.json()
+    assert dataset["name"] == "frames" and dataset["version"] == 1
+    assert dataset["num_items"] == len(expected_names)
+    manifest = (await test_app_asyncio.get(f"/datasets/{dataset['id']}/manifest", headers=auth)).json()
+    assert [item["name"] for item in manifest] == expected_names
+
+    # Next version
+    response = await test_app_asyncio.post("/datasets/", json=payload, headers=auth)
+    assert response.json()["version"] == 2
+
+
+@pytest.mark.asyncio
+async def test_dataset_manifest_and_archive(test_app_asyncio, init_test_db, test_db, mock_bucket):
+    auth = await pytest.get_token(ACCESS_TABLE[1]["id"], ACCESS_TABLE[1]["scope"].split())
+    dataset = (await test_app_asyncio.post("/datasets/", json={"name": "frames"}, headers=auth)).json()
+    assert dataset["size_bytes"] == 60
+
+    response = await test_app_asyncio.get(f"/datasets/{dataset['id']}/manifest", headers=auth)
+    assert response.status_code == 200
+    manifest = {item["name"]: item for item in response.json()}
+    assert manifest["media/1.jpg"]["url"] == "https://bucket/media/a.jpg"
+    assert manifest["media/1.jpg"]["offset"] is None
+    # Packed media
+    assert manifest["media/2.jpg"]["url"] == "https://bucket/shards/first.tar"
+    assert (manifest["media/2.jpg"]["offset"], manifest["media/2.jpg"]["size"]) == (512, 20)
+    assert manifest["annotations/1.json"]["media_id"] == 1 and manifest["annotations/1.json"]["annotation_id"] == 1
+    # By pages
+    url = f"/datasets/{dataset['id']}/manifest"
+    first_page = (await test_app_asyncio.get(url, params={"limit": 2}, headers=auth)).json()
+    next_page = (await test_app_asyncio.get(url, params={"after_id": first_page[-1]["id"]}, headers=auth)).json()
+    assert [item["name"] for item in first_page + next_page] == [item["name"] for item in response.json()]
+    assert len(first_page) == 2 and len(next_page) == len(manifest) - 2
+    assert (await test_app_asyncio.get(url, params={"limit": 1001}, headers=auth)).status_code == 422
+
+    response = await test_app_asyncio.get(f"/datasets/{dataset['id']}/archive", headers=auth)
+    assert response.status_code == 200
+    assert response.headers["content-disposition"] == 'attachment; filename="frames-v1.tar"'
+    with tarfile.open(fileobj=io.BytesIO(response.content)) as tar:
+        assert {member.name: tar.extractfile(member).read() for member in tar} == {
+            "media/1.jpg": b"a" * 10,
+            "media/2.jpg": b"b" * 20,
+            "media/3.mp4": b"c" * 30,
+            "annotations/1.json": b'{"label": "fire"}',
+        }
+
+    # The content of the snapshot outlives the media
+    await test_db.execute(db.media.delete().where(db.media.c.id == 2))
+    assert await tasks.get_referenced_keys(["media/b.jpg"]) == {"media/b.jpg"}
+    response = await test_app_asyncio.delete(f"/datasets/{dataset['id']}/", headers=auth)
+    assert response.status_code == 200
+    assert await tasks.get_referenced_keys(["media/b.jpg"]) == set()
+    assert (await get_entry(test_db, db.jobs, 1))["kind"] == "delete_file"
+    response = await test_app_asyncio.get(f"/datasets/{dataset['id']}/manifest", headers=auth)
+    assert response.status_code == 404
@@ -36,3 +36,11 @@ async def test_create_access_token(test_app_asyncio, init_test_db, payload, stat
     assert response.status_code == status_code, print(payload)
     if isinstance(status_detail, str):
         assert response.json()["detail"] == status_detail
+
+
+@pytest.mark.asyncio
+async def test_get_jwks(test_app_asyncio):
+    response = await test_app_asyncio.get("/login/jwks")
+    assert response.status_code == 200
+    # Secret keys are never exposed
+    assert response.json() == {"keys": []}
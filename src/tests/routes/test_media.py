@@ -1,3 +1,5 @@
+import base64
+import hashlib
 import json
 import os
 import tempfile
@@ -6,11 +8,13 @@ from datetime import datetime
 import pytest
 import pytest_asyncio
 import requests
+from fastapi import HTTPException
 
 from app import db
-from app.api import crud
+from app.api import crud, tasks
+from app.api.routes import media as media_routes
 from app.api.security import hash_content_file
-from app.services import s3_bucket
+from app.services import hash_fields, resolve_bucket_key, resolve_content_file_name, s3_bucket
 from tests.db_utils import TestSessionLocal, fill_table, get_entry
 from tests.utils import update_only_datetime
 
@@ -20,20 +24,56 @@ ACCESS_TABLE = [
 ]
 
 MEDIA_TABLE = [
-    {"id": 1, "type": "image", "created_at": "2020-10-13T08:18:45.447773"},
-    {"id": 2, "type": "video", "created_at": "2020-10-13T09:18:45.447773"},
+    {
+        "id": 1,
+        "type": "image",
+        "device_id": 1,
+        "status": None,
+        "size_bytes": 204800,
+        "content_type": "image/jpeg",
+        "width": 1280,
+        "height": 720,
+        "captured_at": "2020-10-13T08:15:00",
+        "duplicate_of": None,
+        "created_at": "2020-10-13T08:18:45.447773",
+    },
+    {
+        "id": 2,
+        "type": "video",
+        "device_id": 2,
+        "status": None,
+        "size_bytes": None,
+        "content_type": None,
+        "width": None,
+        "height": None,
+        "captured_at": None,
+        "duplicate_of": None,
+        "created_at": "2020-10-13T09:18:45.447773",
+    },
+]
+
+ANNOTATIONS_TABLE = [
+    {"id": 1, "media_id": 2, "status": None, "created_at": "2020-10-13T09:20:45.447773"},
+    {"id": 2, "media_id": 2, "status": None, "created_at": "2020-10-13T09:21:45.447773"},
 ]
 
 
 MEDIA_TABLE_FOR_DB = list(map(update_only_datetime, MEDIA_TABLE))
+ANNOTATIONS_TABLE_FOR_DB = list(map(update_only_datetime, ANNOTATIONS_TABLE))
 
 
 @pytest_asyncio.fixture(scope="function")
 async def init_test_db(monkeypatch, test_db):
     monkeypatch.setattr(crud.base, "database", test_db)
+    monkeypatch.setattr(crud.jobs, "database", test_db)
+    monkeypatch.setattr(crud.media, "database", test_db)
+    monkeypatch.setattr(crud.shards, "database", test_db)
+    monkeypatch.setattr(tasks, "database", test_db)
+    monkeypatch.setattr(media_routes, "database", test_db)
     monkeypatch.setattr(db, "SessionLocal", TestSessionLocal)
     await fill_table(test_db, db.accesses, ACCESS_TABLE)
     await fill_table(test_db, db.media, MEDIA_TABLE_FOR_DB)
+    await fill_table(test_db, db.annotations, ANNOTATIONS_TABLE_FOR_DB)
 
 
 @pytest.mark.parametrize(
@@ -64,22 +104,91 @@ async def test_get_media(test_app_asyncio, init_test_db, access_idx, media_id, s
 
 
 @pytest.mark.parametrize(
-    "access_idx, status_code, status_details, expected_results",
+    "access_idx, media_id, status_code, status_details, expected_results",
     [
-        [None, 401, "Not authenticated", None],
-        [0, 200, None, []],
-        [1, 200, None, MEDIA_TABLE],
+        [None, 1, 401, "Not authenticated", None],
+        [0, 1, 403, "This access can't read resources", None],
+        [1, 1, 200, None, []],
+        [1, 2, 200, None, ANNOTATIONS_TABLE],
+        [1, 999, 404, "Table media has no entry with id=999", None],
+        [1, 0, 422, None, None],
     ],
 )
 @pytest.mark.asyncio
-async def test_fetch_media(test_app_asyncio, init_test_db, access_idx, status_code, status_details, expected_results):
+async def test_fetch_media_annotations(
+    test_app_asyncio, init_test_db, access_idx, media_id, status_code, status_details, expected_results
+):
 
     # Create a custom access token
     auth = None
     if isinstance(access_idx, int):
         auth = await pytest.get_token(ACCESS_TABLE[access_idx]["id"], ACCESS_TABLE[access_idx]["scope"].split())
 
-    response = await test_app_asyncio.get("/media/", headers=auth)
+    response = await test_app_asyncio.get(f"/media/{media_id}/annotations", headers=auth)
+    assert response.status_code == status_code
+    if isinstance(status_details, str):
+        assert response.json()["detail"] == status_details
+
+    if response.status_code // 100 == 2:
+        assert response.json() == expected_results
+
+
+@pytest.mark.parametrize(
+    "access_idx, params, status_code, status_details, expected_results",
+    [
+        [None, {}, 401, "Not authenticated", None],
+        [0, {}, 200, None, []],
+        [1, {}, 200, None, MEDIA_TABLE],
+        [
+            1,
+            {"include": "annotations"},
+            200,
+            None,
+            [
+                {**MEDIA_TABLE[0], "annotations": []},
+                {**MEDIA_TABLE[1], "annotations": ANNOTATIONS_TABLE},
+            ],
+        ],
+        [1, {"include": "devices"}, 422, None, None],
+        [1, {"content_type": "image/jpeg"}, 200, None, MEDIA_TABLE[:1]],
+        [1, {"content_type": "image/png"}, 200, None, []],
+        [1, {"min_width": 1280, "min_height": 720}, 200, None, MEDIA_TABLE[:1]],
+        [1, {"min_width": 1920}, 200, None, []],
+        [1, {"min_size": 1024, "max_size": 1024 * 1024}, 200, None, MEDIA_TABLE[:1]],
+        [1, {"max_size": 1024}, 200, None, []],
+        [
+            1,
+            {"captured_after": "2020-10-13T08:00:00", "captured_before": "2020-10-13T09:00:00"},
+            200,
+            None,
+            MEDIA_TABLE[:1],
+        ],
+        [1, {"captured_after": "2020-10-14T00:00:00"}, 200, None, []],
+        [1, {"device_id": 2}, 200, None, MEDIA_TABLE[1:]],
+        [
+            1,
+            {"device_id": 1, "captured_after": "2020-10-13T08:00:00", "captured_before": "2020-10-13T09:00:00"},
+            200,
+            None,
+            MEDIA_TABLE[:1],
+        ],
+        [1, {"device_id": 2, "captured_after": "2020-10-13T08:00:00"}, 200, None, []],
+        [1, {"device_id": 0}, 422, None, None],
+        [1, {"include": "annotations", "min_width": 1}, 200, None, [{**MEDIA_TABLE[0], "annotations": []}]],
+        [1, {"min_width": 0}, 422, None, None],
+    ],
+)
+@pytest.mark.asyncio
+async def test_fetch_media(
+    test_app_asyncio, init_test_db, access_idx, params, status_code, status_details, expected_results
+):
+
+    # Create a custom access token
+    auth = None
+    if isinstance(access_idx, int):
+        auth = await pytest.get_token(ACCESS_TABLE[access_idx]["id"], ACCESS_TABLE[access_idx]["scope"].split())
+
+    response = await test_app_asyncio.get("/media/", params=params, headers=auth)
     assert response.status_code == status_code
     if isinstance(status_details, str):
         assert response.json()["detail"] == status_details
@@ -94,7 +203,9 @@ async def test_fetch_media(test_app_asyncio, init_test_db, access_idx, status_co
         [None, {}, 401, "Not authenticated"],
         [0, {"type": "video"}, 403, "Your access scope is not compatible with this operation."],
         [1, {}, 201, None],
+        [1, {"device_id": 3, "captured_at": "2020-10-13T08:15:00"}, 201, None],
         [1, {"type": "audio"}, 422, None],
+        [1, {"device_id": 0}, 422, None],
     ],
 )
 @pytest.mark.asyncio
@@ -113,7 +224,7 @@ async def test_create_media(test_app_asyncio, init_test_db, test_db, access_idx,
 
     if response.status_code // 100 == 2:
         json_response = response.json()
-        test_response = {"id": len(MEDIA_TABLE) + 1, **payload, "type": "image"}
+        test_response = {"id": len(MEDIA_TABLE) + 1, **payload, "type": "image", "status": None}
         assert {k: v for k, v in json_response.items() if k != "created_at"} == test_response
 
         new_media = await get_entry(test_db, db.media, json_response["id"])
@@ -153,9 +264,9 @@ async def test_update_media(
     if response.status_code // 100 == 2:
         updated_media = await get_entry(test_db, db.media, media_id)
         updated_media = dict(**updated_media)
-        for k, v in updated_media.items():
-            if k != "bucket_key":
-                assert v == payload.get(k, MEDIA_TABLE_FOR_DB[media_id - 1][k])
+        for k, v in MEDIA_TABLE_FOR_DB[media_id - 1].items():
+            assert updated_media[k] == payload.get(k, v)
+        assert updated_media["version"] == 2
 
 
 @pytest.mark.parametrize(
@@ -164,6 +275,7 @@ async def test_update_media(
         [None, 1, 401, "Not authenticated"],
         [0, 1, 403, "Your access scope is not compatible with this operation."],
         [1, 1, 200, None],
+        [1, 2, 409, "Media has annotations"],
         [1, 999, 404, "Table media has no entry with id=999"],
         [1, 0, 422, None],
     ],
@@ -195,7 +307,7 @@ async def test_upload_media(test_app_asyncio, init_test_db, test_db, monkeypatch
     admin_auth = await pytest.get_token(ACCESS_TABLE[admin_idx]["id"], ACCESS_TABLE[admin_idx]["scope"].split())
 
     # 1 - Create a media that will have an upload
-    payload = {}
+    payload = {"device_id": 1, "captured_at": "2021-06-01T12:00:00"}
     new_media_id = len(MEDIA_TABLE_FOR_DB) + 1
     response = await test_app_asyncio.post("/media/", data=json.dumps(payload), headers=admin_auth)
     assert response.status_code == 201
@@ -236,8 +348,25 @@ async def test_upload_media(test_app_asyncio, init_test_db, test_db, monkeypatch
     updated_media = await get_entry(test_db, db.media, response_json["id"])
     updated_media = dict(**updated_media)
     response_json.pop("created_at")
-    assert {k: v for k, v in updated_media.items() if k not in ("created_at", "bucket_key")} == response_json
+    assert response_json["status"] == "uploaded"
+    # File properties extracted from the headers
+    assert response_json["content_type"] == "image/png"
+    assert response_json["size_bytes"] == len(img_content)
+    assert response_json["width"] > 0 and response_json["height"] > 0
+    # Declared by the device
+    assert response_json["device_id"] == 1 and response_json["captured_at"] == "2021-06-01T12:00:00"
+    assert updated_media.pop("captured_at").isoformat() == response_json.pop("captured_at")
+    assert {k: updated_media[k] for k in response_json if k != "status"} == {
+        k: v for k, v in response_json.items() if k != "status"
+    }
     assert updated_media["bucket_key"] is not None
+    # Integrity check performed in the background
+    assert updated_media["status"] == "verified"
+    # Thumbnail generation left to the worker
+    thumbnail_jobs = await crud.fetch_all(db.jobs, {"kind": db.JobKind.generate_thumbnail})
+    assert [job["payload"] for job in thumbnail_jobs] == [
+        {"bucket_key": updated_media["bucket_key"], "media_type": "image"}
+    ]
 
     # 2b - Upload failing
     async def failing_upload(bucket_key, file_binary):
@@ -246,3 +375,385 @@ async def test_upload_media(test_app_asyncio, init_test_db, test_db, monkeypatch
     monkeypatch.setattr(s3_bucket, "upload_file", failing_upload)
     response = await test_app_asyncio.post(f"/media/{new_media_id}/upload", files=dict(file="bar"), headers=admin_auth)
     assert response.status_code == 500
+
+
+@pytest.mark.parametrize(
+    "num_conflicts, status_code",
+    [
+        # Retried with the latest version of the entry
+        [1, 200],
+        # The upload gives way and removes its own object
+        [3, 409],
+    ],
+)
+@pytest.mark.asyncio
+async def test_upload_media_conflict(test_app_asyncio, init_test_db, test_db, monkeypatch, num_conflicts, status_code):
+    admin_auth = await pytest.get_token(ACCESS_TABLE[1]["id"], ACCESS_TABLE[1]["scope"].split())
+    del admin_auth["Content-Type"]
+    content = b"frame content"
+    bucket_key = resolve_bucket_key(resolve_content_file_name(hash_content_file(content), "frame.jpg"), "media")
+
+    async def mock_upload_file(bucket_key, file_binary):
+        return True
+
+    async def mock_get_file_metadata(bucket_key):
+        return {"ETag": hash_content_file(content, use_md5=True), "ContentLength": len(content)}
+
+    async def mock_delete_file(bucket_key):
+        return True
+
+    monkeypatch.setattr(s3_bucket, "upload_file", mock_upload_file)
+    monkeypatch.setattr(s3_bucket, "get_file_metadata", mock_get_file_metadata)
+    monkeypatch.setattr(s3_bucket, "delete_file", mock_delete_file)
+
+    # Another upload is registered right before each attempt
+    update_entry = crud.update_entry
+    other_keys = []
+
+    async def concurrent_update_entry(table, payload, entry_id, only_specified=True, version=None):
+        if len(other_keys) < num_conflicts:
+            other_keys.append(f"media/other{len(other_keys)}.jpg")
+            await test_db.execute(
+                db.media.update()
+                .where(db.media.c.id == entry_id)
+                .values(bucket_key=other_keys[-1], version=db.media.c.version + 1)
+            )
+        return await update_entry(table, payload, entry_id, only_specified, version)
+
+    monkeypatch.setattr(crud, "update_entry", concurrent_update_entry)
+    response = await test_app_asyncio.post(
+        "/media/1/upload", files=dict(file=("frame.jpg", content)), headers=admin_auth
+    )
+    assert response.status_code == status_code
+    entry = await get_entry(test_db, db.media, 1)
+    assert entry["version"] == 1 + num_conflicts + (status_code == 200)
+    deletions = [
+        job["payload"]["bucket_key"] for job in await crud.fetch_all(db.jobs, {"kind": db.JobKind.delete_file})
+    ]
+    if status_code == 200:
+        assert entry["bucket_key"] == bucket_key and bucket_key not in deletions
+    else:
+        assert response.json()["detail"] == "Table media entry with id=1 was modified concurrently"
+        # The entry still points to the last concurrent upload
+        assert entry["bucket_key"] == other_keys[-1]
+        assert deletions == [bucket_key]
+
+
+@pytest.mark.asyncio
+async def test_precheck_media(test_app_asyncio, init_test_db, test_db, monkeypatch):
+
+    admin_auth = await pytest.get_token(ACCESS_TABLE[1]["id"], ACCESS_TABLE[1]["scope"].split())
+    content = b"frame content"
+    payload = {"sha256": hash_content_file(content), "size": len(content), "filename": "frame.jpg"}
+    bucket_key = f"media/{payload['sha256'][:32]}.jpg"
+
+    async def mock_get_file_metadata(bucket_key):
+        return {"ContentLength": len(content)}
+
+    monkeypatch.setattr(s3_bucket, "get_file_metadata", mock_get_file_metadata)
+
+    # Invalid digest
+    response = await test_app_asyncio.post(
+        "/media/1/precheck", data=json.dumps({**payload, "sha256": "abc"}), headers=admin_auth
+    )
+    assert response.status_code == 422
+    # Content not stored yet
+    response = await test_app_asyncio.post("/media/1/precheck", data=json.dumps(payload), headers=admin_auth)
+    assert response.status_code == 204
+    # Only verified content of the same size is linked
+    await test_db.execute(db.media.update().where(db.media.c.id == 2).values(bucket_key=bucket_key, status="uploaded"))
+    response = await test_app_asyncio.post("/media/1/precheck", data=json.dumps(payload), headers=admin_auth)
+    assert response.status_code == 204
+    await test_db.execute(db.media.update().where(db.media.c.id == 2).values(status="verified"))
+    response = await test_app_asyncio.post(
+        "/media/1/precheck", data=json.dumps({**payload, "size": 1}), headers=admin_auth
+    )
+    assert response.status_code == 204
+    response = await test_app_asyncio.post("/media/1/precheck", data=json.dumps(payload), headers=admin_auth)
+    assert response.status_code == 200
+    assert response.json()["status"] == "verified"
+    entry = await get_entry(test_db, db.media, 1)
+    assert entry["bucket_key"] == bucket_key and entry["status"] == "verified"
+
+
+@pytest.mark.parametrize(
+    "access_idx, media_id, status_code, status_details",
+    [
+        [None, 1, 401, "Not authenticated"],
+        [0, 1, 403, "This access can't read resources"],
+        [1, 1, 404, "Media has no content"],
+        [1, 3, 200, None],
+        [1, 4, 404, "File cannot be found on the bucket storage"],
+    ],
+)
+@pytest.mark.asyncio
+async def test_get_media_thumbnail_url(
+    test_app_asyncio, init_test_db, test_db, monkeypatch, access_idx, media_id, status_code, status_details
+):
+    await fill_table(
+        test_db,
+        db.media,
+        [
+            {"id": 3, "type": "image", "bucket_key": "media/with_thumbnail.jpg"},
+            {"id": 4, "type": "video", "bucket_key": "media/pending.mp4"},
+        ],
+        remove_ids=False,
+    )
+
+    async def mock_check_file_existence(bucket_key):
+        return bucket_key == "thumbnails/with_thumbnail.jpg"
+
+    class MockS3Client:
+        def generate_presigned_url(self, method, Params, ExpiresIn):
+            return f"https://bucket/{Params['Key']}"
+
+    monkeypatch.setattr(s3_bucket, "check_file_existence", mock_check_file_existence)
+    monkeypatch.setattr(s3_bucket, "_client", MockS3Client())
+
+    auth = None
+    if isinstance(access_idx, int):
+        auth = await pytest.get_token(ACCESS_TABLE[access_idx]["id"], ACCESS_TABLE[access_idx]["scope"].split())
+
+    response = await test_app_asyncio.get(f"/media/{media_id}/thumbnail", headers=auth)
+    assert response.status_code == status_code
+    if isinstance(status_details, str):
+        assert response.json()["detail"] == status_details
+    if response.status_code == 200:
+        assert response.json()["url"] == "https://bucket/thumbnails/with_thumbnail.jpg"
+
+
+@pytest.mark.parametrize(
+    "access_idx, media_id, status_code, status_details, expected_url, expected_range",
+    [
+        [None, 3, 401, "Not authenticated", None, None],
+        [0, 3, 403, "This access can't read resources", None, None],
+        [1, 1, 404, "Media has no content", None, None],
+        [1, 3, 200, None, "https://bucket/media/loose.jpg", (None, None)],
+        # Packed media are a byte range of their shard
+        [1, 4, 200, None, "https://bucket/shards/first.tar", (1536, 100)],
+    ],
+)
+@pytest.mark.asyncio
+async def test_get_media_url_and_content(
+    test_app_asyncio,
+    init_test_db,
+    test_db,
+    monkeypatch,
+    access_idx,
+    media_id,
+    status_code,
+    status_details,
+    expected_url,
+    expected_range,
+):
+    await fill_table(
+        test_db,
+        db.media,
+        [
+            {"id": 3, "type": "image", "bucket_key": "media/loose.jpg", "size_bytes": 50, "content_type": "image/jpeg"},
+            {"id": 4, "type": "image", "bucket_key": "media/packed.jpg", "size_bytes": 100},
+        ],
+        remove_ids=False,
+    )
+    await fill_table(test_db, db.shards, [{"id": 1, "bucket_key": "shards/first.tar", "size": 4096, "num_items": 1}])
+    await fill_table(
+        test_db, db.shard_items, [{"bucket_key": "media/packed.jpg", "shard_id": 1, "offset": 1536, "size": 100}]
+    )
+    stored_files = {"media/loose.jpg": b"l" * 50, "shards/first.tar": b"s" * 4096}
+
+    async def mock_check_file_existence(bucket_key):
+        return bucket_key in stored_files
+
+    async def mock_stream_file(bucket_key, byte_range=None):
+        if bucket_key not in stored_files:
+            raise HTTPException(status_code=404, detail="File cannot be found on the bucket storage")
+        content = stored_files[bucket_key]
+        if byte_range is not None:
+            content = content[byte_range[0] : byte_range[0] + byte_range[1]]
+
+        async def _chunks():
+            yield content
+
+        return len(content), _chunks()
+
+    class MockS3Client:
+        def generate_presigned_url(self, method, Params, ExpiresIn):
+            return f"https://bucket/{Params['Key']}"
+
+    monkeypatch.setattr(s3_bucket, "check_file_existence", mock_check_file_existence)
+    monkeypatch.setattr(s3_bucket, "stream_file", mock_stream_file)
+    monkeypatch.setattr(s3_bucket, "_client", MockS3Client())
+
+    auth = None
+    if isinstance(access_idx, int):
+        auth = await pytest.get_token(ACCESS_TABLE[access_idx]["id"], ACCESS_TABLE[access_idx]["scope"].split())
+
+    response = await test_app_asyncio.get(f"/media/{media_id}/url", headers=auth)
+    assert response.status_code == status_code
+    if isinstance(status_details, str):
+        assert response.json()["detail"] == status_details
+    if response.status_code == 200:
+        assert response.json()["url"] == expected_url
+        assert (response.json()["offset"], response.json()["size"]) == expected_range
+
+    response = await test_app_asyncio.get(f"/media/{media_id}/content", headers=auth)
+    assert response.status_code == status_code
+    if response.status_code == 200:
+        assert response.content == (b"l" * 50 if expected_range[0] is None else b"s" * 100)
+        assert int(response.headers["content-length"]) == len(response.content)
+
+
+@pytest.mark.parametrize(
+    "access_idx, payload, status_code, status_details, expected_ids",
+    [
+        [None, {}, 401, "Not authenticated", None],
+        [0, {}, 403, "This access can't read resources", None],
+        [1, {"ids": []}, 422, None, None],
+        [1, {"limit": 1001}, 422, None, None],
+        # Only verified content
+        [1, {}, 200, None, [10, 11, 12]],
+        [1, {"ids": [12, 10, 13, 999]}, 200, None, [10, 12]],
+        [1, {"filters": {"type": "video"}}, 200, None, [12]],
+        [1, {"after_id": 10, "limit": 1}, 200, None, [11]],
+    ],
+)
+@pytest.mark.asyncio
+async def test_get_media_urls(
+    test_app_asyncio, init_test_db, test_db, monkeypatch, access_idx, payload, status_code, status_details, expected_ids
+):
+    await test_db.execute(db.media.update().values(status="uploaded"))
+    await fill_table(
+        test_db,
+        db.media,
+        [
+            {"id": 10, "type": "image", "bucket_key": "media/ab12.jpg", "status": "verified", "size_bytes": 50},
+            {"id": 11, "type": "image", "bucket_key": "media/cd34.jpg", "status": "verified", "size_bytes": 100},
+            {"id": 12, "type": "video", "bucket_key": "media/ef56.mp4", "status": "verified", "size_bytes": 200},
+            {"id": 13, "type": "image", "bucket_key": "media/0000.jpg", "status": "corrupted", "size_bytes": 10},
+        ],
+        remove_ids=False,
+    )
+    await fill_table(test_db, db.shards, [{"bucket_key": "shards/first.tar", "size": 4096, "num_items": 1}])
+    await fill_table(
+        test_db, db.shard_items, [{"bucket_key": "media/cd34.jpg", "shard_id": 1, "offset": 512, "size": 100}]
+    )
+    monkeypatch.setattr(
+        s3_bucket, "presign_url", lambda bucket_key, url_expiration=3600: f"https://bucket/{bucket_key}"
+    )
+
+    auth = None
+    if isinstance(access_idx, int):
+        auth = await pytest.get_token(ACCESS_TABLE[access_idx]["id"], ACCESS_TABLE[access_idx]["scope"].split())
+
+    response = await test_app_asyncio.post("/media/urls", json=payload, headers=auth)
+    assert response.status_code == status_code
+    if isinstance(status_details, str):
+        assert response.json()["detail"] == status_details
+    if response.status_code == 200:
+        items = response.json()
+        assert [item["media_id"] for item in items] == expected_ids
+        urls = {item["media_id"]: item for item in items}
+        if 10 in urls:
+            assert urls[10] == {
+                "media_id": 10,
+                "content_name": "ab12.jpg",
+                "size_bytes": 50,
+                "url": "https://bucket/media/ab12.jpg",
+                "offset": None,
+                "size": None,
+            }
+        if 11 in urls:
+            # Packed
+            assert (urls[11]["url"], urls[11]["offset"], urls[11]["size"]) == (
+                "https://bucket/shards/first.tar",
+                512,
+                100,
+            )
+
+
+@pytest.mark.parametrize(
+    "access_idx, media_id, params, status_code, status_details, expected_ids",
+    [
+        [None, 3, {}, 401, "Not authenticated", None],
+        [0, 3, {}, 403, "This access can't read resources", None],
+        [1, 1, {}, 404, "Media has no perceptual hash", None],
+        [1, 999, {}, 404, "Table media has no entry with id=999", None],
+        # Closest first, without the media itself
+        [1, 3, {}, 200, None, [(4, 0), (5, 4)]],
+        [1, 3, {"max_distance": 0}, 200, None, [(4, 0)]],
+        [1, 3, {"max_distance": 11}, 200, None, [(4, 0), (5, 4), (6, 9)]],
+        [1, 3, {"max_distance": 64}, 422, None, None],
+    ],
+)
+@pytest.mark.asyncio
+async def test_fetch_media_duplicates(
+    test_app_asyncio, init_test_db, test_db, access_idx, media_id, params, status_code, status_details, expected_ids
+):
+    phash = 0x5060B79790B0605
+    # Distances of 0, 4 (spread over the bands), 9 (several bits in the same band) & 64
+    other_hashes = [phash, phash ^ 0x0001000100010001, phash ^ 0x00000000000001FF, phash ^ (2**64 - 1)]
+    await fill_table(
+        test_db,
+        db.media,
+        [
+            {"id": idx, "type": "image", **hash_fields(value)}
+            for idx, value in enumerate([phash, *other_hashes], start=len(MEDIA_TABLE) + 1)
+        ],
+        remove_ids=False,
+    )
+
+    auth = None
+    if isinstance(access_idx, int):
+        auth = await pytest.get_token(ACCESS_TABLE[access_idx]["id"], ACCESS_TABLE[access_idx]["scope"].split())
+
+    response = await test_app_asyncio.get(f"/media/{media_id}/duplicates", params=params, headers=auth)
+    assert response.status_code == status_code
+    if isinstance(status_details, str):
+        assert response.json()["detail"] == status_details
+    if response.status_code == 200:
+        assert [(entry["id"], entry["distance"]) for entry in response.json()] == expected_ids
+
+
+@pytest.mark.asyncio
+async def test_put_media_content(test_app_asyncio, init_test_db, test_db, monkeypatch):
+    admin_auth = await pytest.get_token(ACCESS_TABLE[1]["id"], ACCESS_TABLE[1]["scope"].split())
+    headers = {**admin_auth, "Content-Type": "application/octet-stream"}
+    content = b"raw frame content" * 1000
+    content_md5 = base64.b64encode(hashlib.md5(content).digest()).decode()  # nosec B324
+    uploaded = {}
+
+    async def mock_upload_file(bucket_key, file_binary):
+        uploaded[bucket_key] = file_binary.read()
+        return True
+
+    monkeypatch.setattr(s3_bucket, "upload_file", mock_upload_file)
+    monkeypatch.setattr(tasks.cfg, "UPLOAD_VERIFICATION", False)
+
+    # Wrong content type
+    response = await test_app_asyncio.put(
+        "/media/1/content", params={"filename": "frame.jpg"}, content=content, headers=admin_auth
+    )
+    assert response.status_code == 415
+    # Corrupted content
+    response = await test_app_asyncio.put(
+        "/media/1/content",
+        params={"filename": "frame.jpg"},
+        content=content[:-1] + b"!",
+        headers={**headers, "Content-MD5": content_md5},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Content-MD5 mismatch"
+    assert len(uploaded) == 0
+
+    response = await test_app_asyncio.put(
+        "/media/1/content",
+        params={"filename": "frame.jpg"},
+        content=content,
+        headers={**headers, "Content-MD5": content_md5},
+    )
+    assert response.status_code == 200, response.text
+    bucket_key = f"media/{hash_content_file(content)[:32]}.jpg"
+    assert uploaded == {bucket_key: content}
+    assert response.json()["status"] == "uploaded"
+    assert response.json()["size_bytes"] == len(content)
+    assert (await get_entry(test_db, db.media, 1))["bucket_key"] == bucket_key
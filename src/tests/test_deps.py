@@ -1,10 +1,13 @@
 import pytest
 import pytest_asyncio
-from fastapi import HTTPException
+from fastapi import APIRouter, BackgroundTasks, FastAPI, File, HTTPException, UploadFile
 from fastapi.security import SecurityScopes
+from httpx import AsyncClient
 
+from app import config as cfg
 from app import db
 from app.api import crud, deps, security
+from app.api.ratelimit import ConcurrencyLimiter
 from app.api.schemas import AccessRead
 from tests.db_utils import fill_table
 
@@ -48,3 +51,36 @@ async def test_get_current_access(init_test_db, token_data, scope, expected_acce
         access = await deps.get_current_access(SecurityScopes([scope]), token=token)
         if isinstance(expected_access, int):
             assert access.dict() == AccessRead(**ACCESS_TABLE[expected_access]).dict()
+
+
+@pytest.mark.asyncio
+async def test_admission_route(monkeypatch):
+    monkeypatch.setitem(cfg.RATE_LIMITS, "admin", (0.01, 2))
+    limiter = ConcurrencyLimiter(1)
+    calls, in_flight = [], []
+    router = APIRouter(route_class=deps.AdmissionRoute)
+
+    @router.post("/upload")
+    @deps.admission(limiter)
+    async def upload(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+        calls.append(file.filename)
+        background_tasks.add_task(lambda: in_flight.append(limiter.in_flight))
+        return {}
+
+    app = FastAPI()
+    app.include_router(router)
+    token = await security.create_access_token({"sub": "3", "scopes": ["admin"]})
+    headers = {"Authorization": f"Bearer {token}"}
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.post("/upload", files={"file": ("frame.jpg", b"content")}, headers=headers)
+        assert response.status_code == 200
+        # The slot is released before the background tasks run
+        assert in_flight == [0] and limiter.in_flight == 0
+        # Refused before the body is read
+        assert limiter.try_acquire()
+        response = await client.post("/upload", files={"file": ("busy.jpg", b"content")}, headers=headers)
+        assert response.status_code == 429 and limiter.in_flight == 1
+        limiter.release()
+        response = await client.post("/upload", files={"file": ("limited.jpg", b"content")}, headers=headers)
+        assert response.status_code == 429 and "Retry-After" in response.headers
+    assert calls == ["frame.jpg"]
@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+from app import db
+from app.api import ratelimit
+from app.api.ratelimit import ConcurrencyLimiter, DatabaseStore, MemoryStore
+
+
+@pytest.mark.asyncio
+async def test_memory_store():
+    store = MemoryStore()
+    # Burst
+    assert await store.consume("access:1", rate=1, burst=2) == 0
+    assert await store.consume("access:1", rate=1, burst=2) == 0
+    wait_time = await store.consume("access:1", rate=1, burst=2)
+    assert 0 < wait_time <= 1
+    # Buckets are independent
+    assert await store.consume("access:2", rate=1, burst=2) == 0
+    # Buckets that are full again are forgotten
+    assert await store.consume("access:3", rate=1000, burst=2) == 0
+    time.sleep(0.01)
+    store.evict_idle()
+    assert set(store._buckets) == {"access:1", "access:2"}
+
+
+@pytest.mark.asyncio
+async def test_database_store(monkeypatch, test_db):
+    monkeypatch.setattr(ratelimit, "database", test_db)
+    store = DatabaseStore(db.rate_limits)
+    assert await store.consume("access:1", rate=0.1, burst=2) == 0
+    assert await store.consume("access:1", rate=0.1, burst=2) == 0
+    wait_time = await store.consume("access:1", rate=0.1, burst=2)
+    assert 0 < wait_time <= 10
+    # A refused request doesn't consume tokens
+    assert await store.consume("access:1", rate=0.1, burst=2) <= wait_time
+    assert await store.consume("access:2", rate=0.1, burst=2) == 0
+
+
+def test_concurrency_limiter():
+    limiter = ConcurrencyLimiter(2)
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release()
+    assert limiter.try_acquire()
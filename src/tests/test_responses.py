@@ -0,0 +1,77 @@
+import json
+from datetime import datetime
+from typing import List
+
+import pytest
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from httpx import AsyncClient
+from pydantic import parse_obj_as
+
+from app.api.responses import JSONGZipMiddleware, fast_response, project
+from app.api.schemas import AccessRead, MediaAnnotationsOut
+from app.db.models import MediaType, UploadStatus
+
+
+def test_project():
+    row = {"id": 1, "login": "first_login", "hashed_password": "hashed_pwd", "scope": "user"}
+    # Fields outside of the response model are left out
+    assert project(row, AccessRead) == {"id": 1, "login": "first_login", "scope": "user"}
+
+
+def test_fast_response():
+    rows = [
+        {
+            "id": 1,
+            "bucket_key": "media/frame.jpg",
+            "type": MediaType.image,
+            "status": UploadStatus.verified,
+            "size_bytes": 1024,
+            "content_type": "image/jpeg",
+            "width": 1280,
+            "height": 720,
+            "captured_at": datetime(2020, 10, 13, 8, 15),
+            "phash": 42,
+            "duplicate_of": None,
+            "created_at": datetime(2020, 10, 13, 8, 18, 45, 447773),
+            "annotations": [
+                {
+                    "id": 1,
+                    "media_id": 1,
+                    "bucket_key": "annotations/labels.json",
+                    "status": None,
+                    "created_at": datetime(2020, 10, 13, 9, 20, 45, 447773),
+                }
+            ],
+        }
+    ]
+    response = fast_response(rows, MediaAnnotationsOut)
+    assert response.media_type == "application/json"
+    # Same document as the validated path
+    expected = jsonable_encoder(parse_obj_as(List[MediaAnnotationsOut], rows))
+    assert json.loads(response.body) == expected
+    assert "bucket_key" not in json.loads(response.body)[0]
+
+
+@pytest.mark.asyncio
+async def test_json_gzip_middleware():
+    app = FastAPI()
+    app.add_middleware(JSONGZipMiddleware, minimum_size=100, compresslevel=5)
+    content = b"\xff" * 1000
+
+    @app.get("/listing")
+    async def listing():
+        return [{"id": idx} for idx in range(100)]
+
+    @app.get("/content")
+    async def get_content():
+        return StreamingResponse(iter([content]), media_type="image/jpeg", headers={"Content-Length": "1000"})
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/listing", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip" and len(response.json()) == 100
+        # Binary contents are streamed as is, with their length
+        response = await client.get("/content", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in response.headers and response.headers["Content-Length"] == "1000"
+        assert response.content == content
@@ -1,8 +1,11 @@
+import gzip
 from datetime import datetime, timedelta
 
 import pytest
 import requests
-from jose import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from jose import JWTError, jwt
 
 from app import config as cfg
 from app.api import security
@@ -45,6 +48,22 @@ def test_hash_content_file():
     assert hash1 != hash2
 
 
+def test_hash_gzip_content():
+
+    content = b"fire" * 1000000
+    compressed = gzip.compress(content)
+    # Same hash as the decompressed content, computed by chunks
+    assert security.hash_gzip_content(compressed, len(content), chunk_size=1024) == security.hash_content_file(content)
+    # Decompression bomb
+    with pytest.raises(ValueError):
+        security.hash_gzip_content(compressed, len(content) - 1)
+    # Invalid content
+    with pytest.raises(ValueError):
+        security.hash_gzip_content(content, len(content))
+    with pytest.raises(ValueError):
+        security.hash_gzip_content(compressed[:-10], len(content))
+
+
 @pytest.mark.parametrize(
     "content, expiration, expected_delta",
     [
@@ -64,3 +83,69 @@ async def test_create_access_token(content, expiration, expected_delta):
     assert all(v == decoded_data[k] for k, v in content.items())
     # Check expiration
     assert datetime.utcfromtimestamp(decoded_data["exp"]) - timedelta(minutes=expected_delta) < after
+
+
+def _pem_keys(private_key):
+    private_pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    public_pem = (
+        private_key.public_key()
+        .public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+        .decode()
+    )
+    return private_pem, public_pem
+
+
+def test_keyset():
+    rsa_private, rsa_public = _pem_keys(rsa.generate_private_key(public_exponent=65537, key_size=2048))
+    ec_private, ec_public = _pem_keys(ec.generate_private_key(ec.SECP256R1()))
+    claims = {"sub": "1"}
+
+    # Rotation: tokens of the previous key remain valid while it's in the key set
+    old_keyset = security.KeySet([{"kid": "old", "alg": "HS256", "key": "old_secret"}])
+    old_token = old_keyset.encode(claims)
+    assert jwt.get_unverified_header(old_token)["kid"] == "old"
+    keyset = security.KeySet(
+        [
+            {"kid": "old", "alg": "HS256", "key": "old_secret"},
+            {"kid": "new", "alg": "RS256", "key": rsa_private},
+        ],
+        signing_kid="new",
+    )
+    new_token = keyset.encode(claims)
+    assert jwt.get_unverified_header(new_token)["kid"] == "new"
+    assert keyset.decode(old_token) == claims
+    # Verified by the node that signed it
+    assert keyset.decode(new_token) == claims
+    # Once removed
+    with pytest.raises(JWTError):
+        security.KeySet([{"kid": "new", "alg": "RS256", "key": rsa_private}]).decode(old_token)
+
+    # Verification with the public key only
+    verifier = security.KeySet([{"kid": "new", "alg": "RS256", "key": rsa_public}])
+    assert verifier.decode(new_token) == claims
+    # Only public keys are exposed
+    jwks = keyset.jwks()["keys"]
+    assert len(jwks) == 1 and jwks[0]["kid"] == "new" and jwks[0]["kty"] == "RSA" and "d" not in jwks[0]
+
+    # Elliptic curves
+    ec_keyset = security.KeySet([{"kid": "ec", "alg": "ES256", "key": ec_private}])
+    ec_token = ec_keyset.encode(claims)
+    assert ec_keyset.decode(ec_token) == claims
+    assert security.KeySet([{"kid": "ec", "alg": "ES256", "key": ec_public}]).decode(ec_token) == claims
+
+    # Algorithm confusion: a token signed with HS256 using the public key as a secret
+    forged = jwt.encode(claims, "forged", algorithm="HS256", headers={"kid": "new"})
+    with pytest.raises(JWTError):
+        verifier.decode(forged)
+
+    # Invalid configurations
+    with pytest.raises(ValueError):
+        security.KeySet([])
+    with pytest.raises(ValueError):
+        security.KeySet([{"kid": "a", "alg": "none", "key": ""}])
+    with pytest.raises(ValueError):
+        security.KeySet([{"kid": "a", "alg": "HS256", "key": "secret"}], signing_kid="b")
+    with pytest.raises(ValueError):
+        verifier.encode(claims)
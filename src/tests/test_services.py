@@ -1,5 +1,29 @@
-from app.services import resolve_bucket_key, s3_bucket
-from app.services.bucket import S3Bucket
+import io
+import tarfile
+from datetime import datetime
+
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+from fastapi import HTTPException
+from PIL import Image
+
+from app.services import (
+    TAR_END,
+    band_neighbors,
+    compute_dhash,
+    extract_file_metadata,
+    hamming_distance,
+    hash_fields,
+    make_thumbnail,
+    resolve_bucket_key,
+    s3_bucket,
+    tar_header,
+    tar_padding,
+    thumbnail_key,
+    write_shard,
+)
+from app.services.bucket import S3Bucket, StreamingUpload
 
 
 def test_resolve_bucket_key(monkeypatch):
@@ -15,3 +39,189 @@ def test_resolve_bucket_key(monkeypatch):
 
 def test_bucket_service():
     assert isinstance(s3_bucket, S3Bucket)
+
+
+@pytest.mark.asyncio
+async def test_bucket_stream_file():
+    bucket = S3Bucket("us-east-1", "http://localhost:9000", "access", "secret", "bucket")
+    with Stubber(bucket._s3) as stubber:
+        stubber.add_client_error("get_object", "NoSuchKey", http_status_code=404)
+        stubber.add_client_error("get_object", "SlowDown", http_status_code=503)
+        # Missing files
+        with pytest.raises(HTTPException) as exc_info:
+            await bucket.stream_file("media/missing.jpg")
+        assert exc_info.value.status_code == 404
+        # Other errors are not mistaken for missing files
+        with pytest.raises(ClientError):
+            await bucket.stream_file("media/frame.jpg")
+
+
+def test_extract_file_metadata():
+    # JPEG with a capture time
+    exif = Image.Exif()
+    exif.get_ifd(0x8769)[0x9003] = "2023:06:21 14:03:12"
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48)).save(buffer, format="JPEG", exif=exif)
+    buffer.seek(0)
+    metadata = extract_file_metadata(buffer, "frame.jpg")
+    assert metadata == {
+        "size_bytes": len(buffer.getvalue()),
+        "content_type": "image/jpeg",
+        "width": 64,
+        "height": 48,
+        "captured_at": datetime(2023, 6, 21, 14, 3, 12),
+    }
+    # The file position is restored
+    assert buffer.tell() == 0
+
+    # The actual format prevails over the extension
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32)).save(buffer, format="PNG")
+    buffer.seek(0)
+    metadata = extract_file_metadata(buffer, "frame.jpg")
+    assert metadata["content_type"] == "image/png" and metadata["captured_at"] is None
+
+    # Non-image content
+    metadata = extract_file_metadata(io.BytesIO(b"\x00" * 100), "clip.mp4")
+    assert metadata == {
+        "size_bytes": 100,
+        "content_type": "video/mp4",
+        "width": None,
+        "height": None,
+        "captured_at": None,
+    }
+
+
+def test_write_shard():
+    items = [("media/a.jpg", b"a" * 1000), ("media/b.jpg", b""), ("media/c.jpg", bytes(range(256)))]
+    archive = io.BytesIO()
+    index = write_shard(items, archive)
+    content = archive.getvalue()
+    assert [(name, size) for name, _, size in index] == [(name, len(data)) for name, data in items]
+    # Byte-range reads
+    for (name, offset, size), (_, data) in zip(index, items):
+        assert content[offset : offset + size] == data
+    # Sequential reads
+    archive.seek(0)
+    with tarfile.open(fileobj=archive) as tar:
+        assert [(member.name, tar.extractfile(member).read()) for member in tar] == items
+    # Deterministic
+    assert write_shard(items, io.BytesIO()) == index
+
+
+def test_tar_header():
+    # Archive written on the fly
+    items = [("media/a.jpg", b"a" * 1000), ("annotations/b.json", b"{}")]
+    content = b"".join(tar_header(name, len(data)) + data + tar_padding(len(data)) for name, data in items) + TAR_END
+    assert len(content) % 512 == 0
+    with tarfile.open(fileobj=io.BytesIO(content)) as tar:
+        assert [(member.name, tar.extractfile(member).read()) for member in tar] == items
+
+
+def test_thumbnail_key():
+    assert thumbnail_key("media/0123abcd.jpg") == "thumbnails/0123abcd.jpg"
+    assert thumbnail_key("media/0123abcd.mp4") == "thumbnails/0123abcd.jpg"
+
+
+def test_make_thumbnail():
+    buffer = io.BytesIO()
+    Image.new("RGBA", (1000, 500)).save(buffer, format="PNG")
+    with Image.open(io.BytesIO(make_thumbnail(buffer.getvalue(), max_size=128))) as img:
+        assert img.format == "JPEG"
+        # Aspect ratio is preserved
+        assert img.size == (128, 64)
+
+
+def _encode(img, **kwargs):
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", **kwargs)
+    buffer.seek(0)
+    return buffer
+
+
+def test_compute_dhash():
+    img = Image.effect_mandelbrot((640, 480), (-2, -1.5, 1, 1.5), 100).convert("RGB")
+    buffer = _encode(img)
+    phash = compute_dhash(buffer)
+    assert isinstance(phash, int) and 0 <= phash < 2**64
+    assert buffer.tell() == 0
+    # Robust to rescaling & recompression
+    assert hamming_distance(phash, compute_dhash(_encode(img.resize((320, 240)), quality=50))) <= 4
+    # But not to a different content
+    assert hamming_distance(phash, compute_dhash(_encode(img.rotate(90)))) > 10
+    assert compute_dhash(io.BytesIO(b"not an image")) is None
+
+
+def test_hash_fields():
+    assert hash_fields(None) == dict.fromkeys(["phash", "phash_band0", "phash_band1", "phash_band2", "phash_band3"])
+    # Stored as a signed 64-bit integer
+    fields = hash_fields(2**64 - 1)
+    assert fields["phash"] == -1
+    assert all(fields[f"phash_band{idx}"] == 2**16 - 1 for idx in range(4))
+    assert hamming_distance(fields["phash"], 0) == 64
+    assert hash_fields(0x0004000300020001)["phash_band0"] == 1
+    assert hash_fields(0x0004000300020001)["phash_band3"] == 4
+
+
+def test_band_neighbors():
+    assert band_neighbors(5, 0) == [5]
+    neighbors = band_neighbors(5, 1)
+    assert len(neighbors) == 17 and len(set(neighbors)) == 17
+    assert all(hamming_distance(5, value) <= 1 for value in neighbors)
+    assert len(band_neighbors(5, 2)) == 1 + 16 + 120
+
+
+class FakeBucket:
+    def __init__(self):
+        self.files = {}
+        self.parts = {}
+
+    async def upload_file(self, bucket_key, file_binary):
+        self.files[bucket_key] = file_binary.read()
+        return True
+
+    async def start_multipart_upload(self, bucket_key):
+        self.parts[bucket_key] = []
+        return "upload_id"
+
+    async def upload_part(self, bucket_key, upload_id, part_number, data):
+        self.parts[bucket_key].append(data)
+        return {"ETag": f"etag{part_number}", "PartNumber": part_number}
+
+    async def complete_multipart_upload(self, bucket_key, upload_id, parts):
+        assert [part["PartNumber"] for part in parts] == list(range(1, len(parts) + 1))
+        self.files[bucket_key] = b"".join(self.parts.pop(bucket_key))
+
+    async def abort_multipart_upload(self, bucket_key, upload_id):
+        self.parts.pop(bucket_key)
+
+    async def copy_file(self, source_key, bucket_key):
+        self.files[bucket_key] = self.files[source_key]
+
+    async def delete_file(self, bucket_key):
+        self.files.pop(bucket_key, None)
+
+
+@pytest.mark.parametrize("content_size", [0, 10, 25, 40])
+@pytest.mark.asyncio
+async def test_streaming_upload(content_size):
+    bucket = FakeBucket()
+    content = bytes(range(content_size))
+    upload = StreamingUpload(bucket, "media/uploads/tmp", part_size=10)
+    for idx in range(0, content_size, 3):
+        await upload.write(content[idx : idx + 3])
+    # Small files are kept in memory
+    assert upload.is_complete_in_memory == (content_size < 10)
+    if upload.is_complete_in_memory:
+        assert upload.getvalue() == content
+    else:
+        assert upload.head == content[:10]
+    assert await upload.finalize("media/final.bin")
+    # The staging file is removed
+    assert bucket.files == {"media/final.bin": content} and bucket.parts == {}
+
+    # Aborted upload
+    upload = StreamingUpload(bucket, "media/uploads/tmp", part_size=10)
+    await upload.write(content)
+    await upload.abort()
+    assert bucket.parts == {}
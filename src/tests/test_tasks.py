@@ -0,0 +1,272 @@
+import io
+import tarfile
+from datetime import date, datetime
+
+import pytest
+import pytest_asyncio
+from PIL import Image
+
+from app import config as cfg
+from app import db
+from app.api import crud, tasks
+from app.api.schemas import MediaIn
+from app.db.models import JobKind
+from app.services import make_thumbnail, s3_bucket
+from tests.db_utils import fill_table, get_entry
+from tests.utils import update_only_datetime
+
+MEDIA_TABLE = [
+    {
+        "id": 1,
+        "type": "image",
+        "bucket_key": "media/new.jpg",
+        "status": "uploaded",
+        "created_at": "2020-10-13T08:18:45.447773",
+    },
+    {
+        "id": 2,
+        "type": "image",
+        "bucket_key": "media/other.jpg",
+        "status": None,
+        "created_at": "2020-10-13T09:18:45.447773",
+    },
+]
+
+MEDIA_TABLE_FOR_DB = list(map(update_only_datetime, MEDIA_TABLE))
+
+
+@pytest_asyncio.fixture(scope="function")
+async def init_test_db(monkeypatch, test_db):
+    monkeypatch.setattr(crud.base, "database", test_db)
+    monkeypatch.setattr(crud.jobs, "database", test_db)
+    monkeypatch.setattr(crud.media, "database", test_db)
+    monkeypatch.setattr(crud.shards, "database", test_db)
+    monkeypatch.setattr(tasks, "database", test_db)
+    await fill_table(test_db, db.media, MEDIA_TABLE_FOR_DB)
+
+
+@pytest.mark.parametrize(
+    "etag, previous_key, expected_key, expected_status, expected_deletions",
+    [
+        ["right_md5", "media/old.jpg", "media/new.jpg", "verified", ["media/old.jpg", "thumbnails/old.jpg"]],
+        # The previous key is still used by another entry
+        ["right_md5", "media/other.jpg", "media/new.jpg", "verified", []],
+        ["wrong_md5", "media/old.jpg", "media/old.jpg", "corrupted", ["media/new.jpg", "thumbnails/new.jpg"]],
+    ],
+)
+@pytest.mark.asyncio
+async def test_verify_upload(
+    init_test_db, test_db, monkeypatch, etag, previous_key, expected_key, expected_status, expected_deletions
+):
+    async def mock_get_file_metadata(bucket_key):
+        return {"ETag": f'"{etag}"', "ContentLength": 10}
+
+    deleted_keys = []
+
+    async def mock_delete_file(bucket_key):
+        deleted_keys.append(bucket_key)
+
+    monkeypatch.setattr(s3_bucket, "get_file_metadata", mock_get_file_metadata)
+    monkeypatch.setattr(s3_bucket, "delete_file", mock_delete_file)
+
+    payload = {
+        "table": "media",
+        "entry_id": 1,
+        "bucket_key": "media/new.jpg",
+        "md5": "right_md5",
+        "size": 10,
+        "previous_key": previous_key,
+    }
+    await tasks.verify_upload(payload)
+    entry = await get_entry(test_db, db.media, 1)
+    assert entry["bucket_key"] == expected_key
+    assert entry["status"] == expected_status
+    assert deleted_keys == expected_deletions
+
+
+@pytest.mark.asyncio
+async def test_run_job(init_test_db, test_db, monkeypatch):
+    monkeypatch.setattr(tasks.cfg, "JOB_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(tasks.cfg, "JOB_RETRY_DELAY", 0)
+
+    async def failing_delete(bucket_key):
+        raise ValueError("unreachable bucket")
+
+    monkeypatch.setattr(s3_bucket, "delete_file", failing_delete)
+    job_id = await crud.jobs.enqueue(db.jobs, db.JobKind.delete_file, {"bucket_key": "media/unknown.jpg"})
+    await tasks.run_job(job_id)
+    job = await get_entry(test_db, db.jobs, job_id)
+    assert job["status"] == "failed"
+    assert job["attempts"] == 2
+    assert "unreachable bucket" in job["last_error"]
+
+    # A finished job can't be executed twice
+    async def mock_delete_file(bucket_key):
+        return None
+
+    monkeypatch.setattr(s3_bucket, "delete_file", mock_delete_file)
+    job_id = await crud.jobs.enqueue(db.jobs, db.JobKind.delete_file, {"bucket_key": "media/unknown.jpg"})
+    await tasks.run_job(job_id)
+    await tasks.run_job(job_id)
+    job = await get_entry(test_db, db.jobs, job_id)
+    assert job["status"] == "done"
+    assert job["attempts"] == 1
+
+
+@pytest.mark.asyncio
+async def test_generate_thumbnail(init_test_db, test_db, monkeypatch):
+    buffer = io.BytesIO()
+    Image.new("RGB", (1280, 720)).save(buffer, format="JPEG")
+    stored_files = {"media/new.jpg": buffer.getvalue()}
+    downloads = []
+
+    async def mock_check_file_existence(bucket_key):
+        return bucket_key in stored_files
+
+    async def mock_download_file(bucket_key, byte_range=None):
+        downloads.append(bucket_key)
+        return stored_files[bucket_key]
+
+    async def mock_upload_file(bucket_key, file_binary):
+        stored_files[bucket_key] = file_binary.read()
+        return True
+
+    async def mock_render_thumbnail(content, is_video=False):
+        # Rendered in the process of the test
+        return make_thumbnail(content, is_video)
+
+    monkeypatch.setattr(s3_bucket, "check_file_existence", mock_check_file_existence)
+    monkeypatch.setattr(s3_bucket, "download_file", mock_download_file)
+    monkeypatch.setattr(s3_bucket, "upload_file", mock_upload_file)
+    monkeypatch.setattr(tasks, "render_thumbnail", mock_render_thumbnail)
+
+    await tasks.generate_thumbnail({"bucket_key": "media/new.jpg", "media_type": "image"})
+    with Image.open(io.BytesIO(stored_files["thumbnails/new.jpg"])) as img:
+        assert img.format == "JPEG" and max(img.size) == 256
+    # Same content: generated only once
+    await tasks.generate_thumbnail({"bucket_key": "media/new.jpg", "media_type": "image"})
+    # Content not referenced anymore
+    await tasks.generate_thumbnail({"bucket_key": "media/removed.jpg", "media_type": "image"})
+    assert downloads == ["media/new.jpg"]
+
+
+@pytest.mark.asyncio
+async def test_pack_shards(init_test_db, test_db, monkeypatch):
+    monkeypatch.setattr(tasks.cfg, "SHARD_SIZE", 250)
+    monkeypatch.setattr(tasks.cfg, "PACKING_MAX_ITEM_SIZE", 100)
+    monkeypatch.setattr(tasks.cfg, "SHARD_MAX_WAIT", 0)
+    entries = [
+        dict(id=idx, type="image", bucket_key=f"media/{idx}.jpg", status="verified", size_bytes=size)
+        for idx, size in zip(range(3, 8), [100, 100, 100, 60, 200])
+    ]
+    await fill_table(test_db, db.media, [{**entry, "created_at": datetime.utcnow()} for entry in entries])
+    stored_files = {entry["bucket_key"]: bytes([entry["id"]]) * entry["size_bytes"] for entry in entries}
+
+    async def mock_download_file(bucket_key, byte_range=None):
+        content = stored_files[bucket_key]
+        return content if byte_range is None else content[byte_range[0] : byte_range[0] + byte_range[1]]
+
+    async def mock_upload_file(bucket_key, file_binary):
+        stored_files[bucket_key] = file_binary.read()
+        return True
+
+    async def mock_delete_file(bucket_key):
+        stored_files.pop(bucket_key, None)
+
+    async def mock_delete_files(bucket_keys):
+        for bucket_key in bucket_keys:
+            stored_files.pop(bucket_key, None)
+        return []
+
+    monkeypatch.setattr(s3_bucket, "download_file", mock_download_file)
+    monkeypatch.setattr(s3_bucket, "upload_file", mock_upload_file)
+    monkeypatch.setattr(s3_bucket, "delete_file", mock_delete_file)
+    monkeypatch.setattr(s3_bucket, "delete_files", mock_delete_files)
+
+    await tasks.pack_shards({})
+    # Oldest first, up to the shard size (the largest item stays an individual file)
+    shard_keys = [key for key in stored_files if key.startswith("shards/")]
+    assert len(shard_keys) == 1
+    assert sorted(key for key in stored_files if key.startswith("media/")) == [
+        "media/5.jpg",
+        "media/6.jpg",
+        "media/7.jpg",
+    ]
+    with tarfile.open(fileobj=io.BytesIO(stored_files[shard_keys[0]])) as tar:
+        assert tar.getnames() == ["media/3.jpg", "media/4.jpg"]
+    # Items are read by byte range
+    file_key, byte_range = await tasks.locate_content("media/4.jpg")
+    assert file_key == shard_keys[0]
+    assert await s3_bucket.download_file(file_key, byte_range) == b"\x04" * 100
+    assert await tasks.locate_content("media/7.jpg") == ("media/7.jpg", None)
+    assert await tasks.is_content_stored("media/4.jpg", 100)
+    # The next shard is queued
+    assert await crud.jobs.last_created_at(db.jobs, JobKind.pack_shards) is not None
+    # Remaining items are packed once they have waited long enough
+    await tasks.pack_shards({})
+    assert len([key for key in stored_files if key.startswith("shards/")]) == 2
+    assert [key for key in stored_files if key.startswith("media/")] == ["media/7.jpg"]
+
+    # The shard is deleted with its last item
+    await test_db.execute(db.media.delete().where(db.media.c.id.in_([3, 4])))
+    assert await tasks.delete_files(["media/3.jpg"]) == []
+    assert shard_keys[0] in stored_files
+    await tasks.delete_file({"bucket_key": "media/4.jpg"})
+    assert shard_keys[0] not in stored_files
+    assert await tasks.locate_content("media/4.jpg") == ("media/4.jpg", None)
+
+    # The shard isn't left on the bucket if it can't be registered
+    await fill_table(
+        test_db,
+        db.media,
+        [
+            dict(
+                id=8,
+                type="image",
+                bucket_key="media/8.jpg",
+                status="verified",
+                size_bytes=50,
+                created_at=datetime.utcnow(),
+            )
+        ],
+    )
+    stored_files["media/8.jpg"] = b"\x08" * 50
+
+    async def failing_register_shard(*args):
+        raise RuntimeError("duplicate key value violates unique constraint")
+
+    monkeypatch.setattr(crud.shards, "register_shard", failing_register_shard)
+    with pytest.raises(RuntimeError):
+        await tasks.pack_shards({})
+    assert len([key for key in stored_files if key.startswith("shards/")]) == 1
+    assert "media/8.jpg" in stored_files
+
+
+@pytest.mark.asyncio
+async def test_manage_partitions(init_test_db, test_db, monkeypatch):
+    assert crud.partitions.shift_month(date(2020, 11, 1), 2) == date(2021, 1, 1)
+    assert crud.partitions.shift_month(date(2020, 1, 1), -1) == date(2019, 12, 1)
+    monkeypatch.setattr(crud.partitions, "database", test_db)
+    # The media of October 2020 are moved from the default partition to their own
+    await crud.partitions.create_partition(db.media, date(2020, 10, 1))
+    assert await test_db.fetch_val("SELECT COUNT(*) FROM media_2020_10") == len(MEDIA_TABLE)
+    assert await test_db.fetch_val("SELECT COUNT(*) FROM media_default") == 0
+    assert len(await crud.fetch_all(db.media)) == len(MEDIA_TABLE)
+    await crud.partitions.create_partition(db.media, date(2020, 1, 1))
+    monkeypatch.setattr(cfg, "PARTITION_PREMAKE_MONTHS", 2)
+    monkeypatch.setattr(cfg, "PARTITION_RETENTION_MONTHS", 12)
+    monkeypatch.setattr(cfg, "PARTITION_ARCHIVE_SCHEMA", "test_archive")
+
+    await tasks.manage_partitions({})
+    this_month = datetime.utcnow().date().replace(day=1)
+    for table in (db.media, db.annotations):
+        partitions = await crud.partitions.fetch_partitions(table)
+        assert all(crud.partitions.shift_month(this_month, offset) in partitions for offset in range(3))
+    # Past the retention period
+    assert date(2020, 1, 1) not in await crud.partitions.fetch_partitions(db.media)
+    assert await test_db.fetch_val("SELECT to_regclass('test_archive.media_2020_10') IS NOT NULL")
+    # Transparent to the CRUD layer
+    entry = await crud.create_entry(db.media, MediaIn())
+    assert (await crud.get_entry(db.media, entry["id"]))["created_at"].date() >= this_month
+    assert len(await crud.fetch_all(db.media)) == 1
+    await test_db.execute("DROP SCHEMA test_archive CASCADE")
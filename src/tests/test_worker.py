@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+
+from app import db, worker
+from app.api import crud, tasks
+from app.services import s3_bucket
+from tests.db_utils import fill_table, get_entry
+from tests.utils import update_only_datetime
+
+MEDIA_TABLE = [
+    {"id": 1, "type": "image", "bucket_key": "media/used.jpg", "created_at": "2020-10-13T08:18:45.447773"},
+]
+
+MEDIA_TABLE_FOR_DB = list(map(update_only_datetime, MEDIA_TABLE))
+
+
+@pytest_asyncio.fixture(scope="function")
+async def init_test_db(monkeypatch, test_db):
+    monkeypatch.setattr(crud.base, "database", test_db)
+    monkeypatch.setattr(crud.jobs, "database", test_db)
+    monkeypatch.setattr(crud.media, "database", test_db)
+    monkeypatch.setattr(crud.shards, "database", test_db)
+    monkeypatch.setattr(tasks, "database", test_db)
+    monkeypatch.setattr(worker, "database", test_db)
+    monkeypatch.setattr(tasks.bucket_throttle, "rate", 0)
+    await fill_table(test_db, db.media, MEDIA_TABLE_FOR_DB)
+
+
+@pytest.mark.asyncio
+async def test_process_deletions(init_test_db, test_db, monkeypatch):
+    requests = []
+
+    async def mock_delete_files(bucket_keys):
+        requests.append(sorted(bucket_keys))
+        return ["media/locked.jpg"]
+
+    monkeypatch.setattr(s3_bucket, "delete_files", mock_delete_files)
+    keys = ["media/unused.jpg", "media/used.jpg", "media/locked.jpg"]
+    await crud.jobs.enqueue_many(db.jobs, db.JobKind.delete_file, [{"bucket_key": key} for key in keys])
+
+    assert await worker.process_deletions() == 3
+    # A single bucket request, without the referenced key (thumbnails are removed along with their media)
+    assert requests == [["media/locked.jpg", "media/unused.jpg", "thumbnails/locked.jpg", "thumbnails/unused.jpg"]]
+    statuses = [(await get_entry(test_db, db.jobs, job_id))["status"] for job_id in range(1, 4)]
+    assert statuses == ["done", "done", "pending"]
+    # Nothing left to do until the retry
+    assert await worker.process_deletions() == 0
+
+
+@pytest.mark.asyncio
+async def test_schedule_periodic_jobs(init_test_db, test_db):
+    await worker.schedule_periodic_jobs()
+    scheduled = await crud.fetch_all(db.jobs)
+    assert {job["kind"] for job in scheduled} >= {db.JobKind.scan_orphans, db.JobKind.manage_partitions}
+    # Not due anymore
+    await worker.schedule_periodic_jobs()
+    assert len(await crud.fetch_all(db.jobs)) == len(scheduled)
+
+
+@pytest.mark.asyncio
+async def test_scan_orphans(init_test_db, test_db, monkeypatch):
+    old_ts = datetime.now(timezone.utc) - timedelta(days=2)
+
+    async def mock_list_files(prefix, continuation_token=None):
+        if continuation_token is None:
+            return [
+                {"Key": "media/used.jpg", "LastModified": old_ts},
+                {"Key": "media/orphan.jpg", "LastModified": old_ts},
+                {"Key": "media/uploading.jpg", "LastModified": datetime.now(timezone.utc)},
+            ], "next_page"
+        return [], None
+
+    monkeypatch.setattr(s3_bucket, "list_files", mock_list_files)
+    await tasks.scan_orphans({"prefix": "media/"})
+    pending_jobs = await crud.fetch_all(db.jobs)
+    assert [(job["kind"], job["payload"]) for job in pending_jobs] == [
+        (db.JobKind.delete_file, {"bucket_key": "media/orphan.jpg"}),
+        (db.JobKind.scan_orphans, {"prefix": "media/", "continuation_token": "next_page"}),
+    ]
@@ -12,6 +12,8 @@ def update_only_datetime(entity_as_dict):
         to_return["start_ts"] = parse_time(to_return["start_ts"])
     if isinstance(to_return.get("end_ts"), str):
         to_return["end_ts"] = parse_time(to_return["end_ts"])
+    if isinstance(to_return.get("captured_at"), str):
+        to_return["captured_at"] = datetime.fromisoformat(to_return["captured_at"])
     return to_return
 
 